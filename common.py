@@ -1,6 +1,6 @@
 """Common utils
 """
-import os, sys, shutil, fnmatch
+import os
 
 
 # Return ["top level path to root google3", "relative path after that"
@@ -2,232 +2,1720 @@
 """A cpp parser that currently parse class name and function def
 """
 
-import re, unittest
+import array, bisect, mmap, os, re
 
-COMMON_EXCLUDE_PAIRS = [("{", "}"), ("(", ")"), ("<", ">")]
+import instrument
+
+# Increase whenever parse results change, as cached results depend on it
+PARSER_VERSION = 13
+
+COMMON_EXCLUDE_PAIRS = (("{", "}"), ("(", ")"), ("<", ">"))
+# Spans Parser.find_top_level looks outside of
+TOP_LEVEL_PAIRS = (("{", "}"), ("<", ">"))
 
 DEBUG = False
 
+# Environment variable to let Parser use NumPy, when it is installed, for
+# StructuralScan. It is off by default as the token scan measured faster.
+NUMPY_ENV = "CPP_REFACTOR_NUMPY"
+USE_NUMPY = os.environ.get(NUMPY_ENV) == "1"
+# With fewer tokens, setting up the arrays costs more than the Python scan
+STRUCTURAL_SCAN_MIN_TOKENS = 2048
+
+# Environment variable for the engine parse_functions uses on class bodies.
+# By default lines of simple declarations are matched by regular expressions
+# and only the others are left to Parser. "0" leaves every line to Parser,
+# and "check" runs both engines and raises if their results differ.
+FAST_PATH_ENV = "CPP_REFACTOR_FAST_PATH"
+FAST_PATH = os.environ.get(FAST_PATH_ENV, "1")
+
+# Token kinds, equal to the group index in _TOKEN_RE
+TOKEN_COMMENT = 1
+TOKEN_LITERAL = 2
+TOKEN_CODE = 3
+
+# Line kinds, used to find the comment block right before a found target
+LINE_CODE = 0
+LINE_COMMENT = 1  # the line only holds comments
+LINE_BLANK = 2
+
+# A raw string is matched up to its "(" only, the lexer finds its end
+_TOKEN_PATTERN = r"""
+    (//.*|/\*.*?(?:\*/|$))
+  | ((?:u8|[uUL])?R"[^()\\\s"]{0,16}\(
+     |"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)
+  | ([A-Za-z_]\w*|\d[\w'.]*|::|<<|->|\S)
+"""
+# Braces, semicolons and what can hide them, for ScopeTree
+_SCOPE_PATTERN = r"""
+    (//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?:u8|[uUL])?R"([^()\\\s"]{0,16})\(.*?\)\2"
+  | "(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?|\d[\w'.]*
+  | ([{};])
+"""
+# Code right before the "{" of a namespace or an extern "C" block
+_NAMESPACE_OPEN_PATTERN = (
+    r'(?:\bnamespace(?:\s+([\w:]+))?|\bextern\s*"C\+*")\s*$')
+# The last class key before a "{", and whether it is an enum
+_CLASS_KEY_PATTERN = r"\b(enum\s+)?(?:class|struct|union)\b"
+# Keywords parse_classes looks for
+_CLASS_KEYS = ("class", "struct")
+# Labels that can be written on the line of a declaration, before its words
+_ACCESS_LABELS = ("public:", "protected:", "private:")
+# A class body line declaring one function, without brackets in its words or
+# suffix, nor comments or literals before the trailing comment
+_SIMPLE_DECL_PATTERN = r"""^([^(){}\[\];"'/\\\#]*)
+  (\([^()\[\];"'/\\\#]*\))
+  ([^(){}\[\];"'/\\\#<>]*);\s*(?://.*)?$"""
+# A class body line without functions: blank, a comment, an access label or a
+# statement without brackets
+_NO_FUNCTION_PATTERN = r"""^\s*(?:(?:public|protected|private)\s*:\s*
+  |[^(){}\[\];"'/\\\#]*;\s*)?(?://.*)?$"""
+# Brackets, semicolons and what can hide them on one line, lexed like
+# _TOKEN_RE does, for the lines the fast path leaves to Parser
+_LINE_SCAN_PATTERN = r"""
+    (//.*|/\*.*?(?:\*/|$))
+  | ((?:u8|[uUL])?R"[^()\\\s"]{0,16}\()
+  | ("(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)
+  | ([{}()\[\];])
+  | ([A-Za-z_]\w*|\d[\w'.]*|\S)
+"""
+# What _split_sig leaves to _parse_sig: other brackets, comments, literals,
+# tokens with "<" or ">" and "<" that BracketIndex does not take as a template
+# bracket, ie. after a number
+_SIG_REJECT_PATTERN = r"""[()\[\];"'/\\\#\n]|<<|->|operator
+  |(?:^|[^\w\s]|\b\d\w*)\s*<"""
+# Compiled by _compile_regexes before the first lexing rather than at import
+_TOKEN_RE = None
+_SCOPE_RE = None
+_NAMESPACE_OPEN_RE = None
+_CLASS_KEY_RE = None
+_SIMPLE_DECL_RE = None
+_NO_FUNCTION_RE = None
+_LINE_SCAN_RE = None
+_SIG_REJECT_RE = None
+_SIG_SPLIT_RE = None
+_BLOCK_COMMENT_END = "*/"
+_COMMENT_OPENERS = ("/*", "//")
+
+# Brackets tracked by BracketIndex, mapped to their other half
+_BRACKET_OPENERS = {"(": ")", "[": "]", "{": "}", "<": ">"}
+_BRACKET_CLOSERS = {")": "(", "]": "[", "}": "{"}
+
+
+def _compile_regexes():
+  global _TOKEN_RE, _SCOPE_RE, _NAMESPACE_OPEN_RE, _CLASS_KEY_RE
+  global _SIMPLE_DECL_RE, _NO_FUNCTION_RE, _LINE_SCAN_RE, _SIG_REJECT_RE
+  global _SIG_SPLIT_RE
+  _TOKEN_RE = re.compile(_TOKEN_PATTERN, re.VERBOSE)
+  _SCOPE_RE = re.compile(_SCOPE_PATTERN, re.VERBOSE | re.DOTALL)
+  _NAMESPACE_OPEN_RE = re.compile(_NAMESPACE_OPEN_PATTERN)
+  _CLASS_KEY_RE = re.compile(_CLASS_KEY_PATTERN)
+  _SIMPLE_DECL_RE = re.compile(_SIMPLE_DECL_PATTERN, re.VERBOSE)
+  _NO_FUNCTION_RE = re.compile(_NO_FUNCTION_PATTERN, re.VERBOSE)
+  _LINE_SCAN_RE = re.compile(_LINE_SCAN_PATTERN, re.VERBOSE)
+  _SIG_REJECT_RE = re.compile(_SIG_REJECT_PATTERN, re.VERBOSE)
+  _SIG_SPLIT_RE = re.compile(r"[<>,={]")
+
+
+def _is_open_block_comment(text):
+  return text.startswith("/*") and (len(text) < 4 or not text.endswith("*/"))
+
+
+# Appends tokens of line i, the text between two offsets of source, which is
+# a string or mmap. open_end is None, or the text ending the block comment or
+# raw string left open by the lines before. Returns [open_end, line_kind]
+# after this line.
+def _lex_line(source, i, line_start, line_end, open_end, append):
+  if open_end is None:
+    return _lex_tokens(source, i, line_start, line_start, line_end, LINE_BLANK,
+                       append)
+  kind = TOKEN_COMMENT if open_end == _BLOCK_COMMENT_END else TOKEN_LITERAL
+  end = source.find(open_end, line_start, line_end)
+  if end < 0:
+    text = source[line_start:line_end].rstrip("\n")
+    if kind == TOKEN_LITERAL:
+      if text != "":
+        append((i, 0, text, kind))
+      return [open_end, LINE_CODE]
+    if text.strip() != "":
+      append((i, 0, text, kind))
+      return [open_end, LINE_COMMENT]
+    return [open_end, LINE_BLANK]
+  start = end + len(open_end)
+  append((i, 0, source[line_start:start], kind))
+  line_kind = LINE_CODE if kind == TOKEN_LITERAL else LINE_COMMENT
+  return _lex_tokens(source, i, line_start, start, line_end, line_kind, append)
+
+
+# Lexes line i from offset start, with line_kind so far. Returns like
+# _lex_line.
+def _lex_tokens(source, i, line_start, start, line_end, line_kind, append):
+  last = None
+  for m in _TOKEN_RE.finditer(source, start, line_end):
+    kind = m.lastindex
+    text = m.group(kind)
+    if kind == TOKEN_LITERAL and text[-1] == "(" and text[0] not in "\"'":
+      # raw string, which may end further on this line or on a later one
+      closer = ")" + text[text.index('"') + 1:-1] + '"'
+      end = source.find(closer, m.end(), line_end)
+      if end < 0:
+        append((i, m.start() - line_start,
+                source[m.start():line_end].rstrip("\n"), kind))
+        return [closer, LINE_CODE]
+      end += len(closer)
+      append((i, m.start() - line_start, source[m.start():end], kind))
+      return _lex_tokens(source, i, line_start, end, line_end, LINE_CODE,
+                         append)
+    last = (i, m.start() - line_start, text, kind)
+    append(last)
+    if kind != TOKEN_COMMENT:
+      line_kind = LINE_CODE
+    elif line_kind == LINE_BLANK:
+      line_kind = LINE_COMMENT
+  if (last is not None and last[3] == TOKEN_COMMENT and
+      _is_open_block_comment(last[2])):
+    return [_BLOCK_COMMENT_END, line_kind]
+  return [None, line_kind]
+
+
+# Returns the offset of every line start in text, plus len(text) at the end
+def _line_offsets(text):
+  offsets = array.array("l", [0])
+  find = text.find
+  i = find("\n")
+  while i >= 0:
+    offsets.append(i + 1)
+    i = find("\n", i + 1)
+  if offsets[-1] != len(text):
+    offsets.append(len(text))
+  return offsets
+
+
+class SourceBuffer(object):
+  """A file held as one string (or mmap) plus a table of line start offsets.
+
+  It acts as a read only list of lines, which are only materialized when
+  indexed. Slicing it or calling view() gives a buffer on part of the text
+  that shares both the string and the offset table, so classes and functions
+  can refer to spans of the file without copying their lines.
+  """
+
+  def __init__(self, text, line_offsets=None, first_line=0, num_lines=None,
+               start=0, end=None):
+    self.text = text
+    if line_offsets is None:
+      line_offsets = _line_offsets(text)
+    self._line_offsets = line_offsets
+    # index of the first line of this buffer in _line_offsets
+    self._first_line = first_line
+    if num_lines is None:
+      num_lines = len(line_offsets) - 1 - first_line
+    self._num_lines = num_lines
+    # offsets of the text in this buffer, which may cut the first and last line
+    self.start = start
+    self.end = len(text) if end is None else end
+
+  @classmethod
+  def from_lines(cls, lines):
+    return cls("".join(lines))
+
+  # Returns a buffer on a read only mmap of the file, which stays open until
+  # the buffer is garbage collected
+  @classmethod
+  def from_file(cls, path):
+    with open(path, "rb") as fin:
+      if os.fstat(fin.fileno()).st_size == 0:
+        return cls("")
+      return cls(mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ))
+
+  # Returns a buffer of one line, even if text has newlines
+  @classmethod
+  def single_line(cls, text):
+    return cls(text, [0, len(text)])
+
+  def __len__(self):
+    return self._num_lines
+
+  # Returns the [start, end) offsets of line i
+  def line_range(self, i):
+    k = self._first_line + i
+    return (max(self.start, self._line_offsets[k]),
+            min(self.end, self._line_offsets[k + 1]))
+
+  def line(self, i):
+    if i < 0:
+      i += self._num_lines
+    if i < 0 or i >= self._num_lines:
+      raise IndexError("line index out of range")
+    start, end = self.line_range(i)
+    return self.text[start:end]
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start_i, end_i, step = index.indices(self._num_lines)
+      assert step == 1, "Only continuous lines can be sliced"
+      if start_i >= end_i:
+        return SourceBuffer(self.text, self._line_offsets,
+                            self._first_line + start_i, 0, self.start,
+                            self.start)
+      return SourceBuffer(self.text, self._line_offsets,
+                          self._first_line + start_i, end_i - start_i,
+                          self.line_range(start_i)[0],
+                          self.line_range(end_i - 1)[1])
+    return self.line(index)
+
+  def __iter__(self):
+    for i in range(self._num_lines):
+      yield self.line(i)
+
+  def __eq__(self, other):
+    if isinstance(other, (SourceBuffer, list, tuple)):
+      return list(self) == list(other)
+    return NotImplemented
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    if result is NotImplemented:
+      return result
+    return not result
+
+  def __repr__(self):
+    return "SourceBuffer(%r)" % list(self)
+
+  def offset(self, i, j):
+    return self.line_range(i)[0] + j
+
+  # Returns the (i, j) position of an offset
+  def position(self, offset):
+    k = bisect.bisect_right(self._line_offsets, offset, self._first_line,
+                            self._first_line + self._num_lines) - 1
+    i = k - self._first_line
+    return i, offset - self.line_range(i)[0]
+
+  # including the starting char, excluding end char
+  def substring(self, start_i, start_j, end_i, end_j):
+    return self.text[self.offset(start_i, start_j):self.offset(end_i, end_j)]
+
+  # Returns the buffer of text between the offsets
+  def view(self, start, end):
+    first_i = self.position(start)[0]
+    last_i = self.position(max(start, end - 1))[0]
+    return SourceBuffer(self.text, self._line_offsets,
+                        self._first_line + first_i, last_i - first_i + 1,
+                        start, end)
+
+
+def as_buffer(lines):
+  if isinstance(lines, SourceBuffer):
+    return lines
+  return SourceBuffer.from_lines(lines)
+
+
+class Lexer(object):
+  """Turns lines into a token stream once, so that searches skip char work.
+
+  Every token is a tuple (i, j, text, kind), where (i, j) is the line and
+  column of its first char. Identifiers, numbers, "::", "<<", "->" and single
+  punctuation chars are TOKEN_CODE. A block comment spanning several lines
+  gives one TOKEN_COMMENT per line. String, char and raw string literals are
+  TOKEN_LITERAL, one per line as well for a raw string spanning lines.
+  """
+
+  def __init__(self, lines):
+    self.buffer = as_buffer(lines)
+    self.tokens = []
+    # line_start[i] is the index of the first token on or after line i
+    self.line_start = []
+    self.line_kinds = []
+    # comment_above[i] is the first line of the comment only lines right
+    # above line i, or -1
+    self.comment_above = array.array("l")
+    # line -> index of its first comment token, filled as lines are asked for
+    self._first_comment = {}
+    self._masked = {}
+    self._lex(self.buffer)
+    if instrument.counters is not None:
+      instrument.counters["lex_tokens"] += len(self.tokens)
+
+  def _lex(self, buffer):
+    if _TOKEN_RE is None:
+      _compile_regexes()
+    instrument.add("lex_chars", buffer.end - buffer.start)
+    source = buffer.text
+    tokens = self.tokens
+    append = tokens.append
+    open_end = None
+    offsets = buffer._line_offsets
+    first_line = buffer._first_line
+    last_i = len(buffer) - 1
+    for i in range(last_i + 1):
+      line_start = offsets[first_line + i]
+      line_end = offsets[first_line + i + 1]
+      if i == 0:
+        line_start = max(line_start, buffer.start)
+      if i == last_i:
+        line_end = min(line_end, buffer.end)
+      self.line_start.append(len(tokens))
+      open_end, line_kind = _lex_line(source, i, line_start, line_end,
+                                      open_end, append)
+      self.line_kinds.append(line_kind)
+    self.line_start.append(len(tokens))
+
+    above = -1
+    for i, line_kind in enumerate(self.line_kinds):
+      self.comment_above.append(above)
+      if line_kind != LINE_COMMENT:
+        above = -1
+      elif above < 0:
+        above = i
+
+  # Returns the first line of the comment block right before token k, which
+  # is either a comment on the same line or comment only lines above it
+  def comment_start(self, k):
+    i = self.tokens[k][0]
+    first_k = self._first_comment.get(i)
+    if first_k is None:
+      first_k = self.line_start[i + 1]
+      for each_k in range(self.line_start[i], first_k):
+        if self.tokens[each_k][3] == TOKEN_COMMENT:
+          first_k = each_k
+          break
+      self._first_comment[i] = first_k
+    if first_k < k:
+      return i
+    if self.comment_above[i] < 0:
+      return None
+    return self.comment_above[i]
+
+  def masked(self, literals=True):
+    """Returns a SourceBuffer of the lexed lines with comments, and literals
+    unless literals is False, replaced by spaces. Lines and columns stay the
+    same, so positions of tokens can be used on it. It is built once."""
+    masked = self._masked.get(literals)
+    if masked is not None:
+      return masked
+    buffer = self.buffer
+    text = buffer.text
+    pieces = []
+    pos = buffer.start
+    offsets = buffer._line_offsets
+    first_line = buffer._first_line
+    for (i, j, token_text, kind) in self.tokens:
+      if kind == TOKEN_CODE or (kind == TOKEN_LITERAL and not literals):
+        continue
+      # buffer.offset(i, j), inlined
+      offset = (offsets[first_line + i] if i > 0 else buffer.start) + j
+      pieces.append(text[pos:offset])
+      pieces.append(" " * len(token_text))
+      pos = offset + len(token_text)
+    pieces.append(text[pos:buffer.end])
+    masked = SourceBuffer("".join(pieces))
+    self._masked[literals] = masked
+    return masked
+
+
+class BracketIndex(object):
+  """Matches every opener token to its closer in one pass over the tokens.
+
+  match[k] is the index of the token paired with token k, or -1. It pairs
+  (), [], {}, the "<" ">" of templates and the pieces of block comments that
+  span several lines. A "<" is a template bracket only if it follows an
+  identifier and a ">" closes it before any ";", "{", "}" or a closer of an
+  outer bracket, otherwise it is the less-than operator and stays -1.
+  """
+
+  def __init__(self, tokens):
+    self.match = [-1] * len(tokens)
+    # [opener, closer] of every template bracket pair
+    self.angles = []
+    self._index(tokens)
+    instrument.add("bracket_index_tokens", len(tokens))
+
+  def _pair(self, opener_k, closer_k):
+    self.match[opener_k] = closer_k
+    self.match[closer_k] = opener_k
+
+  def _index(self, tokens):
+    stack = []
+    # tokens on the stack that are "<", as candidates of template brackets
+    angles = 0
+    prev_text = ""
+    comment_k = -1
+    for k, (i, j, text, kind) in enumerate(tokens):
+      if kind == TOKEN_COMMENT:
+        if comment_k < 0:
+          if _is_open_block_comment(text):
+            comment_k = k
+        elif text.endswith("*/"):
+          self._pair(comment_k, k)
+          comment_k = -1
+        continue
+      if comment_k >= 0:
+        # block comment not closed, ie. the lines ended inside of it
+        comment_k = -1
+      if kind != TOKEN_CODE:
+        prev_text = text
+        continue
+
+      if text == "<":
+        if ((prev_text[:1].isalpha() or prev_text[:1] == "_") and
+            prev_text != "operator"):
+          stack.append(k)
+          angles += 1
+      elif text == ">":
+        if angles > 0 and tokens[stack[-1]][2] == "<":
+          self.angles.append([stack[-1], k])
+          self._pair(stack.pop(), k)
+          angles -= 1
+      elif text in _BRACKET_CLOSERS or text in ";{":
+        # these never show up in template arguments
+        while angles > 0 and tokens[stack[-1]][2] == "<":
+          stack.pop()
+          angles -= 1
+        if text == "{":
+          stack.append(k)
+        elif text != ";":
+          opener = _BRACKET_CLOSERS[text]
+          for depth in range(len(stack) - 1, -1, -1):
+            if tokens[stack[depth]][2] == opener:
+              # openers above the match are left unmatched
+              angles -= sum(1 for each_k in stack[depth + 1:]
+                            if tokens[each_k][2] == "<")
+              self._pair(stack[depth], k)
+              del stack[depth:]
+              break
+      elif text in _BRACKET_OPENERS:
+        stack.append(k)
+      prev_text = text
+
+
+# numpy once imported by _import_numpy, False if it is not installed
+_numpy = None
+
+
+def _import_numpy():
+  global _numpy
+  if _numpy is None:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = False
+  return _numpy or None
+
+
+class StructuralScan(object):
+  """The depth of every char in {} and template <> spans, computed in bulk
+  with NumPy on the masked text of a Parser.
+
+  The masked text is loaded as a uint8 array and the depth is a cumulative
+  sum of its braces and of the template brackets that BracketIndex paired.
+  find() answers a Parser.find of one char outside of those spans with a
+  binary search in the offsets of that char at depth 0. That equals the
+  token by token scan as long as braces balance, which balanced tells, and
+  the search starts at depth 0.
+  """
+
+  def __init__(self, numpy, masked, angles):
+    self.numpy = numpy
+    self.chars = numpy.frombuffer(masked.text, dtype=numpy.uint8)
+    delta = (self.chars == ord("{")).astype(numpy.int32)
+    delta -= self.chars == ord("}")
+    brace_depth = numpy.cumsum(delta)
+    self.balanced = (len(delta) == 0 or
+                     (brace_depth[-1] == 0 and brace_depth.min() >= 0))
+    if len(angles) > 0:
+      angles = numpy.array(angles, dtype=numpy.intp)
+      delta[angles[:, 0]] += 1
+      delta[angles[:, 1]] -= 1
+    # spans open right before each char
+    self.depth = numpy.cumsum(delta) - delta
+    self._positions = {}
+
+  # Returns the offset of the first char from start at depth 0, None if
+  # there is none
+  def find(self, char, start):
+    numpy = self.numpy
+    positions = self._positions.get(char)
+    if positions is None:
+      positions = numpy.flatnonzero((self.chars == ord(char)) &
+                                    (self.depth == 0))
+      self._positions[char] = positions
+    m = numpy.searchsorted(positions, start)
+    if m == len(positions):
+      return None
+    return int(positions[m])
+
+
+_TARGET_CACHE = {}
+
+
+# Returns the texts of code tokens a target is made of, ie. "public:" gives
+# ("public", ":")
+def _lex_target(target):
+  texts = _TARGET_CACHE.get(target)
+  if texts is None:
+    texts = tuple(token[2] for token in Lexer([target]).tokens)
+    assert len(texts) > 0, "Empty target"
+    _TARGET_CACHE[target] = texts
+  return texts
+
+
+_EXCLUDE_ACTIONS_CACHE = {}
+
+
+# Maps token text to (True, closer) for openers and (False, closer) for
+# closers. Like a scan in pair order, the first pair mentioning a text wins.
+def _exclude_actions(exclude_pairs):
+  try:
+    return _EXCLUDE_ACTIONS_CACHE[exclude_pairs]
+  except (KeyError, TypeError):
+    pass
+  cache_key = tuple(tuple(each_pair) for each_pair in exclude_pairs)
+  actions = _EXCLUDE_ACTIONS_CACHE.get(cache_key)
+  if actions is not None:
+    return actions
+  actions = {}
+  for opener, closer in cache_key:
+    if opener not in actions:
+      actions[opener] = (True, closer)
+    if closer not in actions:
+      actions[closer] = (False, closer)
+  _EXCLUDE_ACTIONS_CACHE[cache_key] = actions
+  return actions
+
 
 # NOte: cannot find "<<" as it will be skipped
 class Parser(object):
 
   def __init__(self, lines):
-    self.lines = lines
+    self.lines = as_buffer(lines)
+    self.lexer = Lexer(self.lines)
+    self._brackets = None
+    # StructuralScan, False if it cannot be used
+    self._scan = None
     self.next_i = 0
     self.next_j = 0
+    # index of the next token to scan, None if it needs to be computed
+    self.next_k = 0
     self.comment_i = None
 
+  @property
+  def brackets(self):
+    if self._brackets is None:
+      self._brackets = BracketIndex(self.lexer.tokens)
+    return self._brackets
+
   def set_start_pos(self, i, j):
+    if i == self.next_i and j == self.next_j:
+      return
     self.next_i = i
     self.next_j = j
+    self.next_k = None
 
-  def _check_exclude(self, line, index, excluding, exclude_pairs):
-    for each_exclude_pair in exclude_pairs:
-      chars = line[index:index + len(each_exclude_pair[0])]
-      if chars == each_exclude_pair[0]:
-        excluding.append(each_exclude_pair)
-        return 1
-      chars = line[index:index + len(each_exclude_pair[1])]
-      if chars == each_exclude_pair[1]:
-        # last element in excluding must match
-        # For "\n" we need special handle as unlike others, it is not a real
-        # pair with "//", every newline will hit here
-        if len(excluding) > 0 and excluding[-1][1] == chars:
-          excluding.pop()
-          return 2
-        return 0
-    return 0
+  def _start_index(self):
+    if self.next_k is not None:
+      return self.next_k
+    lexer = self.lexer
+    if self.next_i >= len(self.lines):
+      return len(lexer.tokens)
+    k = lexer.line_start[self.next_i]
+    end = lexer.line_start[self.next_i + 1]
+    while k < end and lexer.tokens[k][1] < self.next_j:
+      k += 1
+    return k
+
+  # Whether tokens from k on spell all texts of target without gaps
+  def _match_at(self, k, target):
+    tokens = self.lexer.tokens
+    if k + len(target) > len(tokens):
+      return False
+    i, j, text, kind = tokens[k]
+    end_j = j + len(text)
+    for m in range(1, len(target)):
+      next_i, next_j, next_text, next_kind = tokens[k + m]
+      if (next_kind != TOKEN_CODE or next_i != i or next_j != end_j or
+          next_text != target[m]):
+        return False
+      end_j += len(next_text)
+    return True
 
   # Get all string with comments with no space line before the target
-  def find(self, targets, exclude_pairs=[]):
+  def find(self, targets, exclude_pairs=()):
     if isinstance(targets, basestring):
       targets = [targets]
-    total_len = len(self.lines)
+    targets = [_lex_target(target) for target in targets]
+    first_texts = set(target[0] for target in targets)
+    actions = _exclude_actions(exclude_pairs)
+    tokens = self.lexer.tokens
+    total_tokens = len(tokens)
+    match = self.brackets.match if len(actions) > 0 else None
     excluding = list()
+    pushes = 0
 
-    comment_on = False
-    comment_i = None
-    comment_exclude_list = [["/*", "*/"], ["//", "\n"]]
-    for i in range(self.next_i, total_len):
-      curr_line = self.lines[i]
-      if DEBUG:
-        print "curr line: ", targets, excluding, curr_line
-
-      # Handle comments
-      if curr_line.strip().startswith("//"):
-        if comment_i is None:
-          comment_i = i
+    k = self._start_index()
+    start_k = k
+    if DEBUG:
+      print "find: ", targets, "from", self.next_i, self.next_j
+    while k < total_tokens:
+      i, j, text, kind = tokens[k]
+      if kind != TOKEN_CODE:
+        k += 1
         continue
 
-      if curr_line.strip() == "":
-        comment_i = None
+      if len(excluding) == 0 and text in first_texts:
+        for target in targets:
+          if target[0] == text and self._match_at(k, target):
+            last_token = tokens[k + len(target) - 1]
+            self.next_i = i
+            self.next_j = last_token[1] + len(last_token[2])
+            self.next_k = k + len(target)
+            self.comment_i = self.lexer.comment_start(k)
+            if instrument.counters is not None:
+              self._record_find(start_k, k, pushes)
+            return [i, j]
 
-      if i == self.next_i:
-        start_j = self.next_j
-      else:
-        start_j = 0
-      j = start_j - 1
-      while j < len(curr_line) - 1:
-        # Increment first to deal with "continue"
-        j += 1
-        if comment_on == False:
-          # process only if it is not comment
-          if j < len(curr_line) - 2 and curr_line[j:j + 3] == "<< ":
-            j += 2
-            continue
-          for target in targets:
-            next_j = j + len(target)
-            if len(excluding) == 0 and curr_line[j:next_j] == target:
-              self.next_i = i
-              self.next_j = next_j
-              self.comment_i = comment_i
-              return [i, j]
-
-          self._check_exclude(curr_line, j, excluding, exclude_pairs)
-          if j == len(curr_line) - 1:
+      action = actions.get(text)
+      if action is not None:
+        if action[0]:
+          closer_k = match[k]
+          if closer_k > k and tokens[closer_k][2] == action[1]:
+            # jump over the whole span
+            k = closer_k + 1
+            pushes += 1
             continue
-        result = self._check_exclude(curr_line, j, excluding,
-                                     comment_exclude_list)
-        if result == 1:
-          comment_on = True
-          comment_i = i
-        elif result == 2:
-          comment_on = False
+          # "<" without a closer is the less-than operator
+          if text != "<":
+            excluding.append(action[1])
+            pushes += 1
+        elif len(excluding) > 0 and excluding[-1] == text:
+          # last element in excluding must match
+          excluding.pop()
+      k += 1
+
+    if instrument.counters is not None:
+      self._record_find(start_k, k, pushes)
+    return None
+
+  def _record_find(self, start_k, end_k, pushes):
+    counters = instrument.counters
+    counters["find_calls"] += 1
+    counters["find_tokens_scanned"] += end_k - start_k
+    counters["find_chars_scanned"] += (
+        self._token_offset(end_k) - self._token_offset(start_k))
+    counters["exclude_pushes"] += pushes
+
+  def _token_offset(self, k):
+    if k >= len(self.lexer.tokens):
+      return self.lines.end
+    return self.lines.offset(self.lexer.tokens[k][0], self.lexer.tokens[k][1])
+
+  def structural_scan(self):
+    """Returns the StructuralScan of the tokens, or None without NumPy, with
+    few tokens or if braces do not balance"""
+    if self._scan is None:
+      self._scan = False
+      numpy = _import_numpy() if USE_NUMPY else None
+      if (numpy is not None and
+          len(self.lexer.tokens) >= STRUCTURAL_SCAN_MIN_TOKENS):
+        scan = StructuralScan(numpy, self.lexer.masked(), [[
+            self._masked_offset(open_k), self._masked_offset(close_k)
+        ] for (open_k, close_k) in self.brackets.angles])
+        if scan.balanced:
+          self._scan = scan
+    return self._scan or None
+
+  # Same as find(char, TOP_LEVEL_PAIRS) for a single char, answered by the
+  # StructuralScan when it can
+  def find_top_level(self, char):
+    scan = self.structural_scan()
+    if scan is None:
+      return self.find(char, TOP_LEVEL_PAIRS)
+    lexer = self.lexer
+    start_k = self._start_index()
+    if start_k >= len(lexer.tokens):
+      return None
+    start = self._masked_offset(start_k)
+    if scan.depth[start] != 0:
+      return self.find(char, TOP_LEVEL_PAIRS)
+    instrument.add("structural_finds")
+    offset = scan.find(char, start)
+    if offset is None:
+      return None
+    i, j = lexer.masked().position(offset)
+    k = lexer.line_start[i]
+    while lexer.tokens[k][1] < j:
+      k += 1
+    self.next_i = i
+    self.next_j = j + 1
+    self.next_k = k + 1
+    self.comment_i = lexer.comment_start(k)
+    return [i, j]
+
+  # Returns the offset of token k in the masked text, which starts at the
+  # start of lines
+  def _masked_offset(self, k):
+    i, j = self.lexer.tokens[k][:2]
+    if i == 0:
+      return j
+    lines = self.lines
+    return lines._line_offsets[lines._first_line + i] - lines.start + j
+
+  # Returns the closer matching the opener just found, and continues after it
+  def find_matching(self):
+    assert self.next_k is not None
+    tokens = self.lexer.tokens
+    closer_k = self.brackets.match[self.next_k - 1]
+    if closer_k < self.next_k:
+      return None
+    i, j, text, kind = tokens[closer_k]
+    self.next_i = i
+    self.next_j = j + len(text)
+    self.next_k = closer_k + 1
+    return [i, j]
+
+
+class StreamScanner(object):
+  """Scans text from a string or mmap one line at a time.
+
+  Unlike Parser, it keeps no token list, so memory does not grow with the
+  file. tokens() is a generator shared by finditer and find_closer, and the
+  comment and nesting state lives in the generators, so a scan resumes right
+  after the previous match. A "<" is a template bracket only if a ">" closes
+  it, as in BracketIndex, which needs to hold back the tokens of at most one
+  statement until it is known.
+  """
 
+  def __init__(self, source, start=0, end=None):
+    self.source = source
+    self.start = start
+    self.end = len(source) if end is None else end
+
+  @classmethod
+  def open(cls, path):
+    return cls(SourceBuffer.from_file(path).text)
+
+  def _raw_tokens(self):
+    if _TOKEN_RE is None:
+      _compile_regexes()
+    source = self.source
+    end = self.end
+    pos = self.start
+    open_end = None
+    line_tokens = []
+    i = 0
+    while pos < end:
+      line_end = source.find("\n", pos, end) + 1
+      if line_end == 0:
+        line_end = end
+      open_end = _lex_line(source, i, pos, line_end, open_end,
+                           line_tokens.append)[0]
+      if instrument.counters is not None:
+        instrument.counters["scanner_chars"] += line_end - pos
+      for token in line_tokens:
+        yield token
+      del line_tokens[:]
+      pos = line_end
+      i += 1
+
+  def tokens(self):
+    """Yields (i, j, text, kind, is_angle), where is_angle tells whether a
+    "<" or ">" is a template bracket"""
+    pending = []
+    # brackets opened since the first pending "<", as [text, pending index]
+    stack = []
+    angles = 0
+    prev_text = ""
+    for (i, j, text, kind) in self._raw_tokens():
+      if kind != TOKEN_CODE:
+        if kind == TOKEN_LITERAL:
+          prev_text = text
+        if len(pending) > 0:
+          pending.append([i, j, text, kind, False])
+        else:
+          yield (i, j, text, kind, False)
+        continue
+
+      is_candidate = (text == "<" and
+                      (prev_text[:1].isalpha() or prev_text[:1] == "_") and
+                      prev_text != "operator")
+      prev_text = text
+      if len(pending) == 0:
+        if not is_candidate:
+          yield (i, j, text, kind, False)
+          continue
+      pending.append([i, j, text, kind, False])
+      if is_candidate:
+        stack.append(["<", len(pending) - 1])
+        angles += 1
+      elif text == ">":
+        if stack[-1][0] == "<":
+          pending[stack.pop()[1]][4] = True
+          pending[-1][4] = True
+          angles -= 1
+      elif text in _BRACKET_CLOSERS or text in (";", "{"):
+        while len(stack) > 0 and stack[-1][0] == "<":
+          stack.pop()
+          angles -= 1
+        if text in _BRACKET_CLOSERS:
+          if len(stack) > 0 and stack[-1][0] == _BRACKET_CLOSERS[text]:
+            stack.pop()
+        elif text == "{" and angles > 0:
+          stack.append([text, None])
+      elif text in ("(", "["):
+        stack.append([text, None])
+
+      if angles == 0:
+        for token in pending:
+          yield tuple(token)
+        del pending[:]
+        del stack[:]
+    for token in pending:
+      yield tuple(token)
+
+  def finditer(self, targets, exclude_pairs=(), tokens=None):
+    """Yields the [i, j] of every target outside of exclude_pairs, like
+    repeated Parser.find calls. Pass tokens to share it with find_closer."""
+    if isinstance(targets, basestring):
+      targets = [targets]
+    targets = [_lex_target(target) for target in targets]
+    first_texts = set(target[0] for target in targets)
+    actions = _exclude_actions(exclude_pairs)
+    if tokens is None:
+      tokens = self.tokens()
+    excluding = []
+    # partial matches of targets with several tokens as
+    # [target, next index, i, j, end column]
+    partials = []
+    for (i, j, text, kind, is_angle) in tokens:
+      if kind != TOKEN_CODE:
+        partials = []
+        continue
+      if len(partials) > 0:
+        matched = []
+        for (target, m, start_i, start_j, end_j) in partials:
+          if i == start_i and j == end_j and target[m] == text:
+            if m + 1 == len(target):
+              yield [start_i, start_j]
+              matched = []
+              break
+            matched.append([target, m + 1, start_i, start_j, j + len(text)])
+        partials = matched
+
+      if len(excluding) == 0 and text in first_texts:
+        for target in targets:
+          if target[0] == text:
+            if len(target) == 1:
+              yield [i, j]
+              break
+            partials.append([target, 1, i, j, j + len(text)])
+
+      action = actions.get(text)
+      if action is None or (text in ("<", ">") and not is_angle):
+        continue
+      if action[0]:
+        excluding.append(action[1])
+      elif len(excluding) > 0 and excluding[-1] == text:
+        excluding.pop()
+
+  # Consumes tokens up to the closer of the opener just returned by tokens,
+  # returns its [i, j] or None
+  def find_closer(self, tokens, opener="{"):
+    closer = _BRACKET_OPENERS[opener]
+    depth = 1
+    for (i, j, text, kind, is_angle) in tokens:
+      if kind != TOKEN_CODE:
+        continue
+      if text == opener and (opener != "<" or is_angle):
+        depth += 1
+      elif text == closer and (closer != ">" or is_angle):
+        depth -= 1
+        if depth == 0:
+          return [i, j]
     return None
 
 
+# Kinds of scopes
+SCOPE_NAMESPACE = 0  # also anonymous namespaces and extern "C" blocks
+SCOPE_CLASS = 1  # class, struct or union
+SCOPE_BLOCK = 2  # function bodies, enums, initializers...
+
+
+# Returns the name of the class opened by the code before a "{", "" if it
+# has none, or None if the code does not open a class
+def _class_head_name(head):
+  m = None
+  for m in _CLASS_KEY_RE.finditer(head):
+    pass
+  if m is None or m.group(1) is not None:
+    return None
+  # up to base classes or template arguments
+  tail = re.split(r"(?<!:):(?!:)|<", head[m.end():], 1)[0]
+  if "(" in tail or "=" in tail:
+    return None
+  names = [
+      name for name in re.findall(r"[A-Za-z_][\w:]*", tail) if name != "final"
+  ]
+  if len(names) == 0:
+    return ""
+  return names[-1]
+
+
+class Scope(object):
+  """A namespace, class or other block, from its "{" to its "}".
+
+  start and end are the offsets of its braces in the text of the ScopeTree
+  buffer, end is the end of the text if it is never closed. path holds the
+  names of the enclosing namespaces and classes and its own, anonymous ones
+  left out, and local is True within an anonymous namespace. head is the
+  offset of the "namespace" or "extern" of a namespace.
+  """
+  __slots__ = ("kind", "name", "path", "local", "start", "end", "head",
+               "parent")
+
+  def __init__(self, kind, name, start, parent, head=None, local=False):
+    self.kind = kind
+    self.name = name
+    self.start = start
+    self.end = None
+    self.head = head
+    self.parent = parent
+    self.path = () if parent is None else parent.path
+    self.local = local or (parent is not None and parent.local)
+    if name and kind != SCOPE_BLOCK:
+      self.path = self.path + tuple(name.split("::"))
+
+  def __repr__(self):
+    return "Scope(%d, %r, %r, %r)" % (self.kind, "::".join(self.path),
+                                      self.start, self.end)
+
+
+# Whether the rest of a line after a "}" leaves nothing open for the next line
+def _ends_line(rest):
+  rest = rest.strip()
+  if rest.startswith(";"):
+    rest = rest[1:].lstrip()
+  return rest == "" or (rest.startswith("//") and not rest.endswith("\\"))
+
+
+class ScopeTree(object):
+  """The namespaces, classes and blocks of a file, found in one regex pass
+  over braces, semicolons, comments and literals, which is much faster than
+  lexing.
+
+  scopes are in the order of their "{", so a scope comes after the scopes
+  enclosing it. balanced is False if braces do not balance, as preprocessor
+  branches can make them.
+  """
+
+  def __init__(self, lines):
+    if _SCOPE_RE is None:
+      _compile_regexes()
+    self.buffer = as_buffer(lines)
+    self.scopes = []
+    self.balanced = True
+    self._starts = []
+    self._without_namespaces = None
+    self._build()
+
+  def _build(self):
+    buffer = self.buffer
+    text = buffer.text
+    scopes = self.scopes
+    scope = None
+    # code since the last brace or semicolon, comments replaced by a space
+    head = []
+    head_start = buffer.start
+    prev_end = buffer.start
+    for m in _SCOPE_RE.finditer(text, buffer.start, buffer.end):
+      head.append(text[prev_end:m.start()])
+      prev_end = m.end()
+      char = m.group(3)
+      if char is None:
+        head.append(" " if m.group(1) is not None else m.group())
+        continue
+      if char == "{":
+        code = "".join(head)
+        namespace = _NAMESPACE_OPEN_RE.search(code)
+        if namespace is not None:
+          keyword = "namespace" if code[namespace.start()] == "n" else "extern"
+          scope = Scope(SCOPE_NAMESPACE, namespace.group(1) or "", m.start(),
+                        scope, text.rfind(keyword, head_start, m.start()),
+                        keyword == "namespace" and namespace.group(1) is None)
+        else:
+          name = _class_head_name(code)
+          if name is None:
+            scope = Scope(SCOPE_BLOCK, "", m.start(), scope)
+          else:
+            scope = Scope(SCOPE_CLASS, name, m.start(), scope)
+        scopes.append(scope)
+        self._starts.append(m.start())
+      elif char == "}":
+        if scope is None:
+          self.balanced = False
+        else:
+          scope.end = m.start()
+          scope = scope.parent
+      del head[:]
+      head_start = m.end()
+    while scope is not None:
+      self.balanced = False
+      scope.end = buffer.end
+      scope = scope.parent
+
+  # Returns the innermost scope holding offset between its braces, or None
+  def scope_at(self, offset):
+    k = bisect.bisect_left(self._starts, offset) - 1
+    if k < 0:
+      return None
+    scope = self.scopes[k]
+    while scope is not None and scope.end <= offset:
+      scope = scope.parent
+    return scope
+
+  # Returns the names of the namespaces and classes enclosing offset
+  def path_at(self, offset):
+    scope = self.scope_at(offset)
+    if scope is None:
+      return ()
+    return scope.path
+
+  def splits(self):
+    """Returns [line, path] right after each block closed at the top level or
+    right inside namespaces, ie. after a class or a function. Parts of the
+    file cut there parse on their own, within the namespaces of path. Only
+    lines after a "}" with at most a ";" and a line comment after it are
+    split, so that no code or open comment is carried over."""
+    buffer = self.buffer
+    result = []
+    for scope in self.scopes:
+      if scope.kind == SCOPE_NAMESPACE or (scope.parent is not None and
+                                          scope.parent.kind != SCOPE_NAMESPACE):
+        continue
+      if scope.end >= buffer.end:
+        continue
+      split_i = buffer.position(scope.end)[0] + 1
+      if not _ends_line(buffer.text[scope.end + 1:buffer.line_range(
+          split_i - 1)[1]]):
+        continue
+      if split_i < len(buffer) and (len(result) == 0 or
+                                    result[-1][0] != split_i):
+        path = () if scope.parent is None else scope.parent.path
+        result.append([split_i, path])
+    return result
+
+  def without_namespaces(self):
+    """Returns a SourceBuffer of the text with the heads and braces of
+    namespaces replaced by spaces, so that a Parser skipping blocks still
+    finds what namespaces hold. Lines and columns stay the same."""
+    if self._without_namespaces is not None:
+      return self._without_namespaces
+    buffer = self.buffer
+    text = buffer.text
+    spans = []
+    for scope in self.scopes:
+      if scope.kind == SCOPE_NAMESPACE:
+        spans.append([scope.head, scope.start + 1])
+        if scope.end < buffer.end:
+          spans.append([scope.end, scope.end + 1])
+    spans.sort()
+    pieces = []
+    pos = buffer.start
+    for (start, end) in spans:
+      pieces.append(text[pos:start])
+      pieces.append(re.sub(r"[^\n]", " ", text[start:end]))
+      pos = end
+    pieces.append(text[pos:buffer.end])
+    self._without_namespaces = SourceBuffer("".join(pieces))
+    return self._without_namespaces
+
+
+# Returns the length of the common prefix of a and b, or of their common
+# suffix if reverse, with a binary search over slice compares
+def _common_length(a, b, reverse=False):
+  low = 0
+  high = min(len(a), len(b))
+  while low < high:
+    mid = (low + high + 1) // 2
+    if reverse:
+      same = a[len(a) - mid:] == b[len(b) - mid:]
+    else:
+      same = a[:mid] == b[:mid]
+    if same:
+      low = mid
+    else:
+      high = mid - 1
+  return low
+
+
+def line_diff(old_lines, new_lines):
+  """Returns [first, old_end, new_end]: the lines before first and the lines
+  from old_end and new_end on are the same in old_lines and new_lines, so
+  only lines first to new_end changed. Both are lists of lines or
+  SourceBuffers."""
+  old_buffer = as_buffer(old_lines)
+  new_buffer = as_buffer(new_lines)
+  old_text = old_buffer.text[old_buffer.start:old_buffer.end]
+  new_text = new_buffer.text[new_buffer.start:new_buffer.end]
+  prefix = _common_length(old_text, new_text)
+  if prefix == len(old_text) and prefix == len(new_text):
+    return [len(new_buffer), len(old_buffer), len(new_buffer)]
+  first = new_text.count("\n", 0, prefix)
+  suffix = min(
+      _common_length(old_text, new_text, True),
+      len(old_text) - prefix, len(new_text) - prefix)
+  # the lines of the suffix, including the line it starts in only if it
+  # starts a line in both
+  tail = 0
+  if suffix > 0:
+    i, j = new_buffer.position(new_buffer.start + len(new_text) - suffix)
+    tail = len(new_buffer) - 1 - i
+    old_start = len(old_text) - suffix
+    if j == 0 and (old_start == 0 or old_text[old_start - 1] == "\n"):
+      tail += 1
+  tail = min(tail, len(old_buffer) - first, len(new_buffer) - first)
+  return [first, len(old_buffer) - tail, len(new_buffer) - tail]
+
+
+def top_level_splits(lines):
+  """Returns the lines right after each block closed at the top level or
+  right inside namespaces, ie. after a class or a function. Parts of the file
+  cut there parse on their own. Returns [] if braces do not balance.
+  """
+  scopes = ScopeTree(lines)
+  if not scopes.balanced:
+    return []
+  return [split_i for (split_i, path) in scopes.splits()]
+
+
 def parse_classes(lines):
-  """Parses all recognized classes in lines
+  """Parses all recognized classes and structs in lines
 
   Returns a list of class_info
-  class_info: [class_name, [class_lines]]
+  class_info: [class_name, class_lines, class_offset]
+  class_lines is a SourceBuffer on lines, starting from the "{" of the class.
+  Nested classes follow the class holding them, under their own name.
+  Forward declarations, "class" in template parameters and "struct" in
+  declarations, ie. "struct stat* s;", are skipped.
   """
-  parser = Parser(lines)
+  buffer = as_buffer(lines)
+  scanner = StreamScanner(buffer.text, buffer.start, buffer.end)
+  tokens = scanner.tokens()
   result = []
-  while True:
-    pos = parser.find("class")
-    if pos is None:
-      break
-    # try to get class name
-    i, j = pos
-    line = lines[i].strip()
-    m = re.match(r".*class\s+(\S+).*", line)
-    assert m is not None
-    class_name = m.group(1)
+  for pos in scanner.finditer(_CLASS_KEYS, (("<", ">"),), tokens):
+    # the class name is the last identifier before the body or base classes
+    class_name = None
+    text = None
+    for (i, j, text, kind, is_angle) in tokens:
+      if kind != TOKEN_CODE:
+        continue
+      if text in (":", "{", ";"):
+        break
+      if (text[0].isalpha() or text[0] == "_") and text != "final":
+        class_name = text
+    if text == ";" or class_name is None:
+      continue
 
-    (start_i, start_j) = parser.find("{")
-    (end_i, j) = parser.find("}", COMMON_EXCLUDE_PAIRS)
-    result_lines = lines[start_i:end_i + 1]
-    result_lines[0] = result_lines[0][start_j:]
-    result.append([class_name, result_lines, start_i])
+    start_i, start_j = i, j
+    if text != "{":
+      for (start_i, start_j, text, kind, is_angle) in tokens:
+        if kind == TOKEN_CODE and text == "{":
+          break
+    end_pos = scanner.find_closer(tokens)
+    if end_pos is None:
+      break
+    class_lines = buffer.view(
+        buffer.offset(start_i, start_j), buffer.line_range(end_pos[0])[1])
+    result.append([class_name, class_lines, start_i])
+    # find_closer skipped the classes nested in this one
+    body_start = buffer.offset(start_i, start_j) + 1
+    body_end = buffer.offset(end_pos[0], end_pos[1])
+    if any(buffer.text.find(key, body_start, body_end) >= 0
+           for key in _CLASS_KEYS):
+      for (nested_name, nested_lines, nested_offset) in parse_classes(
+          buffer.view(body_start, body_end)):
+        # up to the end of the last line, as for other classes
+        end_i = buffer.position(nested_lines.end - 1)[0]
+        result.append([
+            nested_name,
+            buffer.view(nested_lines.start, buffer.line_range(end_i)[1]),
+            nested_offset + start_i
+        ])
 
   return result
 
 
+# Whether the class whose "{" is on line class_offset is a struct
+def _is_struct(buffer, class_offset):
+  if _CLASS_KEY_RE is None:
+    _compile_regexes()
+  text = buffer.text
+  line_start, line_end = buffer.line_range(class_offset)
+  brace = text.find("{", line_start, line_end)
+  head_start = max(text.rfind(char, buffer.start, brace) for char in ";{}")
+  m = None
+  for m in _CLASS_KEY_RE.finditer(text, head_start + 1, brace):
+    pass
+  return m is not None and m.group() == "struct"
+
+
+# Returns the [i, j] of the "public:" of the class whose "{" is on line
+# class_offset, or of that "{" for a struct without one, as its members are
+# public from there. None if a class has none.
 def find_public_line(lines, class_offset):
-  parser = Parser(lines)
-  parser.set_start_pos(class_offset + 1, 0)
-  pos = parser.find("public:", COMMON_EXCLUDE_PAIRS)
-  assert pos is not None
-  return pos
+  buffer = as_buffer(lines)
+  body = buffer[class_offset + 1:]
+  scanner = StreamScanner(body.text, body.start, body.end)
+  for (i, j) in scanner.finditer("public:", COMMON_EXCLUDE_PAIRS):
+    return [i + class_offset + 1, j]
+  if _is_struct(buffer, class_offset):
+    return [class_offset, buffer[class_offset].find("{")]
+  return None
 
 
 # including the starting char, excluding end char
 def get_string_from_lines(lines, start_i, start_j, end_i, end_j):
   if start_i > end_i:
     return ""
+  if isinstance(lines, SourceBuffer):
+    return lines.substring(start_i, start_j, end_i, end_j)
   if start_i == end_i:
     return lines[start_i][start_j:end_j]
-  result = lines[start_i][start_j:]
-  for i in range(start_i + 1, end_i + 1):
-    if i == end_i:
-      result += lines[i][:end_j]
-      break
-    result += lines[i]
-  return result
+  return "".join([lines[start_i][start_j:]] + lines[start_i + 1:end_i] +
+                 [lines[end_i][:end_j]])
 
 
-# return a list of functions as dictionary of following template:
+def _intern(text):
+  if text is None:
+    return None
+  return intern(text)
+
+
+# Returns text without the word, and with single spaces between words
+def _remove_word(text, word):
+  words = text.split()
+  if word in words:
+    words.remove(word)
+  return " ".join(words)
+
+
+class Param(object):
+  """A parameter of a function: its type and name, and its default value or
+  None. Params are shared between parse results and must not be modified."""
+  __slots__ = ("decl", "default")
+
+  def __init__(self, decl, default=None):
+    self.decl = _intern(decl)
+    self.default = _intern(default)
+
+  def __eq__(self, other):
+    return (isinstance(other, Param) and self.decl == other.decl and
+            self.default == other.default)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self.decl, self.default))
+
+  def __reduce__(self):
+    return (Param, (self.decl, self.default))
+
+  def __repr__(self):
+    return "Param(%r, %r)" % (self.decl, self.default)
+
+  def as_list(self):
+    return [self.decl, self.default]
+
+
+class FunctionDecl(object):
+  """A function declared in a class or defined in a cc file.
+
+  range is the (first, last) line of the function, prefix has words before
+  the return type (ie. static) and suffix those after the parameters (ie.
+  const / override). key identifies the function between the header and the
+  cc file, so it ignores static, override and default values. Records are
+  shared between parse results and the cache, and must not be modified.
+  """
+  __slots__ = ("range", "name", "return_type", "prefix", "suffix", "sig",
+               "key")
+
+  def __init__(self, range, name, return_type="", prefix="", suffix="",
+               sig=()):
+    self.range = tuple(range)
+    self.name = _intern(name)
+    self.return_type = _intern(return_type)
+    self.prefix = _intern(prefix)
+    self.suffix = _intern(suffix)
+    self.sig = tuple(sig)
+    keys = [_remove_word(prefix, "static"), return_type, name]
+    keys.extend(param.decl for param in self.sig)
+    keys.append(_remove_word(suffix, "override"))
+    self.key = intern(" ".join(keys))
+
+  def __eq__(self, other):
+    return (isinstance(other, FunctionDecl) and self.range == other.range and
+            self.key == other.key and self.prefix == other.prefix and
+            self.suffix == other.suffix and self.sig == other.sig)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __reduce__(self):
+    return (FunctionDecl, (self.range, self.name, self.return_type,
+                           self.prefix, self.suffix, self.sig))
+
+  def __repr__(self):
+    return "FunctionDecl(%r)" % self.as_dict()
+
+  def as_dict(self):
+    return {
+        "range": list(self.range),
+        "name": self.name,
+        "return": self.return_type,
+        "prefix": self.prefix,
+        "suffix": self.suffix,
+        "sig": [param.as_list() for param in self.sig],
+    }
+
+  # Returns a copy with some fields changed
+  def replace(self, **changes):
+    fields = {
+        "range": self.range,
+        "name": self.name,
+        "return_type": self.return_type,
+        "prefix": self.prefix,
+        "suffix": self.suffix,
+        "sig": self.sig,
+    }
+    fields.update(changes)
+    return FunctionDecl(**fields)
+
+
+# return a list of FunctionDecl
 # input: class_name to identify the function in cc file
-TEMPLATE = {
-    "range": None,  # range of lines [starting index, ending index]
-    "name": None,
-    "return": "",
-    "prefix": "",  # ie. static
-    "suffix": "",  # ie. const / override
-    "sig": [],  # signatures: [type name, default]
-}
 
 
 def parse_functions(lines, class_name=None):
-  parser = Parser(lines)
+  if class_name is not None:
+    return _parse_functions(lines, [class_name])[class_name]
+  if FAST_PATH == "0":
+    return _parse_functions(lines, None)[None]
+  result = _parse_declarations(lines)
+  if FAST_PATH == "check":
+    expected = _parse_functions(lines, None)[None]
+    if result != expected:
+      raise AssertionError("fast path %r differs from Parser %r" %
+                           (result, expected))
+  return result
+
+
+# Returns the [name, return_type, prefix, suffix, sig_string] of a function
+# declared by a match of _SIMPLE_DECL_RE, like _parse_functions finds them,
+# or () if the line declares nothing, or None if Parser is needed
+def _simple_declaration(m):
+  head, sig_string, suffix = m.groups()
+  if head.count("<") != head.count(">") or "operator" in head:
+    return None
+  if "<<" in sig_string or ("{" in sig_string and
+                            not sig_string.count("{") == sig_string.count(
+                                "{}") == sig_string.count("}")):
+    return None
+  words = head.split()
+  while len(words) > 0 and words[0] in _ACCESS_LABELS:
+    del words[0]
+  suffix = suffix.strip()
+  if len(words) == 0 or "default" in suffix:
+    return ()
+  if suffix.startswith(":"):
+    suffix = ""
+  if len(words) == 1:
+    return [words[0], "", "", suffix, sig_string]
+  return [words[-1], words[-2], " ".join(words[:-2]), suffix, sig_string]
+
+
+# Scans a line of the statements left to Parser, with the brackets open
+# before it on stack, and state [whether a block comment is open, whether
+# the last code ends a statement]. Returns False if the line closes a bracket
+# it did not open, ie. the class body, or starts a raw string.
+def _scan_line(text, stack, state):
+  start = 0
+  if state[0]:
+    start = text.find(_BLOCK_COMMENT_END)
+    if start < 0:
+      return True
+    start += len(_BLOCK_COMMENT_END)
+    state[0] = False
+  for m in _LINE_SCAN_RE.finditer(text, start):
+    kind = m.lastindex
+    if kind == 1:
+      state[0] = _is_open_block_comment(m.group(1))
+      continue
+    if kind == 2:
+      return False
+    if kind == 4:
+      char = m.group(4)
+      if char in _BRACKET_CLOSERS:
+        if len(stack) == 0 or stack[-1] != _BRACKET_CLOSERS[char]:
+          return False
+        stack.pop()
+      elif char != ";":
+        stack.append(char)
+      state[1] = char in ";}"
+    else:
+      state[1] = False
+  return True
+
+
+# Parses a class body like _parse_functions, but takes the lines of simple
+# declarations and the lines without functions with regular expressions, and
+# only leaves the statements in between to Parser
+def _parse_declarations(lines):
+  if _SIMPLE_DECL_RE is None:
+    _compile_regexes()
+  lines = as_buffer(lines)
+  num_lines = len(lines)
+  # the column after the "{" of the class body
+  first_j = 0
+  if num_lines > 0:
+    first_line = lines[0]
+    body_j = len(first_line) - len(first_line.lstrip())
+    if first_line[body_j:body_j + 1] == "{":
+      first_j = body_j + 1
+  try:
+    return _parse_declaration_lines(lines, first_j)
+  except AssertionError:
+    # Parser went past the end of the statements it was given, which only
+    # broken code makes it do, ie. a "= default" followed by a body
+    instrument.add("parser_path_lines", num_lines)
+    return _parse_functions(lines, None)[None]
+
+
+def _parse_declaration_lines(lines, first_j):
+  num_lines = len(lines)
+  source = lines.text
   result = []
+  fast_lines = 0
+  # first line of the statements left to Parser, or None
+  start_i = None
+  stack = []
+  state = [False, False]
+  for i in range(num_lines):
+    # one line at a time, so that a memory mapped file is never copied whole
+    start, end = lines.line_range(i)
+    if i == 0:
+      start += first_j
+    text = source[start:end]
+    if text.endswith("\n"):
+      text = text[:-1]
+    if start_i is None:
+      m = _SIMPLE_DECL_RE.match(text)
+      decl = None if m is None else _simple_declaration(m)
+      if decl is not None:
+        if len(decl) > 0:
+          name, return_type, prefix, suffix, sig_string = decl
+          result.append(
+              FunctionDecl((i, i), name, return_type, prefix, suffix,
+                           _parse_sig_cached(sig_string)))
+        fast_lines += 1
+        continue
+      if (_NO_FUNCTION_RE.match(text) is not None or
+          i == num_lines - 1 and text.split("//")[0].strip() in ("}", "};")):
+        fast_lines += 1
+        continue
+      if i > 0 and text.lstrip().startswith("{"):
+        # Parser would take it for the "{" of the class body
+        instrument.add("parser_path_lines", num_lines)
+        return _parse_functions(lines, None)[None]
+      start_i = i
+    if not _scan_line(text, stack, state):
+      break
+    if len(stack) == 0 and not state[0] and state[1]:
+      result.extend(
+          _parse_functions(lines[start_i:i + 1], None, start_i)[None])
+      start_i = None
+      state[1] = False
+  if start_i is not None:
+    result.extend(_parse_functions(lines[start_i:], None, start_i)[None])
+  if instrument.counters is not None:
+    instrument.counters["fast_path_lines"] += fast_lines
+    instrument.counters["parser_path_lines"] += num_lines - fast_lines
+  return result
+
+
+def parse_definitions(lines, class_names, line_offset=0):
+  """Parses the functions of several classes defined in a cc file in one pass
+
+  Returns a dict from each class name to its functions. Class names are
+  qualified by their namespaces and enclosing classes, ie. "ns::A::B", and
+  each definition goes to the class its qualified name resolves to from the
+  namespaces it is in. line_offset is added to their ranges, ie. the first
+  line of lines in the file.
+  """
+  scopes = ScopeTree(lines)
+  return _parse_functions(scopes.without_namespaces(), class_names,
+                          line_offset, scopes)
+
+
+def parse_definitions_between(scopes, class_names, start_i, end_i):
+  """Parses the definitions on lines start_i to end_i of the file of scopes,
+  which must start at a split, like parse_definitions on the whole file.
+  Ranges are in lines of the whole file."""
+  lines = scopes.without_namespaces()[start_i:end_i]
+  return _parse_functions(lines, class_names, start_i, scopes)
+
+
+# Returns a dict from each suffix of class_names, ie. "B" and "A::B" for
+# "ns::A::B", to its class, or None if several classes share it
+def _owner_index(class_names):
+  index = {}
+  for class_name in class_names:
+    names = class_name.split("::")
+    for k in range(len(names)):
+      suffix = "::".join(names[k:])
+      if suffix in index and index[suffix] != class_name:
+        index[suffix] = None
+      else:
+        index[suffix] = class_name
+  return index
+
+
+# Returns the class that owns a function defined as name within the
+# namespaces and classes of path, and name without its qualifier. The lookup
+# goes from the innermost namespace out like C++ does, then to a class
+# ending with the qualifier, ie. "A::f" belongs to "ns::A" after a using
+# namespace ns, as long as the namespaces of path left out enclose it. In an
+# anonymous namespace, local is True and the class is one of the cc file.
+def _find_owner(name, path, class_names, owner_index, local=False):
+  qualifier, sep, short_name = name.rpartition("::")
+  if qualifier == "":
+    return None, name
+  if qualifier.startswith("::"):
+    path = ()
+    qualifier = qualifier[2:]
+  elif local:
+    return None, name
+  for k in range(len(path), -1, -1):
+    class_name = "::".join(path[:k] + (qualifier,))
+    if class_name in class_names:
+      return class_name, short_name
+  names = path + tuple(qualifier.split("::"))
+  for k in range(len(names)):
+    class_name = owner_index.get("::".join(names[k:]))
+    if class_name is None:
+      continue
+    # the namespaces around the definition must enclose the class, "bar"
+    # does not enclose "foo::A", while the qualifier may be left out
+    left_out = path[:k]
+    outer = tuple(class_name.split("::")[:-(len(names) - k)])
+    if outer[len(outer) - len(left_out):] == left_out:
+      return class_name, short_name
+  return None, name
+
+
+# With class_names None, lines are a class body of header file and the result
+# is {None: functions}. Otherwise functions defined in a cc file are grouped
+# by their class, with line_offset added to their ranges, and scopes is the
+# ScopeTree of the file that lines are without_namespaces of.
+def _parse_functions(lines, class_names, line_offset=0, scopes=None):
+  if class_names is None:
+    result = {None: []}
+  else:
+    result = dict((class_name, []) for class_name in class_names)
+    owner_index = _owner_index(class_names)
 
   # corner cases
+  lines = as_buffer(lines)
   if len(lines) == 0:
     return result
-  lines[0] = lines[0].strip()
-  if lines[0] != "" and lines[0][0] == "{":
-    lines[0] = lines[0][1:]
+  # skip the "{" of a class body
+  first_line = lines[0]
+  body_j = len(first_line) - len(first_line.lstrip())
+  if class_names is None and first_line[body_j:body_j + 1] == "{":
+    lines = lines.view(lines.offset(0, body_j + 1), lines.end)
+  parser = Parser(lines)
+  # names and signatures are taken without the comments in them
+  masked = parser.lexer.masked(literals=False)
+  # where the last function ended, the words of the next one start after it
+  last_end = (0, 0)
 
-  exclude_pairs = [("{", "}"), ("<", ">")]
   while True:
-    pos = parser.find("(", exclude_pairs)
+    pos = parser.find_top_level("(")
     if pos is None:
       break
-    f = dict(TEMPLATE)
     i, j = pos
-    line = lines[i][:j].strip()
-    words = line.split()
+    head = masked.substring(i, last_end[1] if last_end[0] == i else 0, i, j)
+    head = head[max(head.rfind(";"), head.rfind("{"), head.rfind("}")) + 1:]
+    words = head.split()
+    while len(words) > 0 and words[0] in _ACCESS_LABELS:
+      del words[0]
+    if len(words) == 0:
+      continue
     name = words[-1]
 
     # filter out funcions in cc file
-    if class_name is not None and not name.startswith(class_name + "::"):
-      continue
+    class_name = None
+    if class_names is not None:
+      path = ()
+      local = False
+      if scopes is not None:
+        scope = scopes.scope_at(scopes.buffer.start + lines.offset(i, j))
+        if scope is not None:
+          path = scope.path
+          local = scope.local
+      class_name, name = _find_owner(name, path, result, owner_index, local)
+      if class_name is None:
+        continue
 
     if DEBUG:
-      print "Found function line: ", line
-    f["name"] = remove_class_name(name, class_name)
+      print "Found function head: ", head
+    return_type = ""
+    prefix = ""
     if len(words) > 1:
-      f["return"] = remove_class_name(words[-2], class_name)
-      f["prefix"] = remove_class_name(" ".join(words[:-2]), class_name)
+      return_type = remove_class_name(words[-2], class_name)
+      prefix = remove_class_name(" ".join(words[:-2]), class_name)
 
     # signatur handle
-    pos_sig_end = parser.find(")", COMMON_EXCLUDE_PAIRS)
+    pos_sig_end = parser.find_matching()
     assert pos_sig_end is not None
     sig_i, sig_j = pos_sig_end
-    sig_string = get_string_from_lines(lines, i, j, sig_i, sig_j + 1)
+    sig_string = get_string_from_lines(masked, i, j, sig_i, sig_j + 1)
     sig_string = remove_class_name(sig_string, class_name)
-    f["sig"] = parse_sig(sig_string)
+    sig = _parse_sig_cached(sig_string)
 
     # process between ")" to either ";" or "{"
     pos_def_end = parser.find([";", "{"], COMMON_EXCLUDE_PAIRS)
     assert pos_def_end is not None
     def_i, def_j = pos_def_end
-    suffix = get_string_from_lines(lines, sig_i, sig_j + 1, def_i,
+    suffix = get_string_from_lines(masked, sig_i, sig_j + 1, def_i,
                                    def_j).strip()
 
-    # If starts with ":", which should only happen in constructors
-    if not suffix.startswith(":"):
-      f["suffix"] = suffix
-
     # if suffix has "default", it is probably something like
     # "A(A&& a) = default;", skip it
     if "default" in suffix:
       continue
 
+    # If starts with ":", which should only happen in constructors
+    if suffix.startswith(":"):
+      suffix = ""
+
     # If it is just declearation, we are done
-    if lines[def_i][def_j] == ";":
-      f["range"] = [i, def_i]
-      result.append(f)
+    last_end = (def_i, def_j + 1)
+    if lines.text[lines.offset(def_i, def_j)] == ";":
+      result[class_name].append(
+          FunctionDecl((i + line_offset, def_i + line_offset), name,
+                       return_type, prefix, suffix, sig))
       continue
 
     # process body in case in header file
-    pos_body_end = parser.find("}", [["(", ")"], ["{", "}"]])
+    pos_body_end = parser.find_matching()
     if DEBUG:
       print "Found functon end now"
+    if pos_body_end is None:
+      # the body is never closed, nothing after it is at the top level
+      break
+    last_end = (pos_body_end[0], pos_body_end[1] + 1)
     if class_name is None:
       # skip this function as it as body in header file
       continue
@@ -235,23 +1723,167 @@ def parse_functions(lines, class_name=None):
     # TODO: not include body for now
     # include the "}"
     # f["body"] = get_string_from_lines(lines, def_i, def_j, body_i, body_j + 1)
-    f["range"] = [i, body_i]
-    result.append(f)
+    result[class_name].append(
+        FunctionDecl((i + line_offset, body_i + line_offset), name,
+                     return_type, prefix, suffix, sig))
   return result
 
 
+_CLASS_NAME_RE_CACHE = {}
+
+
+# Removes the qualifier of class_name from the names in word, with as many of
+# its namespaces and enclosing classes as written, ie. "A::T" and "ns::A::T"
+# both become "T" for class "ns::A"
 def remove_class_name(word, class_name):
   if class_name is None:
     return word
-  return re.sub(class_name + "::", "", word)
+  names = class_name.split("::")
+  if names[-1] + "::" not in word:
+    return word
+  pattern = _CLASS_NAME_RE_CACHE.get(class_name)
+  if pattern is None:
+    prefix = ""
+    for name in names[:-1]:
+      prefix = "(?:%s%s::)?" % (prefix, re.escape(name))
+    pattern = re.compile(r"\b" + prefix + re.escape(names[-1]) + "::")
+    _CLASS_NAME_RE_CACHE[class_name] = pattern
+  return pattern.sub("", word)
 
 
-# return list of params: [type and name, default]
+# Signatures kept parsed, as the same ones show up in many classes and files
+SIG_CACHE_SIZE = 4096
+
+
+class LruCache(object):
+  """A dict of at most max_entries, dropping the least recently used entry,
+  that counts its hits and misses. Values must not be modified."""
+
+  def __init__(self, max_entries):
+    from collections import OrderedDict
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  # Returns the value of key, or None
+  def get(self, key):
+    value = self.entries.pop(key, None)
+    if value is None:
+      self.misses += 1
+      return None
+    self.entries[key] = value
+    self.hits += 1
+    return value
+
+  def put(self, key, value):
+    self.entries[key] = value
+    if len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def stats(self):
+    return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "entries": len(self.entries),
+        "max_entries": self.max_entries,
+    }
+
+
+_sig_cache = None
+
+
+def sig_cache_stats():
+  """Returns the hits, misses and entries of the parse_sig cache"""
+  if _sig_cache is None:
+    return LruCache(SIG_CACHE_SIZE).stats()
+  return _sig_cache.stats()
+
+
+def clear_sig_cache():
+  global _sig_cache
+  _sig_cache = None
+
+
+# Returns the tuple of Param of a signature, shared with earlier calls on the
+# same string
+def _parse_sig_cached(sig_string):
+  global _sig_cache
+  if _sig_cache is None:
+    _sig_cache = LruCache(SIG_CACHE_SIZE)
+  result = _sig_cache.get(sig_string)
+  if result is None:
+    result = _split_sig(sig_string)
+    if result is None:
+      result = tuple(_parse_sig(sig_string))
+    _sig_cache.put(sig_string, result)
+    if instrument.counters is not None:
+      instrument.counters["sig_cache_misses"] += 1
+  elif instrument.counters is not None:
+    instrument.counters["sig_cache_hits"] += 1
+  return result
+
+
+# Returns the tuple of Param of a one line signature, split with regular
+# expressions where that gives the same as _parse_sig, or None. Template
+# brackets are tracked like BracketIndex does, and default values may be "{}".
+def _split_sig(sig_string):
+  if _SIG_REJECT_RE is None:
+    _compile_regexes()
+  sig_string = sig_string.strip()
+  inner = sig_string[1:-1]
+  if (sig_string[:1] != "(" or sig_string[-1:] != ")" or
+      _SIG_REJECT_RE.search(inner) is not None):
+    return None
+  if "{" in inner or "}" in inner:
+    if not inner.count("{") == inner.count("{}") == inner.count("}"):
+      return None
+  result = []
+  depth = 0
+  start = 0
+  equal = None
+  for m in _SIG_SPLIT_RE.finditer(inner + ","):
+    char = m.group()
+    if char == "<":
+      depth += 1
+    elif char == ">":
+      if depth > 0:
+        depth -= 1
+    elif char == "{":
+      if depth > 0:
+        # BracketIndex drops the template brackets open before a brace
+        return None
+    elif depth > 0:
+      continue
+    elif char == "=":
+      if equal is None:
+        equal = m.start()
+    elif inner[start:m.start()].strip() == "":
+      # No more parameters
+      break
+    elif equal is None:
+      result.append(Param(inner[start:m.start()].strip()))
+    else:
+      result.append(
+          Param(inner[start:equal].strip(), inner[equal + 1:m.start()].strip()))
+    if char == ",":
+      start = m.end()
+      equal = None
+  if depth > 0:
+    return None
+  return tuple(result)
+
+
+# return list of Param
 def parse_sig(sig_string):
+  return list(_parse_sig_cached(sig_string))
+
+
+def _parse_sig(sig_string):
   # Remove the "("
   sig_string = sig_string.strip()[1:]
   # only one line
-  parser = Parser([sig_string])
+  parser = Parser(SourceBuffer.single_line(sig_string))
   result = []
   last_j = 0
   while True:
@@ -264,185 +1896,16 @@ def parse_sig(sig_string):
     if one_sig == "":
       # No more parameters
       return result
-    equal_parser = Parser([one_sig])
-    equal_pos = equal_parser.find("=", COMMON_EXCLUDE_PAIRS)
+    equal_pos = None
+    if "=" in one_sig:
+      equal_parser = Parser(SourceBuffer.single_line(one_sig))
+      equal_pos = equal_parser.find("=", COMMON_EXCLUDE_PAIRS)
     if equal_pos is None:
-      result.append([one_sig, None])
+      result.append(Param(one_sig))
     else:
       equal_i, equal_j = equal_pos
-      result.append([one_sig[:equal_j].strip(), one_sig[equal_j + 1:].strip()])
+      result.append(
+          Param(one_sig[:equal_j].strip(), one_sig[equal_j + 1:].strip()))
     last_j = j + 1
     parser.set_start_pos(i, last_j)
   return result
-
-
-# Test for this file
-class TestAll(unittest.TestCase):
-
-  def test_parser(self):
-    self.assertEqual(Parser(["abc\n", "class b {"]).find("class"), [1, 0])
-    self.assertEqual(Parser(["//class\n", " class b {"]).find("class"), [1, 1])
-    self.assertEqual(
-        Parser(["/* bb\n", " class a {*/\n", "class b {"]).find("class"),
-        [2, 0])
-    self.assertEqual(Parser(["abc\n", "bbb\n"]).find("bcd"), None)
-
-    # comments on same line
-    self.assertEqual(
-        Parser(["int a; // range [1,5)  ok "]).find("b", [["(", ")"]]), None)
-    self.assertEqual(Parser(["<< abc"]).find("abc", [["<", ">"]]), [0, 3])
-
-  def test_find_class(self):
-    self.assertEqual(
-        parse_classes(["class a {\n", " //dummy\n", "};\n"]),
-        [["a", ["{\n", " //dummy\n", "};\n"], 0]])
-    self.assertEqual(
-        parse_classes("""class a {
- //dummy
-};
-class b {
- //dummy
- void m1() { return; }
-};
-Other function
-void f1() { reutrn ; }
-""".splitlines(True)),
-        [["a", ["{\n", " //dummy\n", "};\n"], 0],
-         ["b", [
-             "{\n",
-             " //dummy\n",
-             " void m1() { return; }\n",
-             "};\n",
-         ], 3]])
-    self.assertEqual(
-        parse_classes(["class a : b {\n", " //dummy\n", "};\n"]),
-        [["a", ["{\n", " //dummy\n", "};\n"], 0]])
-
-  def test_find_public_line(self):
-    self.assertEqual(
-        find_public_line("""class A {
-  class B {
-   public:
-      void OK();
-  };
- public: // <<<< this should be the line found "public"
-  void m2();
-                         };""".splitlines(True), 0), [5, 1])
-
-  def test_parse_sig(self):
-    self.assertEqual(parse_sig("()"), [])
-    self.assertEqual(parse_sig("(int a)"), [["int a", None]])
-    self.assertEqual(
-        parse_sig("(int a, float b)"), [["int a", None], ["float b", None]])
-    self.assertEqual(parse_sig("(int a=2)"), [["int a", "2"]])
-    self.assertEqual(
-        parse_sig("(int a, std::pair<int, int> b = {2,3})"),
-        [["int a", None], ["std::pair<int, int> b", "{2,3}"]])
-
-  def test_parse_function(self):
-    self.assertEqual(
-        parse_functions("""
-  void f1();
-};""".splitlines(True)), [{
-    "range": [1, 1],
-    "name": "f1",
-    "return": "void",
-    "prefix": "",
-    "suffix": "",
-    "sig": [],
-}])
-
-    # Test suffix/ multiline/ leading "{"
-    self.assertEqual(
-        parse_functions("""{int f1(
-                        ) override;""".splitlines(True)), [{
-                            "range": [0, 1],
-                            "name": "f1",
-                            "return": "int",
-                            "prefix": "",
-                            "suffix": "override",
-                            "sig": [],
-                        }])
-
-    # Test constructor/destructor
-    self.assertEqual(
-        parse_functions("""MyC(int a);
-                          ~MyC();""".splitlines(True)), [{
-                              "range": [0, 0],
-                              "name": "MyC",
-                              "return": "",
-                              "prefix": "",
-                              "suffix": "",
-                              "sig": [["int a", None]],
-                          }, {
-                              "range": [1, 1],
-                              "name": "~MyC",
-                              "return": "",
-                              "prefix": "",
-                              "suffix": "",
-                              "sig": [],
-                          }])
-
-    # Test constructor with member data initialiation
-    self.assertEqual(
-        parse_functions("""MyC::MyC() : member_(5) {
-                        }""".splitlines(True), "MyC"), [{
-                            "range": [0, 1],
-                            "name": "MyC",
-                            "return": "",
-                            "prefix": "",
-                            "suffix": "",
-                            "sig": [],
-                        }])
-
-    # header file with function body
-    self.assertEqual(
-        parse_functions("""void f1() {
-                        }""".splitlines(True)), [])
-
-    # cc file with no namepspace
-    self.assertEqual(
-        parse_functions("""void f1() {
-                        }""".splitlines(True), "ClassA"), [])
-
-    # cc file
-    self.assertEqual(
-        parse_functions("""static ClassA::T1 ClassA::f1(ClassA::T2 a) const {
-return;
-}""".splitlines(True), "ClassA"), [{
-    "range": [0, 2],
-    "name": "f1",
-    "return": "T1",
-    "prefix": "static",
-    "suffix": "const",
-    "sig": [["T2 a", None]],
-}])
-
-    # Test body has "<"
-    self.assertEqual(
-        parse_functions("""void MyC::Add() {
-                        for (int i = 0; i < 5; i++) {
-                          //haha
-                        }
-                        }""".splitlines(True), "MyC"), [{
-                            "range": [0, 4],
-                            "name": "Add",
-                            "return": "void",
-                            "prefix": "",
-                            "suffix": "",
-                            "sig": [],
-                        }])
-
-    # Test header file default function
-    self.assertEqual(
-        parse_functions("""MyC(MyC&& rhs) = default; """.splitlines(True)), [])
-
-  # The test method for debug only
-  def test_debug(self):
-
-    pass
-
-
-if __name__ == "__main__":
-
-  unittest.main()
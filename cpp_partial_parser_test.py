@@ -0,0 +1,650 @@
+"""Tests of cpp_partial_parser
+"""
+
+import cPickle, unittest
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import cpp_partial_parser
+from cpp_partial_parser import (
+    COMMON_EXCLUDE_PAIRS, SCOPE_BLOCK, SCOPE_CLASS, SCOPE_NAMESPACE,
+    TOKEN_CODE, TOKEN_COMMENT, TOKEN_LITERAL, TOP_LEVEL_PAIRS, BracketIndex,
+    FunctionDecl, Lexer, LruCache, Param, Parser, ScopeTree, SourceBuffer,
+    StreamScanner, find_public_line, get_string_from_lines, line_diff,
+    parse_classes, parse_definitions, parse_definitions_between,
+    parse_functions, parse_sig, remove_class_name, top_level_splits)
+
+
+def _as_dicts(functions):
+  return [f.as_dict() for f in functions]
+
+
+# Runs test with Parser using StructuralScan on any number of tokens
+def _with_structural_scan(test):
+  saved = [
+      cpp_partial_parser.USE_NUMPY,
+      cpp_partial_parser.STRUCTURAL_SCAN_MIN_TOKENS
+  ]
+  cpp_partial_parser.USE_NUMPY = True
+  cpp_partial_parser.STRUCTURAL_SCAN_MIN_TOKENS = 0
+  try:
+    test()
+  finally:
+    (cpp_partial_parser.USE_NUMPY,
+     cpp_partial_parser.STRUCTURAL_SCAN_MIN_TOKENS) = saved
+
+
+# Runs test with the fast_path mode of parse_functions, see FAST_PATH_ENV
+def _with_fast_path(fast_path, test):
+  saved = cpp_partial_parser.FAST_PATH
+  cpp_partial_parser.FAST_PATH = fast_path
+  try:
+    test()
+  finally:
+    cpp_partial_parser.FAST_PATH = saved
+
+
+class TestAll(unittest.TestCase):
+
+  def test_parser(self):
+    self.assertEqual(Parser(["abc\n", "class b {"]).find("class"), [1, 0])
+    self.assertEqual(Parser(["//class\n", " class b {"]).find("class"), [1, 1])
+    self.assertEqual(
+        Parser(["/* bb\n", " class a {*/\n", "class b {"]).find("class"),
+        [2, 0])
+    self.assertEqual(Parser(["abc\n", "bbb\n"]).find("bcd"), None)
+
+    # comments on same line
+    self.assertEqual(
+        Parser(["int a; // range [1,5)  ok "]).find("b", [["(", ")"]]), None)
+    self.assertEqual(Parser(["<< abc"]).find("abc", [["<", ">"]]), [0, 3])
+
+  def test_lexer(self):
+    self.assertEqual(
+        Lexer(["a::b << c; // x\n", "/* y\n", " z */ 'q' \"{\"\n"]).tokens,
+        [(0, 0, "a", TOKEN_CODE), (0, 1, "::", TOKEN_CODE),
+         (0, 3, "b", TOKEN_CODE), (0, 5, "<<", TOKEN_CODE),
+         (0, 8, "c", TOKEN_CODE), (0, 9, ";", TOKEN_CODE),
+         (0, 11, "// x", TOKEN_COMMENT), (1, 0, "/* y", TOKEN_COMMENT),
+         (2, 0, " z */", TOKEN_COMMENT), (2, 6, "'q'", TOKEN_LITERAL),
+         (2, 10, '"{"', TOKEN_LITERAL)])
+
+  def test_raw_string(self):
+    self.assertEqual(
+        Lexer(['s = R"x({ )" })x"; f(\n']).tokens,
+        [(0, 0, "s", TOKEN_CODE), (0, 2, "=", TOKEN_CODE),
+         (0, 4, 'R"x({ )" })x"', TOKEN_LITERAL), (0, 17, ";", TOKEN_CODE),
+         (0, 19, "f", TOKEN_CODE), (0, 20, "(", TOKEN_CODE)])
+    self.assertEqual(
+        Lexer(['u8R"(a\n', "{\n", ')" }\n']).tokens,
+        [(0, 0, 'u8R"(a', TOKEN_LITERAL), (1, 0, "{", TOKEN_LITERAL),
+         (2, 0, ')"', TOKEN_LITERAL), (2, 3, "}", TOKEN_CODE)])
+    self.assertEqual(Parser(['R"({)" {\n', "}"]).find("}"), [1, 0])
+
+  def test_masked(self):
+    lexer = Lexer(["int a; // b\n", "/* c\n", "*/ f('{', \"d\");\n"])
+    self.assertEqual(
+        list(lexer.masked()),
+        ["int a;     \n", "    \n", "   f(   ,    );\n"])
+    self.assertEqual(
+        list(lexer.masked(literals=False)),
+        ["int a;     \n", "    \n", "   f('{', \"d\");\n"])
+    self.assertEqual(lexer.comment_above[2], 1)
+    lexer = Lexer(["// a\n", "// b\n", "int c;\n", "\n", "/* d */ int e;\n"])
+    self.assertEqual(list(lexer.comment_above), [-1, 0, 0, -1, -1])
+    self.assertEqual(lexer.comment_start(lexer.line_start[2]), 0)
+    self.assertEqual(lexer.comment_start(lexer.line_start[2] + 1), 0)
+    self.assertEqual(lexer.comment_start(lexer.line_start[4] + 1), 4)
+    self.assertEqual(Lexer(["\n", "int c;\n"]).comment_start(0), None)
+
+  def test_parser_tokens(self):
+    # targets only match whole tokens
+    self.assertEqual(Parser(["subclass a;\n", "class b {"]).find("class"),
+                     [1, 0])
+    self.assertEqual(Parser([" public : a;  public:"]).find("public:"), [0, 14])
+    # brackets in literals do not count
+    self.assertEqual(
+        Parser(['{ f("}"); }; x']).find(";", COMMON_EXCLUDE_PAIRS), [0, 11])
+    parser = Parser(["a, b, c"])
+    self.assertEqual(parser.find(","), [0, 1])
+    self.assertEqual(parser.find(","), [0, 4])
+    parser.set_start_pos(0, 0)
+    self.assertEqual(parser.find(","), [0, 1])
+
+  def test_bracket_index(self):
+    tokens = Lexer(["a<b<c>> f(x < y, {1}) /* q\n", "*/ i<5;"]).tokens
+    match = BracketIndex(tokens).match
+    texts = [token[2] for token in tokens]
+    # a < b < c > >
+    self.assertEqual(match[1], 6)
+    self.assertEqual(match[3], 5)
+    # ( ... ) with "x < y" as less-than
+    self.assertEqual(match[8], 16)
+    self.assertEqual(match[10], -1)
+    self.assertEqual(match[13], 15)
+    # block comment pieces, then another less-than
+    self.assertEqual(match[17], 18)
+    self.assertEqual(match[20], -1)
+
+  def test_find_matching(self):
+    parser = Parser(
+        ["void f(int a = b < c) {\n", " if (x<y) { g(); }\n", "}\n"])
+    self.assertEqual(parser.find("("), [0, 6])
+    self.assertEqual(parser.find_matching(), [0, 20])
+    self.assertEqual(parser.find("{"), [0, 22])
+    self.assertEqual(parser.find_matching(), [2, 0])
+    # a less-than inside of a body does not stall the search
+    self.assertEqual(
+        Parser(["f() { i < 5; } g();"]).find(";", COMMON_EXCLUDE_PAIRS),
+        [0, 18])
+
+  def test_source_buffer(self):
+    buffer = SourceBuffer("ab\ncd\n\nef")
+    self.assertEqual(buffer, ["ab\n", "cd\n", "\n", "ef"])
+    self.assertEqual(len(buffer), 4)
+    self.assertEqual(buffer[-1], "ef")
+    self.assertEqual(buffer.position(4), (1, 1))
+    self.assertEqual(buffer.substring(0, 1, 3, 1), "b\ncd\n\ne")
+    view = buffer.view(4, 8)
+    self.assertEqual(view, ["d\n", "\n", "e"])
+    self.assertEqual(view.offset(1, 0), 6)
+    self.assertEqual(view[1:], ["\n", "e"])
+    self.assertEqual(Lexer(view).tokens, [(0, 0, "d", TOKEN_CODE),
+                                          (2, 0, "e", TOKEN_CODE)])
+    self.assertEqual(get_string_from_lines(["ab", "cd", "ef"], 0, 1, 2, 1),
+                     "bcde")
+
+  def test_stream_scanner(self):
+    scanner = StreamScanner("""f(a<b, c); g(x<int>(1));
+/* h(
+*/ k(std::vector<int> v = {1, 2}); m(i < 2, j > 3);
+""")
+    self.assertEqual(
+        list(scanner.finditer("(", COMMON_EXCLUDE_PAIRS)),
+        [[0, 1], [0, 12], [2, 4], [2, 36]])
+    tokens = scanner.tokens()
+    positions = scanner.finditer(["(", "public:"], (), tokens)
+    self.assertEqual(next(positions), [0, 1])
+    self.assertEqual(scanner.find_closer(tokens, "("), [0, 8])
+    self.assertEqual(next(positions), [0, 12])
+
+  def test_find_class(self):
+    self.assertEqual(
+        parse_classes(["class a {\n", " //dummy\n", "};\n"]),
+        [["a", ["{\n", " //dummy\n", "};\n"], 0]])
+    self.assertEqual(
+        parse_classes("""class a {
+ //dummy
+};
+class b {
+ //dummy
+ void m1() { return; }
+};
+Other function
+void f1() { reutrn ; }
+""".splitlines(True)),
+        [["a", ["{\n", " //dummy\n", "};\n"], 0],
+         ["b", [
+             "{\n",
+             " //dummy\n",
+             " void m1() { return; }\n",
+             "};\n",
+         ], 3]])
+    self.assertEqual(
+        parse_classes(["class a : b {\n", " //dummy\n", "};\n"]),
+        [["a", ["{\n", " //dummy\n", "};\n"], 0]])
+    self.assertEqual(
+        parse_classes([
+            "class F;\n", "template <class T> class EXPORT a final {\n",
+            "};\n"
+        ]), [["a", ["{\n", "};\n"], 1]])
+    self.assertEqual(
+        parse_classes([
+            "class a {\n", "  class b { class c {}; };\n", "  void f();\n",
+            "};\n"
+        ]), [["a", ["{\n", "  class b { class c {}; };\n", "  void f();\n",
+                    "};\n"], 0],
+             ["b", ["{ class c {}; };\n"], 1], ["c", ["{}; };\n"], 1]])
+    self.assertEqual(
+        parse_classes([
+            "struct stat;\n", "int f(struct stat* s);\n",
+            "typedef struct A : B {\n", "  struct C { int x; };\n", "} A;\n"
+        ]), [["A", ["{\n", "  struct C { int x; };\n", "} A;\n"], 2],
+             ["C", ["{ int x; };\n"], 3]])
+
+  def test_find_public_line(self):
+    self.assertEqual(
+        find_public_line("""class A {
+  class B {
+   public:
+      void OK();
+  };
+ public: // <<<< this should be the line found "public"
+  void m2();
+                         };""".splitlines(True), 0), [5, 1])
+    self.assertEqual(
+        find_public_line(["class A {\n", "  void f();\n", "};\n"], 0), None)
+    self.assertEqual(
+        find_public_line(["int x;\n", "template <class T>\n", "struct A {\n",
+                          "};\n"], 2), [2, 9])
+    self.assertEqual(
+        find_public_line(["struct A {\n", " public:\n", "};\n"], 0), [1, 1])
+
+  def test_parse_sig(self):
+    self.assertEqual(parse_sig("()"), [])
+    self.assertEqual(parse_sig("(int a)"), [Param("int a")])
+    self.assertEqual(
+        parse_sig("(int a, float b)"), [Param("int a"), Param("float b")])
+    self.assertEqual(parse_sig("(int a=2)"), [Param("int a", "2")])
+    self.assertEqual(
+        parse_sig("(int a, std::pair<int, int> b = {2,3})"),
+        [Param("int a"), Param("std::pair<int, int> b", "{2,3}")])
+
+  def test_sig_cache(self):
+    cpp_partial_parser.clear_sig_cache()
+    sig = parse_sig("(const std::string& name, int a = 1)")
+    sig.append(Param("int b"))
+    again = parse_sig("(const std::string& name, int a = 1)")
+    self.assertEqual(again, [Param("const std::string& name"),
+                             Param("int a", "1")])
+    self.assertIs(again[0], sig[0])
+    stats = cpp_partial_parser.sig_cache_stats()
+    self.assertEqual([stats["hits"], stats["misses"], stats["entries"]],
+                     [1, 1, 1])
+
+    cache = LruCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    self.assertEqual(cache.get("a"), 1)
+    cache.put("c", 3)
+    self.assertEqual([cache.get("b"), cache.get("a"), cache.get("c")],
+                     [None, 1, 3])
+    self.assertEqual([cache.hits, cache.misses], [3, 1])
+
+  def test_parse_function(self):
+    self.assertEqual(
+        _as_dicts(parse_functions("""
+  void f1();
+};""".splitlines(True))), [{
+    "range": [1, 1],
+    "name": "f1",
+    "return": "void",
+    "prefix": "",
+    "suffix": "",
+    "sig": [],
+}])
+
+    # Test suffix/ multiline/ leading "{"
+    self.assertEqual(
+        _as_dicts(parse_functions("""{int f1(
+                        ) override;""".splitlines(True))), [{
+                            "range": [0, 1],
+                            "name": "f1",
+                            "return": "int",
+                            "prefix": "",
+                            "suffix": "override",
+                            "sig": [],
+                        }])
+
+    # Test constructor/destructor
+    self.assertEqual(
+        _as_dicts(parse_functions("""MyC(int a);
+                          ~MyC();""".splitlines(True))), [{
+                              "range": [0, 0],
+                              "name": "MyC",
+                              "return": "",
+                              "prefix": "",
+                              "suffix": "",
+                              "sig": [["int a", None]],
+                          }, {
+                              "range": [1, 1],
+                              "name": "~MyC",
+                              "return": "",
+                              "prefix": "",
+                              "suffix": "",
+                              "sig": [],
+                          }])
+
+    # Test constructor with member data initialiation
+    self.assertEqual(
+        _as_dicts(parse_functions("""MyC::MyC() : member_(5) {
+                        }""".splitlines(True), "MyC")), [{
+                            "range": [0, 1],
+                            "name": "MyC",
+                            "return": "",
+                            "prefix": "",
+                            "suffix": "",
+                            "sig": [],
+                        }])
+
+    # header file with function body
+    self.assertEqual(
+        _as_dicts(parse_functions("""void f1() {
+                        }""".splitlines(True))), [])
+
+    # several declarations on a line, each with only its own words
+    self.assertEqual([(f.name, f.return_type, f.prefix) for f in
+                      parse_functions(
+                          ["{ public: int x_; void f() {} static int g();"
+                           " virtual bool h() = 0; };\n"])],
+                     [("g", "int", "static"), ("h", "bool", "virtual")])
+
+    # cc file with no namepspace
+    self.assertEqual(
+        _as_dicts(parse_functions("""void f1() {
+                        }""".splitlines(True), "ClassA")), [])
+
+    # cc file
+    cc_lines = """static ClassA::T1 ClassA::f1(ClassA::T2 a) const {
+return;
+}""".splitlines(True)
+    self.assertEqual(_as_dicts(parse_functions(cc_lines, "ClassA")), [{
+    "range": [0, 2],
+    "name": "f1",
+    "return": "T1",
+    "prefix": "static",
+    "suffix": "const",
+    "sig": [["T2 a", None]],
+}])
+
+    # Test body has "<"
+    self.assertEqual(
+        _as_dicts(parse_functions("""void MyC::Add() {
+                        for (int i = 0; i < 5; i++) {
+                          //haha
+                        }
+                        }""".splitlines(True), "MyC")), [{
+                            "range": [0, 4],
+                            "name": "Add",
+                            "return": "void",
+                            "prefix": "",
+                            "suffix": "",
+                            "sig": [],
+                        }])
+
+    # Test comments in the declaration
+    self.assertEqual(
+        _as_dicts(
+            parse_functions("""/* f1 */ void f1(int a /* x */,
+                               // y
+                               int b = 2) const;""".splitlines(True))),
+        [{
+            "range": [0, 2],
+            "name": "f1",
+            "return": "void",
+            "prefix": "",
+            "suffix": "const",
+            "sig": [["int a", None], ["int b", "2"]],
+        }])
+
+    # Test header file default function
+    self.assertEqual(
+        parse_functions("""MyC(MyC&& rhs) = default; """.splitlines(True)), [])
+
+  def test_parse_definitions(self):
+    definitions = parse_definitions("""void A::f(A::T a) {}
+int helper(int b) { return b; }
+void ns::B::g() const {}
+void MyA::h() {}
+""".splitlines(True), ["A", "B"])
+    self.assertEqual([f.name for f in definitions["A"]], ["f"])
+    self.assertEqual(definitions["A"][0].sig, (Param("T a"),))
+    self.assertEqual([f.name for f in definitions["B"]], ["g"])
+    self.assertEqual(definitions["B"][0].range, (2, 2))
+    self.assertEqual(remove_class_name("MyA::T A::T", "A"), "MyA::T T")
+    # a body that is never closed ends the parse
+    definitions = parse_definitions(
+        ["void A::f() {}\n", "void A::g() {\n", "  if (x) {\n"], ["A"])
+    self.assertEqual([f.name for f in definitions["A"]], ["f"])
+    self.assertEqual(parse_functions(["{\n", "  void f() {\n"]), [])
+
+  def test_parse_definitions_in_scopes(self):
+    definitions = parse_definitions("""#include "a.h"
+namespace {
+int Helper(int a) { return a; }
+}  // namespace
+namespace ns {
+void A::f(A::T a) {}
+A::B::T A::B::g() const { return T(); }
+}  // namespace ns
+void other::A::h() {}
+// ambiguous between ns::A and other::A
+void A::i() {}
+""".splitlines(True), ["ns::A", "ns::A::B", "other::A"])
+    self.assertEqual([f.name for f in definitions["ns::A"]], ["f"])
+    self.assertEqual(definitions["ns::A"][0].sig, (Param("T a"),))
+    self.assertEqual(definitions["ns::A"][0].range, (5, 5))
+    self.assertEqual([f.return_type for f in definitions["ns::A::B"]], ["T"])
+    self.assertEqual([f.name for f in definitions["other::A"]], ["h"])
+    self.assertEqual(remove_class_name("ns::A::T A::T ns::T", "ns::A"),
+                     "T T ns::T")
+
+  def test_parse_definitions_of_local_classes(self):
+    # classes of the cc file shadow those of the header with the same name
+    definitions = parse_definitions("""using namespace foo;
+void Impl::f() {}
+namespace bar {
+class Impl { void Helper(); };
+void Impl::Helper() {}
+}  // namespace bar
+namespace {
+class A { void g(); };
+void A::g() {}
+}  // namespace
+extern "C" {
+void A::h() {}
+}
+""".splitlines(True), ["foo::Impl", "A"])
+    self.assertEqual([f.name for f in definitions["foo::Impl"]], ["f"])
+    self.assertEqual([f.name for f in definitions["A"]], ["h"])
+
+  def test_function_decl(self):
+    f = FunctionDecl((0, 1), "f", "int", "static", "const override",
+                     [Param("int a", "2")])
+    self.assertEqual(f.key, " int f int a const")
+    self.assertEqual(f.replace(prefix="", suffix="const").key, f.key)
+    self.assertEqual(f.replace(sig=[Param("int b")]).sig, (Param("int b"),))
+    self.assertEqual(f.sig, (Param("int a", "2"),))
+    self.assertEqual(cPickle.loads(cPickle.dumps(f, 2)), f)
+    self.assertEqual(cPickle.loads(cPickle.dumps(f, 0)), f)
+    with self.assertRaises(AttributeError):
+      f.change_to = 0
+
+  def test_scope_tree(self):
+    lines = """namespace a {
+namespace {
+int x = 1;
+}
+class A final : public B<C> {
+  struct In { int f() { return 0; } };
+  enum class E { X };
+};
+extern "C" { void g(); }
+}  // namespace a
+""".splitlines(True)
+    scopes = ScopeTree(lines)
+    self.assertTrue(scopes.balanced)
+    self.assertEqual([(scope.kind, scope.path) for scope in scopes.scopes], [
+        (SCOPE_NAMESPACE, ("a",)),
+        (SCOPE_NAMESPACE, ("a",)),
+        (SCOPE_CLASS, ("a", "A")),
+        (SCOPE_CLASS, ("a", "A", "In")),
+        (SCOPE_BLOCK, ("a", "A", "In")),
+        (SCOPE_BLOCK, ("a", "A")),
+        (SCOPE_NAMESPACE, ("a",)),
+    ])
+    buffer = scopes.buffer
+    self.assertEqual(scopes.path_at(buffer.offset(5, 14)), ("a", "A", "In"))
+    self.assertEqual(scopes.path_at(buffer.offset(2, 0)), ("a",))
+    self.assertEqual(scopes.path_at(buffer.offset(0, 0)), ())
+    self.assertEqual([scope.local for scope in scopes.scopes],
+                     [False, True, False, False, False, False, False])
+    blanked = scopes.without_namespaces()
+    self.assertEqual(blanked[0], " " * 13 + "\n")
+    self.assertEqual(blanked[4], lines[4])
+    self.assertEqual(blanked[8], " " * 13 + "void g();  \n")
+    self.assertEqual(blanked[9], "   // namespace a\n")
+    self.assertFalse(ScopeTree(["{\n", "}}\n"]).balanced)
+
+  def test_top_level_splits(self):
+    lines = """namespace a {
+class A {
+  void f() { if (x) {} }
+};
+// }
+const char* s = "{";
+namespace b { namespace c {
+void g() {}
+int x;
+}}
+}  // namespace a
+""".splitlines(True)
+    self.assertEqual(top_level_splits(lines), [4, 8])
+    self.assertEqual(top_level_splits(["#if X\n", "{\n", "#else\n", "{\n"]),
+                     [])
+    self.assertEqual(top_level_splits(["}\n", "{\n"]), [])
+    # nothing after the "}" may carry over to the next line
+    self.assertEqual(
+        top_level_splits(["int f() {}\n", "void g() {} /* x\n", "*/\n",
+                          "struct S {} s; int h() {\n", "}\n", "int y;\n"]),
+        [1, 5])
+
+  def test_line_diff(self):
+    lines = ["a\n", "b\n", "c\n", "d\n"]
+    self.assertEqual(line_diff(lines, lines), [4, 4, 4])
+    self.assertEqual(line_diff(lines, ["a\n", "x\n", "c\n", "d\n"]),
+                     [1, 2, 2])
+    self.assertEqual(line_diff(lines, ["a\n", "b\n", "c\n"]), [3, 4, 3])
+    self.assertEqual(line_diff(lines, ["a\n", "b\n", "b\n", "c\n", "d\n"]),
+                     [2, 2, 3])
+    self.assertEqual(line_diff(lines, ["a\n", "bb\n", "d\n"]), [1, 3, 2])
+    self.assertEqual(line_diff(["a\n"], ["b\n"]), [0, 1, 1])
+    self.assertEqual(line_diff([], ["a\n"]), [0, 0, 1])
+
+  def test_parse_definitions_between(self):
+    text = """namespace a {
+void A::f() {}
+int A::g(int x) {
+  return x;
+}
+}  // namespace a
+void A::h() {}
+"""
+    scopes = ScopeTree(SourceBuffer(text))
+    result = parse_definitions_between(scopes, ["a::A"], 2, 6)
+    self.assertEqual([(f.name, f.range) for f in result["a::A"]],
+                     [("g", (2, 4))])
+    self.assertEqual(
+        parse_definitions(text, ["a::A"])["a::A"][1], result["a::A"][0])
+    # a block at the start is not taken for a class body
+    scopes = ScopeTree(SourceBuffer("{\nvoid A::f() {}\n}\nvoid A::g() {}\n"))
+    self.assertEqual(
+        [f.name for f in parse_definitions_between(scopes, ["A"], 0, 4)["A"]],
+        ["g"])
+
+  @unittest.skipIf(numpy is None, "needs numpy")
+  def test_structural_scan(self):
+    _with_structural_scan(self.test_parse_function)
+    _with_structural_scan(self.test_parse_definitions)
+    _with_structural_scan(self.test_parse_definitions_in_scopes)
+
+    def check(text):
+      lines = SourceBuffer(text)
+      scan_parser = Parser(lines)
+      self.assertIsNotNone(scan_parser.structural_scan())
+      for (i, j, token_text, kind) in Parser(lines).lexer.tokens:
+        parser = Parser(lines)
+        parser.set_start_pos(i, j)
+        scan_parser.set_start_pos(i, j)
+        self.assertEqual(scan_parser.find_top_level("("),
+                         parser.find("(", TOP_LEVEL_PAIRS))
+        self.assertEqual([scan_parser.next_i, scan_parser.next_j],
+                         [parser.next_i, parser.next_j])
+
+    _with_structural_scan(lambda: check("""
+  std::map<int, std::function<void(int)>> m_;  // f(
+  void f(const char* s = "{(", int a = b < c) { if (x) { g(); } }
+  template <typename T> T g(T t = T()) const;
+  /* h( */ int h(int (*cb)(int)) = 0;
+  enum { kA = (1 << 2) };
+"""))
+
+  def test_split_sig(self):
+    for sig_string in [
+        "()", "(int a)", "( int  a ,float b )", "(int a=2)", "(int a, )",
+        "(, int a)", "(std::map<int, std::vector<int>> m, int b = {})",
+        "(int a = b >= c, int d)", "(a > b, c)", "(A<B, C>::D d = E)"
+    ]:
+      self.assertEqual(
+          cpp_partial_parser._split_sig(sig_string),
+          tuple(cpp_partial_parser._parse_sig(sig_string)), sig_string)
+    # left to the lexer
+    for sig_string in [
+        "(int (*cb)(int))", "(const char* s = \",\")", "(int a /* , */)",
+        "(int a = b < c, int d)", "(int a = 1 << 2)", "(A<{}> a)",
+        "(std::array<int, 1 < 2> a)", "(int a,\n int b)"
+    ]:
+      self.assertIsNone(cpp_partial_parser._split_sig(sig_string), sig_string)
+
+  def test_fast_path(self):
+    _with_fast_path("0", self.test_parse_function)
+    _with_fast_path("check", self.test_parse_function)
+
+    lines = SourceBuffer("""{
+ public:
+  virtual int Foo(const Bar& b) const override;  // Foo(
+  // Bar(
+  static void Bar(std::map<int, int> m = {}) = 0;
+  void Inline() { if (x_) { x_ = 0; } }
+  int Multi(int a,
+            int b);
+  A() : x_(0) {}
+  A(const A& a) = default;
+  /* Commented(
+   */ void Template(std::vector<T> t);
+  template <typename T>
+  T Get();
+  std::function<void(int)> cb_;
+ private:
+  int x_;
+};
+""")
+    functions = parse_functions(lines)
+    self.assertEqual(functions, cpp_partial_parser._parse_functions(
+        lines, None)[None])
+    self.assertEqual(
+        [[f.range, f.name] for f in functions],
+        [[(2, 2), "Foo"], [(4, 4), "Bar"], [(6, 7), "Multi"],
+         [(11, 11), "Template"], [(13, 13), "Get"]])
+    self.assertEqual(functions[0].suffix, "const override")
+    self.assertEqual(functions[1].sig, (Param("std::map<int, int> m", "{}"),))
+
+    import instrument
+    instrument.enable()
+    try:
+      parse_functions(lines)
+      self.assertEqual([
+          instrument.counters["fast_path_lines"],
+          instrument.counters["parser_path_lines"]
+      ], [9, 9])
+    finally:
+      instrument.disable()
+
+    # a class on one line, and bodies the fast path cannot split
+    for text in ["{ void f(); int g(int a); };\n",
+                 "{\n  void f() = default {\n  g(1) }\n  int h();\n};\n",
+                 "{\n  void f(); }\n  void g();\n"]:
+      _with_fast_path("check", lambda: parse_functions(SourceBuffer(text)))
+
+  # The test method for debug only
+  def test_debug(self):
+
+    pass
+
+
+if __name__ == "__main__":
+
+  unittest.main()
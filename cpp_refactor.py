@@ -1,113 +1,353 @@
 #!/usr/bin/python
 
-import os, glob, subprocess, sys, re, shutil
+# Only what every run needs is imported here, as this runs on every save.
+# Modules of other modes are imported where they are used.
+import os, re, sys
 import common
 import cpp_partial_parser
-import pprint
+import instrument
+import parse_cache
 
 DEBUG = False
 
+# Headers of at least this size are parsed in parts by several processes
+# when more than one job is asked for
+PARALLEL_MIN_BYTES = 1024 * 1024
+# Parts per job, to even out their different parse times
+CHUNKS_PER_JOB = 4
+# Files whose last parse ParseHistory keeps
+DEFAULT_HISTORY_FILES = 64
 
-def find_header_file(fin):
-  while True:
-    lc = fin.readline()
-    if not lc:
-      break
-    m = re.match(r'^#include.*"(.*)"', lc)
+_INCLUDE_RE = None
+
+
+# lines: an open file or any other iterable of lines
+def find_header_file(lines):
+  global _INCLUDE_RE
+  if _INCLUDE_RE is None:
+    _INCLUDE_RE = re.compile(r'^#include.*"(.*)"')
+  for lc in lines:
+    m = _INCLUDE_RE.match(lc)
     if m:
       return m.group(1)
 
 
-def remove_str(str_in, target):
-  str_in_list = str_in.split()
-  if target in str_in_list:
-    str_in_list.remove(target)
-  return " ".join(str_in_list)
-
-
-# Generates the key of each functions that can be used as key in the hashtable
-def add_function_key(functions):
-  for f in functions:
-    # skip "static" in prefix
-    prefix = remove_str(f["prefix"], "static")
-    # skip "override" in suffix
-    suffix = remove_str(f["suffix"], "override")
-    keys = []
-    keys.append(prefix)
-    keys.append(f["return"])
-    keys.append(f["name"])
-    for each_input in f["sig"]:
-      # append input type name only, not the default value
-      keys.append(each_input[0])
-    keys.append(suffix)
-    f["key"] = " ".join(keys)
-
-
-def get_uniques(functions):
-  result = {}
-  for i in range(len(functions)):
-    name = functions[i]["name"]
-    if name in result:
-      result[name] = -1
-    else:
-      result[name] = i
+# Name buckets of changed functions larger than this are paired in order
+# rather than by a minimal assignment, which takes size ** 3 steps
+MAX_ASSIGNMENT_SIZE = 32
+# Words that end a parameter type rather than name the parameter
+_TYPE_WORDS = frozenset([
+    "bool", "char", "const", "double", "float", "int", "long", "short",
+    "signed", "unsigned", "volatile"
+])
+# Words of a declaration prefix that a definition out of the class leaves out
+_DECLARATION_WORDS = frozenset(["explicit", "static", "virtual"])
+
+# Parameter types kept, as the same declarations show up in many functions
+PARAM_TYPE_CACHE_SIZE = 4096
+
+_PARAM_NAME_RE = None
+_TYPE_SPACE_RE = None
+_param_type_cache = None
+
+
+# Returns the type of a parameter declaration, without its name and with the
+# spaces of the declaration normalized, ie. "const std::string&" for
+# "const  std::string &name"
+def param_type(decl):
+  global _PARAM_NAME_RE, _TYPE_SPACE_RE, _param_type_cache
+  if _param_type_cache is None:
+    _PARAM_NAME_RE = re.compile(r"^(.*[\w>*&\]\s])\s*\b([A-Za-z_]\w*)$")
+    _TYPE_SPACE_RE = re.compile(r"\s*([<>,*&:\[\]()])\s*")
+    _param_type_cache = cpp_partial_parser.LruCache(PARAM_TYPE_CACHE_SIZE)
+  result = _param_type_cache.get(decl)
+  if result is not None:
+    return result
+  result = " ".join(decl.split())
+  m = _PARAM_NAME_RE.match(result)
+  if m is not None and m.group(2) not in _TYPE_WORDS:
+    result = m.group(1)
+  result = _TYPE_SPACE_RE.sub(r"\1", result).strip()
+  _param_type_cache.put(decl, result)
   return result
 
 
+def _param_types(f):
+  return tuple(param_type(param.decl) for param in f.sig)
+
+
+# Returns the name and parameter types of a function, for messages
+def _describe(f):
+  return "%s(%s)" % (f.name, ", ".join(_param_types(f)))
+
+
+# Returns the number of edits between sequences a and b
+def _edit_distance(a, b):
+  previous = range(len(b) + 1)
+  for i in range(len(a)):
+    current = [i + 1]
+    for j in range(len(b)):
+      current.append(
+          min(previous[j + 1] + 1, current[j] + 1,
+              previous[j] + (a[i] != b[j])))
+    previous = current
+  return previous[-1]
+
+
+# Returns [prefix words, return type] of a function. The qualifier of a
+# constructor or destructor, ie. explicit A(int a), is parsed as its return
+# type, but is part of the prefix.
+def _split_prefix(f):
+  if f.return_type in _DECLARATION_WORDS:
+    return [f.prefix.split() + [f.return_type], ""]
+  return [f.prefix.split(), f.return_type]
+
+
+# Returns [prefix words, return type] of a function as a definition repeats
+# them
+def _definition_prefix(f):
+  words, return_type = _split_prefix(f)
+  return [[word for word in words if word not in _DECLARATION_WORDS],
+          return_type]
+
+
+# Returns what _change_cost compares of a function with parameter types
+# types: (types, prefix, return type, suffix)
+def _cost_key(f, types):
+  words, return_type = _definition_prefix(f)
+  return (types, tuple(words), return_type,
+          tuple(word for word in f.suffix.split() if word != "override"))
+
+
+# Returns the edits to change header function h to cc function c: the edit
+# distance of their parameter types, plus one for a different prefix, one
+# for a different return type and one for a different suffix
+def _change_cost(h, h_types, c, c_types):
+  return _key_cost(_cost_key(h, h_types), _cost_key(c, c_types))
+
+
+def _key_cost(h_key, c_key):
+  return (_edit_distance(h_key[0], c_key[0]) + (h_key[1] != c_key[1]) +
+          (h_key[2] != c_key[2]) + (h_key[3] != c_key[3]))
+
+
+# Returns the column of each row of a cost matrix, with no more rows than
+# columns, so that the total cost is minimal. This is the shortest
+# augmenting path form of the Hungarian algorithm, in rows ** 2 * columns.
+def _min_cost_assignment(costs):
+  num_rows = len(costs)
+  num_cols = len(costs[0])
+  # potentials of rows and columns, and the row of each column, 1 based with
+  # 0 for none
+  u = [0] * (num_rows + 1)
+  v = [0] * (num_cols + 1)
+  row_of = [0] * (num_cols + 1)
+  for row in range(1, num_rows + 1):
+    row_of[0] = row
+    col0 = 0
+    min_to = [float("inf")] * (num_cols + 1)
+    way = [0] * (num_cols + 1)
+    used = [False] * (num_cols + 1)
+    while True:
+      used[col0] = True
+      row0 = row_of[col0]
+      delta = float("inf")
+      col1 = 0
+      for col in range(1, num_cols + 1):
+        if used[col]:
+          continue
+        cur = costs[row0 - 1][col - 1] - u[row0] - v[col]
+        if cur < min_to[col]:
+          min_to[col] = cur
+          way[col] = col0
+        if min_to[col] < delta:
+          delta = min_to[col]
+          col1 = col
+      for col in range(num_cols + 1):
+        if used[col]:
+          u[row_of[col]] += delta
+          v[col] -= delta
+        else:
+          min_to[col] -= delta
+      col0 = col1
+      if row_of[col0] == 0:
+        break
+    while col0 != 0:
+      col1 = way[col0]
+      row_of[col0] = row_of[col1]
+      col0 = col1
+  result = [None] * num_rows
+  for col in range(1, num_cols + 1):
+    if row_of[col] != 0:
+      result[row_of[col] - 1] = col - 1
+  return result
+
+
+# Returns the pairs [header index, cc index] of a bucket of changed
+# functions, of minimal total cost and then in the same order where costs
+# tie. Large buckets are paired in order.
+def _pair_bucket(header_functions, header_types, header_is, cc_functions,
+                 cc_types, cc_is):
+  if len(header_is) == 1 and len(cc_is) == 1:
+    return [[header_is[0], cc_is[0]]]
+  if max(len(header_is), len(cc_is)) > MAX_ASSIGNMENT_SIZE:
+    return zip(header_is, cc_is)
+  h_keys = dict(
+      (i, _cost_key(header_functions[i], header_types[i])) for i in header_is)
+  cc_keys = dict((i, _cost_key(cc_functions[i], cc_types[i])) for i in cc_is)
+  if len(set(h_keys.values())) == 1 and len(set(cc_keys.values())) == 1:
+    # every pair costs the same
+    return zip(header_is, cc_is)
+  transpose = len(header_is) > len(cc_is)
+  rows, cols = [cc_is, header_is] if transpose else [header_is, cc_is]
+  # moves out of order cost less than any edit
+  weight = len(rows) * len(cols) + 1
+  # overloads often have the same types, each cost is computed once
+  key_costs = {}
+  costs = []
+  for row_k in range(len(rows)):
+    row_costs = []
+    for col_k in range(len(cols)):
+      h_i, cc_i = [cols[col_k], rows[row_k]] if transpose else [
+          rows[row_k], cols[col_k]
+      ]
+      pair_key = (h_keys[h_i], cc_keys[cc_i])
+      cost = key_costs.get(pair_key)
+      if cost is None:
+        cost = key_costs[pair_key] = _key_cost(*pair_key)
+      row_costs.append(cost * weight + abs(row_k - col_k))
+    costs.append(row_costs)
+  pairs = []
+  for (row_k, col_k) in enumerate(_min_cost_assignment(costs)):
+    if transpose:
+      pairs.append([cols[col_k], rows[row_k]])
+    else:
+      pairs.append([rows[row_k], cols[col_k]])
+  return pairs
+
+
+# Changed functions are paired among those of the same name with the same
+# parameter types first, then with as many parameters, then with any
+_MATCH_TIERS = [
+    ["same parameter types", lambda f, types: (f.name, types)],
+    ["same arity", lambda f, types: (f.name, len(types))],
+    ["same name", lambda f, types: f.name],
+]
+
+
+def match_functions(header_functions, header_delete, cc_functions, cc_add):
+  """Pairs the header functions at indexes header_delete with the cc
+  functions at indexes cc_add that change them, by name, number and types of
+  parameters, with the fewest edits. Returns a sorted list of [header index,
+  cc index, reason, edits] of the pairs chosen."""
+  # only functions with a name on both sides can pair, and the types of the
+  # others are never needed
+  cc_names = set(cc_functions[i].name for i in cc_add)
+  header_left = [
+      i for i in header_delete if header_functions[i].name in cc_names
+  ]
+  header_names = set(header_functions[i].name for i in header_left)
+  cc_left = [i for i in cc_add if cc_functions[i].name in header_names]
+  header_types = dict(
+      (i, _param_types(header_functions[i])) for i in header_left)
+  cc_types = dict((i, _param_types(cc_functions[i])) for i in cc_left)
+  result = []
+  for (reason, key_of) in _MATCH_TIERS:
+    if len(header_left) == 0 or len(cc_left) == 0:
+      break
+    buckets = {}
+    for i in header_left:
+      buckets.setdefault(key_of(header_functions[i], header_types[i]),
+                         [[], []])[0].append(i)
+    for i in cc_left:
+      key = key_of(cc_functions[i], cc_types[i])
+      if key in buckets:
+        buckets[key][1].append(i)
+    paired_h = set()
+    paired_cc = set()
+    for (header_is, cc_is) in buckets.values():
+      if len(cc_is) == 0:
+        continue
+      for (h_i, cc_i) in _pair_bucket(header_functions, header_types,
+                                      header_is, cc_functions, cc_types,
+                                      cc_is):
+        result.append([
+            h_i, cc_i, reason,
+            _change_cost(header_functions[h_i], header_types[h_i],
+                         cc_functions[cc_i], cc_types[cc_i])
+        ])
+        paired_h.add(h_i)
+        paired_cc.add(cc_i)
+    header_left = [i for i in header_left if i not in paired_h]
+    cc_left = [i for i in cc_left if i not in paired_cc]
+  return sorted(result)
+
+
+# Whether a header function cannot have a definition in a cc file, ie. it is
+# pure virtual or deleted, so that it is never deleted or changed
+def is_declared_only(f):
+  return f.suffix.replace(" ", "").endswith(("=0", "=delete"))
+
+
+# Returns the key of a function as its definition has it, without the words
+# only a declaration has, ie. virtual, override or = 0, so that a declaration
+# and its definition have the same key
+def definition_key(f):
+  words, return_type = _definition_prefix(f)
+  suffix = f.suffix
+  if is_declared_only(f):
+    suffix = suffix.rsplit("=", 1)[0]
+  keys = words + [return_type, f.name]
+  keys.extend(param.decl for param in f.sig)
+  keys.extend(word for word in suffix.split() if word != "override")
+  return " ".join(keys)
+
+
+# Returns [change_to, header_delete, cc_add]: a dict from the index of each
+# changed header function to the cc function it changes to, and the indexes of
+# header functions to delete and of cc functions to add.
 def compare_functions(header_functions, cc_functions):
   cc_keys = {}
   for i in range(len(cc_functions)):
-    cc_keys[cc_functions[i]["key"]] = i
+    cc_keys[cc_functions[i].key] = i
 
   header_delete = []
   for i in range(len(header_functions)):
-    key = header_functions[i]["key"]
+    key = header_functions[i].key
     if key in cc_keys:
       del cc_keys[key]
       continue
-    header_delete.append(i)
+    if not is_declared_only(header_functions[i]):
+      header_delete.append(i)
 
   cc_add = sorted(cc_keys.values())
   if len(cc_add) == 0:
-    # only deletion
-    print "INFO: changed 0, delete", len(header_delete)
-    return []
+    # nothing added, the functions this cc file does not define may be
+    # defined in another one
+    print "INFO: changed 0, delete 0"
+    return [{}, [], []]
   if len(cc_add) == 1 and len(header_delete) == 1:
     # one add and one delete
     h_i = header_delete[0]
     cc_i = cc_add[0]
-    header_functions[h_i]["change_to"] = cc_i
     if DEBUG:
       print "DEBUG: one function changed: ", h_i, " to ", cc_i
     print "INFO: change 1 only"
-    return []
-
-  # last try to pair add and delete by unique function name
-  header_unique = get_uniques(header_functions)
-  cc_unique = get_uniques(cc_functions)
-  header_delete_name_index_map = {}
-  for i in header_delete:
-    header_delete_name_index_map[header_functions[i]["name"]] = i
-  # Real add is final added function from cc files after matching pairs
-  real_add = []
-  change_num = 0
-  for i in cc_add:
-    name = cc_functions[i]["name"]
-    if name in cc_unique and cc_unique[name] >= 0 and name in header_unique and header_unq[name] >= 0:
-      # found pair match
-      header_functions[header_delete_name_index_map[name]]["change_to"] = i
-      del header_delete_name_index_map[name]
-      change_num += 1
-      if DEBUG:
-        print "DEBUG: found pair on", name
-    else:
-      real_add.append(i)
-  header_delete = sorted(header_delete_name_index_map.values())
-  for i in header_delete:
-    header_functions[i]["delete"] = True
-  print "INFO: changed", change_num, "delete", len(header_delete), "add", len(
-      real_add)
-  return real_add
+    return [{h_i: cc_i}, [], []]
+
+  # pair the others by name, arity and parameter types
+  change_to = {}
+  for (h_i, cc_i, reason, edits) in match_functions(
+      header_functions, header_delete, cc_functions, cc_add):
+    change_to[h_i] = cc_i
+    print "INFO: paired %s with %s by %s, %d edits" % (_describe(
+        header_functions[h_i]), _describe(cc_functions[cc_i]), reason, edits)
+  paired_cc = set(change_to.values())
+  header_delete = [i for i in header_delete if i not in change_to]
+  real_add = [i for i in cc_add if i not in paired_cc]
+  print "INFO: changed", len(change_to), "delete", len(
+      header_delete), "add", len(real_add)
+  return [change_to, header_delete, real_add]
 
 
 def generate_function_string(base_f, mod_f=None):
@@ -117,34 +357,37 @@ def generate_function_string(base_f, mod_f=None):
   else:
     target = mod_f
 
-  prefix = target["prefix"]
-  suffix = target["suffix"]
-  name = target["name"]
-  f_return = target["return"]
-  args = target["sig"]
+  words, f_return = _split_prefix(target)
+  suffix = target.suffix
+  name = target.name
+  # [type name, default] of each param
+  args = [[param.decl, param.default] for param in target.sig]
 
   if mod_f is not None:
-    if "static" in base_f["prefix"].split():
-      prefix = "static " + prefix
+    # keep the qualifiers that only the declaration has
+    words = [
+        word for word in _split_prefix(base_f)[0]
+        if word in _DECLARATION_WORDS and word not in words
+    ] + words
 
-    if "override" in base_f["suffix"].split():
-      suffix += " override"
+    if "override" in base_f.suffix.split():
+      suffix = (suffix + " override").strip()
 
     # hash args with default values
     defaults = {}
-    for each_sig in base_f["sig"]:
-      if each_sig[1] is None:
+    for param in base_f.sig:
+      if param.default is None:
         continue
-      defaults[each_sig[0]] = each_sig[1]
+      defaults[param.decl] = param.default
 
     # see if defaults can match
-    for each_sig in mod_f["sig"]:
+    for each_sig in args:
       key = each_sig[0]
       if key in defaults:
         each_sig[1] = defaults[key]
 
   # Now generate string
-  result = " ".join([prefix, f_return, name]) + "("
+  result = " ".join(words + [word for word in [f_return, name] if word]) + "("
   # add args
   arg_str_list = []
   for each_sig in args:
@@ -163,105 +406,516 @@ def generate_function_string(base_f, mod_f=None):
   return result
 
 
-def update_header_file(header_file, header_lines, header_functions,
-                       cc_functions, class_offset):
-  add_function_key(header_functions)
-  add_function_key(cc_functions)
-  cc_add = compare_functions(header_functions, cc_functions)
-  public_pos = cpp_partial_parser.find_public_line(header_lines, class_offset)
-
-  # Now we have everything to process
-  out_file = header_file + ".modified_by_cpp_refactor.h"
-  with open(out_file, "w") as fout:
-    header_f_i = 0
-    header_l_i = 0
-    while header_l_i < len(header_lines):
-      if header_f_i < len(header_functions):
-        curr_f = header_functions[header_f_i]
-        f_range = curr_f["range"]
-        if f_range[0] + class_offset == header_l_i:
-          header_f_i += 1
-          # check function changed or not
-          if "change_to" in curr_f:
-            new_f = generate_function_string(curr_f,
-                                             cc_functions[curr_f["change_to"]])
-            print "INFO: updated:\n   ", generate_function_string(
-                curr_f), "-->", new_f
-            fout.write(new_f)
-            # Jump to next line of current function
-            header_l_i = f_range[1] + class_offset + 1
-            continue
-          if "delete" in curr_f:
-            header_l_i = f_range[1] + class_offset + 1
-            print "INFO: deleted: \n", generate_function_string(curr_f)
-            continue
-
-      # regular write
-      fout.write(header_lines[header_l_i])
-
-      # Check "public:"
-      if header_l_i == public_pos[0]:
-        # write all new function
+# Returns the leading white space of a line
+def _indentation(line):
+  return line[:len(line) - len(line.lstrip())]
+
+
+# classes: list of [class_name, class_offset, header_functions, cc_functions]
+# Returns [replacements, additions, summary] of the edits to the header:
+# replacements maps the first line of each changed or deleted function to
+# [line after the function, new text], additions maps each "public:" line to
+# the texts to add after it. Functions are written with the indentation of the
+# lines they replace, and added ones with that of the first function.
+def plan_header_edits(header_lines, classes):
+  replacements = {}
+  additions = {}
+  summary = {"changed": 0, "deleted": 0, "added": 0}
+  for (class_name, class_offset, header_functions, cc_functions) in classes:
+    print "INFO: class name:", class_name
+    with instrument.phase("compare_functions"):
+      change_to, header_delete, cc_add = compare_functions(
+          header_functions, cc_functions)
+    for (h_i, cc_i) in sorted(change_to.items()):
+      f = header_functions[h_i]
+      first = f.range[0] + class_offset
+      last = f.range[1] + class_offset + 1
+      new_f = _indentation(header_lines[first]) + generate_function_string(
+          f, cc_functions[cc_i])
+      if new_f == "".join(header_lines[i] for i in range(first, last)):
+        # only what the key ignores differs, ie. virtual or override
+        del change_to[h_i]
+        continue
+      print "INFO: updated:\n   ", generate_function_string(f), "-->", new_f
+      replacements[first] = [last, new_f]
+    for h_i in header_delete:
+      f = header_functions[h_i]
+      print "INFO: deleted: \n", generate_function_string(f)
+      replacements[f.range[0] + class_offset] = [
+          f.range[1] + class_offset + 1, ""
+      ]
+    summary["changed"] += len(change_to)
+    summary["deleted"] += len(header_delete)
+    if len(cc_add) > 0:
+      public_pos = cpp_partial_parser.find_public_line(header_lines,
+                                                       class_offset)
+      if public_pos is None:
+        # where to declare them is up to the author of the class
+        print "WARNING: no public: in class %s, not adding:" % class_name
         for add_i in cc_add:
-          new_f = generate_function_string(cc_functions[add_i])
-          print "INFO: added: \n", new_f
-          fout.write(new_f)
+          print "   ", generate_function_string(cc_functions[add_i]),
+        continue
+      if len(header_functions) > 0:
+        indentation = _indentation(
+            header_lines[header_functions[0].range[0] + class_offset])
+      elif public_pos[0] == class_offset:
+        # right after the "{" of a struct
+        indentation = _indentation(header_lines[class_offset]) + "  "
+      else:
+        indentation = _indentation(header_lines[public_pos[0]]) + " "
+      for add_i in cc_add:
+        new_f = indentation + generate_function_string(cc_functions[add_i])
+        print "INFO: added: \n", new_f
+        additions.setdefault(public_pos[0], []).append(new_f)
+      summary["added"] += len(cc_add)
+  return [replacements, additions, summary]
+
+
+# Yields the lines of the header with the planned edits applied
+def apply_header_edits(header_lines, replacements, additions):
+  header_l_i = 0
+  while header_l_i < len(header_lines):
+    if header_l_i in replacements:
+      (next_l_i, new_f) = replacements[header_l_i]
+      if new_f != "":
+        yield new_f
+      # Jump to next line of current function
+      header_l_i = next_l_i
+      continue
 
-      # i++
-      header_l_i += 1
+    # regular write
+    yield header_lines[header_l_i]
+
+    # Check "public:"
+    for new_f in additions.get(header_l_i, ()):
+      yield new_f
+
+    # i++
+    header_l_i += 1
+
+
+# Replaces the file by lines at once, keeping its permissions
+def write_atomically(file_path, lines):
+  import shutil, tempfile
+  fd, tmp_path = tempfile.mkstemp(
+      dir=os.path.dirname(os.path.abspath(file_path)),
+      prefix=".tmp-" + os.path.basename(file_path))
+  try:
+    with os.fdopen(fd, "w") as fout:
+      fout.writelines(lines)
+    shutil.copymode(file_path, tmp_path)
+    os.rename(tmp_path, file_path)
+  except:
+    os.remove(tmp_path)
+    raise
+
+
+# classes: list of [class_name, class_offset, header_functions, cc_functions]
+# All classes are updated in a single rewrite of the header file, and the file
+# is not touched when nothing changes. With write False the header is never
+# written, and the summary has the unified "diff" of the edits instead.
+def update_header_file(header_file, header_lines, classes, write=True):
+  replacements, additions, summary = plan_header_edits(header_lines, classes)
+  if len(replacements) == 0 and len(additions) == 0:
+    print "INFO: header already in sync:", header_file
+    return summary
+
+  new_lines = apply_header_edits(header_lines, replacements, additions)
+  if not write:
+    import difflib
+    summary["diff"] = "".join(
+        difflib.unified_diff(
+            list(header_lines), list(new_lines), header_file, header_file))
+    return summary
 
   if DEBUG:
+    out_file = header_file + ".modified_by_cpp_refactor.h"
+    with open(out_file, "w") as fout:
+      fout.writelines(new_lines)
     #os.system("clang-format " + out_file_unformat + ">" + out_file)
+    import shutil
     shutil.copy(header_file, header_file + ".before_cpp_refactor.h")
     #os.remove(out_file_unformat)
+    return summary
+
+  write_atomically(header_file, new_lines)
+  return summary
+
+
+# Returns a list of [class_name, class_offset, header_functions] of all classes.
+# With jobs over 1, large headers are parsed by a pool of processes. previous
+# is [lines, result] of an earlier parse of the file, to only parse again what
+# changed since.
+def parse_header(header_lines,
+                 cache=None,
+                 header_hash=None,
+                 jobs=1,
+                 previous=None):
+  if cache is not None:
+    result = cache.get("header", header_hash)
+    if result is not None:
+      instrument.add("cache_hits")
+      return result
+    instrument.add("cache_misses")
+
+  header_lines = cpp_partial_parser.as_buffer(header_lines)
+  result = None
+  if previous is not None:
+    result = reparse_header(previous[0], previous[1], header_lines)
+  if result is None:
+    result = _parse_whole_header(header_lines, jobs)
+  if cache is not None:
+    cache.put("header", header_hash, result)
+  return result
 
-  if not DEBUG:
-    shutil.move(out_file, header_file)
 
+def _parse_whole_header(header_lines, jobs):
+  chunks = []
+  if jobs > 1 and header_lines.end - header_lines.start >= PARALLEL_MIN_BYTES:
+    chunks = split_header(header_lines, jobs * CHUNKS_PER_JOB)
+  if len(chunks) > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+      # unlike map, get with a timeout can be interrupted by signals, ie. the
+      # SIGALRM of the batch timeout
+      pool_result = pool.map_async(_parse_header_chunk, chunks, 1)
+      chunk_results = pool_result.get(sys.maxint)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+    result = []
+    for chunk_result in chunk_results:
+      result.extend(chunk_result)
+    return result
+  return _parse_header_classes(header_lines)
+
+
+# Returns [class_name, class_offset, header_functions] of all classes, with
+# first_line added to class_offset. Class names are qualified by their
+# namespaces and enclosing classes, path holding those around header_lines.
+# scopes is the ScopeTree of the whole file when header_lines is a slice of it.
+def _parse_header_classes(header_lines, first_line=0, path=(), scopes=None):
+  result = []
+  header_lines = cpp_partial_parser.as_buffer(header_lines)
+  if scopes is None:
+    scopes = cpp_partial_parser.ScopeTree(header_lines)
+  for (class_name, class_lines,
+       class_offset) in cpp_partial_parser.parse_classes(header_lines):
+    header_functions = cpp_partial_parser.parse_functions(class_lines)
+    class_name = "::".join(path + scopes.path_at(class_lines.start) +
+                           (class_name,))
+    result.append([class_name, class_offset + first_line, header_functions])
+  return result
 
-def main():
-  if len(sys.argv) <= 1:
-    print "Error: need 1 arg as input cc file"
-    exit(1)
-
-  pp = pprint.PrettyPrinter(indent=4)
-  file_path = sys.argv[1]
-
-  header_functions = []
-  header_file = None
-  with open(file_path, "r") as fin:
-    (google3_dir, dummy) = common.find_google3_path(file_path)
-    header_file = google3_dir + "/" + find_header_file(fin)
-
-  header_lines = []
-  with open(header_file, "r") as fheader:
-    header_lines = fheader.readlines()
-
-  # We only support the first class for now
-  (class_name, class_lines,
-   class_offset) = cpp_partial_parser.parse_classes(header_lines)[0]
-  print "INFO: class name:", class_name
-  header_functions = cpp_partial_parser.parse_functions(class_lines)
-  if DEBUG:
-    print "DEBUG: header functions:"
-    pp.pprint(header_functions)
-
-  cc_lines = []
-  with open(file_path, "r") as fin:
-    cc_lines = fin.readlines()
-  # This requires the first "class_name::" is the starting line of cc functions
-  # TODO: process namespace to be more accurate
-  for i in range(len(cc_lines)):
-    if class_name + "::" in cc_lines[i]:
-      cc_lines = cc_lines[i:]
+
+# chunk: [text, first line of the text in the header, namespaces around it]
+def _parse_header_chunk(chunk):
+  return _parse_header_classes(
+      cpp_partial_parser.SourceBuffer(chunk[0]), chunk[1], chunk[2])
+
+
+# Cuts the header at top level splits into at most num_chunks parts of about
+# the same size, returns a list of [text, first line, namespaces around it]
+def split_header(header_lines, num_chunks):
+  scopes = cpp_partial_parser.ScopeTree(header_lines)
+  if not scopes.balanced:
+    return []
+  chunk_size = (header_lines.end - header_lines.start) / num_chunks
+  chunks = []
+  start_i = 0
+  start = header_lines.offset(0, 0)
+  path = ()
+  for (split_i, split_path) in scopes.splits() + [[len(header_lines), ()]]:
+    end = header_lines.line_range(split_i - 1)[1]
+    if end - start < chunk_size and split_i < len(header_lines):
+      continue
+    chunks.append([header_lines.text[start:end], start_i, path])
+    start_i = split_i
+    start = end
+    path = split_path
+  return chunks
+
+
+# Returns [start, end, old_end, scopes]: the lines start to end of new_lines
+# to parse again instead of the lines start to old_end of old_lines, cut at
+# top level splits of both, and the ScopeTree of new_lines. None if braces do
+# not balance, and the whole file has to be parsed.
+def _reparse_span(old_lines, new_lines):
+  old_lines = cpp_partial_parser.as_buffer(old_lines)
+  new_lines = cpp_partial_parser.as_buffer(new_lines)
+  first, old_end, new_end = cpp_partial_parser.line_diff(old_lines, new_lines)
+  old_scopes = cpp_partial_parser.ScopeTree(old_lines)
+  new_scopes = cpp_partial_parser.ScopeTree(new_lines)
+  if not old_scopes.balanced or not new_scopes.balanced:
+    return None
+  old_splits = dict((split_i, path)
+                    for (split_i, path) in old_scopes.splits())
+  shift = len(old_lines) - len(new_lines)
+  start = 0
+  end = len(new_lines)
+  for (split_i, path) in new_scopes.splits():
+    if split_i <= first:
+      if old_splits.get(split_i) == path:
+        start = split_i
+    elif split_i >= new_end and old_splits.get(split_i + shift) == path:
+      end = split_i
       break
-  cc_functions = cpp_partial_parser.parse_functions(cc_lines, class_name)
+  return [start, end, end + shift, new_scopes]
+
+
+def reparse_header(old_lines, old_result, new_lines):
+  """Returns parse_header(new_lines) from old_result of old_lines, parsing
+  only the top level blocks that changed and shifting the class offsets of
+  those after them. None if the whole header has to be parsed."""
+  span = _reparse_span(old_lines, new_lines)
+  if span is None:
+    return None
+  start, end, old_end, scopes = span
+  instrument.add("incremental_parses")
+  instrument.add("incremental_lines", end - start)
+  shift = end - old_end
+  result = [class_info for class_info in old_result if class_info[1] < start]
+  result.extend(
+      _parse_header_classes(scopes.buffer[start:end], start, scopes=scopes))
+  result.extend([class_name, class_offset + shift, header_functions]
+                for (class_name, class_offset, header_functions) in old_result
+                if class_offset >= old_end)
+  return result
+
+
+def reparse_cc(old_lines, old_result, new_lines, class_names):
+  """Returns parse_cc(new_lines, class_names) from old_result of old_lines,
+  parsing only the top level blocks that changed and shifting the ranges of
+  the functions after them. None if the whole file has to be parsed."""
+  if sorted(old_result) != sorted(class_names):
+    return None
+  span = _reparse_span(old_lines, new_lines)
+  if span is None:
+    return None
+  start, end, old_end, scopes = span
+  instrument.add("incremental_parses")
+  instrument.add("incremental_lines", end - start)
+  shift = end - old_end
+  changed = cpp_partial_parser.parse_definitions_between(
+      scopes, class_names, start, end)
+  result = {}
+  for class_name in class_names:
+    functions = [f for f in old_result[class_name] if f.range[0] < start]
+    functions.extend(changed[class_name])
+    functions.extend(
+        f.replace(range=(f.range[0] + shift, f.range[1] + shift))
+        for f in old_result[class_name]
+        if f.range[0] >= old_end)
+    result[class_name] = functions
+  return result
+
+
+# Returns a dict from each of class_names to its functions defined in cc file,
+# with ranges of lines in the whole file. previous is [lines, result] of an
+# earlier parse of the file, to only parse again what changed since.
+def parse_cc(cc_lines, class_names, cache=None, cc_hash=None, previous=None):
+  if cache is not None:
+    key = parse_cache.content_hash(cc_hash + "\0" + ",".join(
+        sorted(class_names)))
+    result = cache.get("cc", key)
+    if result is not None:
+      instrument.add("cache_hits")
+      return result
+    instrument.add("cache_misses")
+
+  result = None
+  if previous is not None:
+    result = reparse_cc(previous[0], previous[1], cc_lines, class_names)
+  if result is None:
+    result = cpp_partial_parser.parse_definitions(cc_lines, class_names)
+  if cache is not None:
+    cache.put("cc", key, result)
+  return result
+
+
+class ParseHistory(object):
+  """The last parse of the max_files files parsed last, for long running
+  processes to pass as previous to parse_header and parse_cc"""
+
+  def __init__(self, max_files=DEFAULT_HISTORY_FILES):
+    self.entries = cpp_partial_parser.LruCache(max_files)
+
+  # Returns [lines, result] of the last parse of the file as kind, ie.
+  # "header" or "cc", or None
+  def get(self, kind, path):
+    entry = self.entries.get((kind, path))
+    if entry is None:
+      return None
+    return entry[:2]
+
+  def put(self, kind, path, lines, content_hash, result):
+    entry = self.entries.get((kind, path))
+    if entry is not None and entry[2] == content_hash:
+      return
+    lines = cpp_partial_parser.as_buffer(lines)
+    # a copy, as a memory mapped file changes when it is written
+    text = lines.text[lines.start:lines.end]
+    self.entries.put((kind, path),
+                     [cpp_partial_parser.SourceBuffer(text), result,
+                      content_hash])
+
+
+# Returns the header included by the cc file, None if it has no such include.
+# cc_lines are the lines of the file if already read.
+def get_header_file(file_path, cc_lines=None):
+  if cc_lines is not None:
+    header = find_header_file(cc_lines)
+  else:
+    with open(file_path, "r") as fin:
+      header = find_header_file(fin)
+  if header is None:
+    return None
+  (google3_dir, dummy) = common.find_google3_path(file_path)
+  return google3_dir + "/" + header
+
+
+# Returns [lines, content hash] of a file. Files are memory mapped rather than
+# read, as generated headers can be larger than the memory we have.
+def read_source(file_path):
+  with instrument.phase("read"):
+    lines = cpp_partial_parser.SourceBuffer.from_file(file_path)
+  with instrument.phase("hash"):
+    return [lines, parse_cache.content_hash(lines.text)]
+
+
+# Returns a read_source taking the files in buffers, a dict from path to
+# content such as unsaved editor buffers, rather than reading them with read
+def buffer_reader(buffers, read=read_source):
+  buffers = dict(
+      (os.path.abspath(path), text) for (path, text) in buffers.items())
+
+  def read_buffer(file_path):
+    text = buffers.get(os.path.abspath(file_path))
+    if text is None:
+      return read(file_path)
+    return [
+        cpp_partial_parser.SourceBuffer(text),
+        parse_cache.content_hash(text)
+    ]
+
+  return read_buffer
+
+
+# Syncs the header of a cc file, returns a summary of the changes.
+# With write False the header is left as is, see update_header_file.
+# Files are read by read, which returns [lines, content hash] like read_source.
+# jobs is the number of processes to parse a large header with. With a
+# ParseHistory, only what changed since the last parse of a file is parsed.
+def sync_file(file_path,
+              cache=None,
+              header_file=None,
+              write=True,
+              read=read_source,
+              jobs=1,
+              history=None):
+  if DEBUG:
+    import pprint
+    pp = pprint.PrettyPrinter(indent=4)
+
+  cc_lines, cc_hash = read(file_path)
+  if header_file is None:
+    header_file = get_header_file(file_path, cc_lines)
+  header_lines, header_hash = read(header_file)
+
+  if cache is not None:
+    if cache.contains("synced", header_hash + cc_hash):
+      instrument.add("cache_hits")
+      print "INFO: unchanged since last run:", file_path
+      return {"unchanged": True}
+
+  with instrument.phase("parse_header"):
+    header_classes = parse_header(
+        header_lines, cache, header_hash, jobs,
+        None if history is None else history.get("header", header_file))
+  if DEBUG:
+    print "DEBUG: header classes:"
+    pp.pprint(header_classes)
+
+  with instrument.phase("parse_cc"):
+    cc_functions = parse_cc(
+        cc_lines, [class_info[0] for class_info in header_classes], cache,
+        cc_hash, None if history is None else history.get("cc", file_path))
+  if history is not None:
+    history.put("header", header_file, header_lines, header_hash,
+                header_classes)
+    history.put("cc", file_path, cc_lines, cc_hash, cc_functions)
   if DEBUG:
     print "Info cc file function definition:"
     pp.pprint(cc_functions)
 
-  update_header_file(header_file, header_lines, header_functions, cc_functions,
-                     class_offset)
+  # Only update classes with functions defined in this cc file
+  classes = []
+  for (class_name, class_offset, header_functions) in header_classes:
+    if len(cc_functions[class_name]) > 0:
+      classes.append([
+          class_name, class_offset, header_functions, cc_functions[class_name]
+      ])
+  with instrument.phase("update_header_file"):
+    summary = update_header_file(header_file, header_lines, classes, write)
+
+  if cache is not None and write and not DEBUG:
+    if any(summary[key] > 0 for key in ["changed", "deleted", "added"]):
+      with open(header_file, "r") as fheader:
+        header_hash = parse_cache.content_hash(fheader.read())
+    cache.put("synced", header_hash + cc_hash, True)
+  return summary
+
+
+def main():
+  import argparse
+  arg_parser = argparse.ArgumentParser(
+      description="Sync the header of a cc file with its definitions")
+  arg_parser.add_argument("cc_file")
+  mode = arg_parser.add_mutually_exclusive_group()
+  mode.add_argument(
+      "--check",
+      action="store_true",
+      help="print the diff without writing, exit 1 if the header is not in "
+      "sync")
+  mode.add_argument(
+      "--diff",
+      action="store_true",
+      help="print the diff without writing the header")
+  arg_parser.add_argument(
+      "-j",
+      "--jobs",
+      type=int,
+      default=1,
+      help="number of processes to parse a large header with")
+  arg_parser.add_argument(
+      "--report",
+      default=os.environ.get(instrument.REPORT_ENV),
+      help="write phase times and counters as json to a file, - for stdout")
+  arg_parser.add_argument(
+      "--profile", help="write a cProfile of the run to this file")
+  arg_parser.add_argument(
+      "--trace_memory",
+      action="store_true",
+      help="add peak traced memory to the report")
+  args = arg_parser.parse_args()
+
+  if args.report or args.profile:
+    instrument.enable(args.profile, args.trace_memory)
+  write = not (args.check or args.diff)
+  summary = sync_file(
+      args.cc_file, parse_cache.default_cache(), write=write, jobs=args.jobs)
+  if args.report:
+    instrument.write_report(args.report)
+  elif args.profile:
+    instrument.report()
+  if summary.get("diff"):
+    sys.stdout.write(summary["diff"])
+    if args.check:
+      exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+"""Runs cpp_refactor over all cc files of directories, globs or file lists
+
+With --changed, only the cc files that changed in the git work tree since a
+base ref, or whose header changed, are synced, within the inputs if any.
+With --watch, the headers of the cc files under the input directories are
+synced whenever those change, until interrupted.
+
+Usage: cpp_refactor_batch.py [-j N] [--timeout SEC] dir|glob|@list_file ...
+       cpp_refactor_batch.py --changed [BASE] [dir ...]
+       cpp_refactor_batch.py --watch [--interval SEC] dir ...
+"""
+
+import argparse, glob, itertools, multiprocessing, os, signal, sys, traceback
+from StringIO import StringIO
+
+import cpp_refactor
+import parse_cache
+import source_watch
+
+DEFAULT_TIMEOUT = 60
+
+# Keys of the summary returned by cpp_refactor.sync_file
+SUMMARY_KEYS = ["changed", "deleted", "added"]
+
+
+class SyncTimeout(Exception):
+  pass
+
+
+def _raise_timeout(signum, frame):
+  raise SyncTimeout()
+
+
+# Expands directories, globs and "@file" lists into a sorted list of cc files
+def find_cc_files(inputs):
+  result = set()
+  for each_input in inputs:
+    if each_input.startswith("@"):
+      with open(each_input[1:], "r") as fin:
+        paths = [line.strip() for line in fin if line.strip() != ""]
+      result.update(find_cc_files(paths))
+    elif os.path.isdir(each_input):
+      for root, dirs, files in os.walk(each_input):
+        for name in files:
+          if name.endswith(".cc"):
+            result.add(os.path.join(root, name))
+    elif glob.has_magic(each_input):
+      result.update(path for path in glob.glob(each_input)
+                    if path.endswith(".cc") and os.path.isfile(path))
+    elif each_input.endswith(".cc"):
+      result.add(each_input)
+  return sorted(result)
+
+
+# Orders files largest first so that the long ones do not run last
+def schedule(cc_files):
+  return sorted(cc_files, key=lambda path: (-os.path.getsize(path), path))
+
+
+# Returns the groups of cc files including the same header, largest first.
+# The files of a group are synced one after another by the same process, as
+# each rewrites the header the others read.
+def group_by_header(cc_files):
+  groups = {}
+  for cc_file in cc_files:
+    try:
+      header_file = cpp_refactor.get_header_file(cc_file)
+    except (IOError, OSError, ValueError):
+      header_file = None
+    key = cc_file if header_file is None else os.path.realpath(header_file)
+    groups.setdefault(key, []).append(cc_file)
+  return sorted(
+      (schedule(group) for group in groups.values()),
+      key=lambda group: (-sum(os.path.getsize(path) for path in group), group))
+
+
+# Returns the cc files including a header large enough to be parsed by
+# several processes
+def find_large_headers(cc_files):
+  result = []
+  for cc_file in cc_files:
+    try:
+      header_file = cpp_refactor.get_header_file(cc_file)
+      if (header_file is not None and os.path.getsize(header_file) >=
+          cpp_refactor.PARALLEL_MIN_BYTES):
+        result.append(cc_file)
+    except (IOError, OSError, ValueError):
+      continue
+  return result
+
+
+_worker_cache = None
+_worker_timeout = DEFAULT_TIMEOUT
+_worker_jobs = 1
+
+
+def _init_worker(timeout, jobs=1):
+  global _worker_cache, _worker_timeout, _worker_jobs
+  _worker_cache = parse_cache.default_cache()
+  _worker_timeout = timeout
+  _worker_jobs = jobs
+  signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+# Returns [cc_file, summary, output, error]
+def _sync_one(cc_file):
+  output = StringIO()
+  stdout = sys.stdout
+  sys.stdout = output
+  summary = None
+  error = None
+  if _worker_timeout > 0:
+    signal.alarm(_worker_timeout)
+  try:
+    header_file = cpp_refactor.get_header_file(cc_file)
+    if header_file is None or not os.path.exists(header_file):
+      error = "no header found"
+    else:
+      summary = cpp_refactor.sync_file(
+          cc_file, _worker_cache, header_file, jobs=_worker_jobs)
+  except SyncTimeout:
+    error = "timed out after %d s" % _worker_timeout
+  except Exception:
+    error = traceback.format_exc()
+  finally:
+    signal.alarm(0)
+    sys.stdout = stdout
+  return [cc_file, summary, output.getvalue(), error]
+
+
+# Returns [cc_file, summary, output, error] of each file of a group in turn
+def _sync_group(cc_files):
+  return [_sync_one(cc_file) for cc_file in cc_files]
+
+
+def run_batch(cc_files, processes=None, timeout=DEFAULT_TIMEOUT, verbose=False):
+  totals = dict((key, 0) for key in SUMMARY_KEYS)
+  modified = []
+  failed = []
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+
+  # Files with a large header are synced one at a time first, each header
+  # parsed in parts by all processes
+  large = find_large_headers(cc_files)
+  results = []
+  if len(large) > 0 and processes > 1:
+    _init_worker(timeout, processes)
+    results = [_sync_one(cc_file) for cc_file in schedule(large)]
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+  else:
+    large = []
+  small = sorted(set(cc_files) - set(large))
+
+  pool = multiprocessing.Pool(processes, _init_worker, (timeout,))
+  try:
+    # chunksize 1 keeps the largest first order
+    for (cc_file, summary, output, error) in itertools.chain(
+        results,
+        itertools.chain.from_iterable(
+            pool.imap_unordered(_sync_group, group_by_header(small), 1))):
+      if verbose and output != "":
+        print "INFO: ==== %s\n%s" % (cc_file, output.rstrip())
+      if error is not None:
+        failed.append([cc_file, error])
+        continue
+      if summary.get("unchanged"):
+        continue
+      for key in SUMMARY_KEYS:
+        totals[key] += summary[key]
+      if any(summary[key] > 0 for key in SUMMARY_KEYS):
+        modified.append(cc_file)
+  finally:
+    pool.close()
+    pool.join()
+
+  print "INFO: files", len(cc_files), "modified", len(modified), "in sync", len(
+      cc_files) - len(modified) - len(failed), "failed", len(failed)
+  print "INFO: changed", totals["changed"], "delete", totals[
+      "deleted"], "add", totals["added"]
+  for cc_file in modified:
+    print "INFO: modified header of", cc_file
+  for (cc_file, error) in failed:
+    print "ERROR:", cc_file, error.strip().splitlines()[-1]
+  return len(failed) == 0
+
+
+def main():
+  arg_parser = argparse.ArgumentParser(
+      description="Sync headers of many cc files in parallel")
+  arg_parser.add_argument(
+      "inputs", nargs="*", help="directories, globs, cc files or @list_file")
+  arg_parser.add_argument(
+      "--changed",
+      nargs="?",
+      const="HEAD",
+      metavar="BASE",
+      help="only cc files changed since the merge base with BASE (HEAD by "
+      "default), staged, unstaged or untracked, and those whose header "
+      "changed")
+  arg_parser.add_argument(
+      "--watch",
+      action="store_true",
+      help="keep the headers in sync as the cc files and headers under the "
+      "input directories change, until interrupted")
+  arg_parser.add_argument(
+      "--interval",
+      type=float,
+      default=source_watch.DEFAULT_INTERVAL,
+      help="seconds between polls of --watch")
+  arg_parser.add_argument(
+      "-j", "--jobs", type=int, default=None, help="number of processes")
+  arg_parser.add_argument(
+      "--timeout",
+      type=int,
+      default=DEFAULT_TIMEOUT,
+      help="seconds per file, 0 for no limit")
+  arg_parser.add_argument(
+      "-v", "--verbose", action="store_true", help="print output of each file")
+  args = arg_parser.parse_args()
+
+  if args.watch:
+    if len(args.inputs) == 0 or not all(
+        os.path.isdir(each_input) for each_input in args.inputs):
+      arg_parser.error("--watch needs directories")
+    try:
+      source_watch.watch(
+          args.inputs,
+          args.interval,
+          verbose=args.verbose,
+          cache=parse_cache.default_cache())
+    except KeyboardInterrupt:
+      pass
+    return
+  if args.changed is not None:
+    import git_changes
+    cc_files = git_changes.affected_cc_files(os.getcwd(), args.changed)
+    if len(args.inputs) > 0:
+      prefixes = tuple(
+          os.path.join(os.path.realpath(each_input), "")
+          for each_input in args.inputs)
+      cc_files = [path for path in cc_files if path.startswith(prefixes)]
+    if len(cc_files) == 0:
+      print "INFO: no changed cc file"
+      return
+  else:
+    if len(args.inputs) == 0:
+      arg_parser.error("need inputs or --changed")
+    cc_files = find_cc_files(args.inputs)
+  if len(cc_files) == 0:
+    print "Error: no cc file found"
+    exit(1)
+  if not run_batch(cc_files, args.jobs, args.timeout, args.verbose):
+    exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,89 @@
+"""Tests of cpp_refactor_batch
+"""
+
+import os, signal, time, unittest
+
+import cpp_refactor
+import cpp_refactor_batch
+import parse_cache
+import test_util
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def setUp(self):
+    test_util.SourceTreeTest.setUp(self)
+    self.cache_dir = os.environ.get(parse_cache.CACHE_DIR_ENV)
+    os.environ[parse_cache.CACHE_DIR_ENV] = ""
+
+  def tearDown(self):
+    if self.cache_dir is None:
+      del os.environ[parse_cache.CACHE_DIR_ENV]
+    else:
+      os.environ[parse_cache.CACHE_DIR_ENV] = self.cache_dir
+    test_util.SourceTreeTest.tearDown(self)
+
+  def test_find_cc_files(self):
+    self.write("google3/b/b.cc", "")
+    self.write("google3/b/b.h", "")
+    self.write("list", self.path("google3/b/b.cc") + "\n\n")
+    self.assertEqual(
+        cpp_refactor_batch.find_cc_files([self.path("google3")]),
+        [self.path("google3/a/a.cc"),
+         self.path("google3/b/b.cc")])
+    self.assertEqual(
+        cpp_refactor_batch.find_cc_files(
+            [self.path("google3/*/*"), "@" + self.path("list")]),
+        [self.path("google3/a/a.cc"),
+         self.path("google3/b/b.cc")])
+    self.assertEqual(
+        cpp_refactor_batch.find_cc_files(
+            [self.path("google3/b/b.h"), self.path("google3/c.cc")]),
+        [self.path("google3/c.cc")])
+
+  def test_run_batch(self):
+    # both files of a header are synced, one after the other
+    self.write("google3/a/a.h",
+               "class A {\n public:\n  void f();\n  int g();\n};\n")
+    self.write("google3/a/a_more.cc", '#include "a/a.h"\nint A::g() {}\n')
+    self.write("google3/a/a.cc",
+               '#include "a/a.h"\nvoid A::f(int x) {}\nint A::g() {}\n')
+    self.write("google3/b/b.h", "class B {\n public:\n  void f();\n};\n")
+    self.write("google3/b/b.cc", '#include "b/b.h"\nvoid B::f() {}\n')
+    cc_files = cpp_refactor_batch.find_cc_files([self.path("google3")])
+    self.assertEqual(
+        cpp_refactor_batch.group_by_header(cc_files),
+        [[self.path("google3/a/a.cc"),
+          self.path("google3/a/a_more.cc")], [self.path("google3/b/b.cc")]])
+    self.assertTrue(cpp_refactor_batch.run_batch(cc_files, 2))
+    header = self.read("google3/a/a.h")
+    self.assertIn("  int g();\n", header)
+    self.assertIn("  void f(int x);\n", header)
+
+    # a file without its header fails the batch
+    self.write("google3/c/c.cc", '#include "c/c.h"\n')
+    self.assertFalse(
+        cpp_refactor_batch.run_batch([self.path("google3/c/c.cc")], 1))
+
+  def test_timeout(self):
+
+    def sync_file(*args, **kwargs):
+      time.sleep(5)
+
+    handler = signal.getsignal(signal.SIGALRM)
+    original = cpp_refactor.sync_file
+    cpp_refactor.sync_file = sync_file
+    try:
+      cpp_refactor_batch._init_worker(1)
+      cc_file, summary, output, error = cpp_refactor_batch._sync_one(
+          self.path("google3/a/a.cc"))
+    finally:
+      cpp_refactor.sync_file = original
+      signal.signal(signal.SIGALRM, handler)
+    self.assertEqual(summary, None)
+    self.assertEqual(error, "timed out after 1 s")
+
+
+if __name__ == "__main__":
+
+  unittest.main()
@@ -0,0 +1,682 @@
+#!/usr/bin/python
+"""Benchmarks of the cpp_refactor phases on generated C++ corpora
+
+Every phase is timed on its own, as the best CPU time of several runs, so
+that other processes do not count, and compared against the committed
+baseline file. Times are scaled by a calibration workload that tokenizes
+like the parser, so the baseline can be compared across machines.
+
+The import time of the save hook modules is checked against a budget, and
+so is the absence of modules only other modes need.
+
+With --scaling, phases are instead timed on pathological inputs of growing
+sizes, and fail if their time grows faster than MAX_GROWTH_EXPONENT allows,
+ie. quadratically, so that one odd file cannot stall a batch run.
+
+With --differential, the classes of the generated corpora and of the headers
+given are parsed by both engines of parse_functions, the regular expression
+fast path and Parser alone. Their hit rate of the fast path is printed, and
+any class they parse differently fails the run.
+
+Usage: cpp_refactor_benchmark.py [--corpus NAME] [--update_baseline]
+       cpp_refactor_benchmark.py --scaling [--case NAME]
+       cpp_refactor_benchmark.py --differential [HEADER|DIR ...]
+"""
+
+import argparse, json, math, os, random, re, shutil, subprocess, sys
+import tempfile, time
+from StringIO import StringIO
+
+import cpp_partial_parser
+import cpp_refactor
+import instrument
+
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "cpp_refactor_benchmark_baseline.json")
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_REPEAT = 5
+# Slowdowns below this many seconds are noise, whatever their ratio is
+MIN_REGRESSION = 0.002
+
+# name -> generator arguments
+CORPORA = {
+    "small": {
+        "classes": 2,
+        "methods": 20,
+        "params": 2,
+        "nesting": 1,
+        "comment_density": 0.2,
+    },
+    "many_classes": {
+        "classes": 50,
+        "methods": 40,
+        "params": 3,
+        "nesting": 1,
+        "comment_density": 0.3,
+    },
+    "long_signatures": {
+        "classes": 5,
+        "methods": 60,
+        "params": 12,
+        "nesting": 2,
+        "comment_density": 0.1,
+    },
+    "deep_nesting": {
+        "classes": 5,
+        "methods": 60,
+        "params": 3,
+        "nesting": 8,
+        "comment_density": 0.1,
+    },
+    "comment_heavy": {
+        "classes": 5,
+        "methods": 60,
+        "params": 3,
+        "nesting": 1,
+        "comment_density": 1.0,
+    },
+}
+
+# Seconds to import each module at the baseline calibration
+IMPORT_BUDGETS = {
+    "cpp_refactor": 0.01,
+    "cpp_refactor_client": 0.02,
+}
+# module -> modules its import must not load
+IMPORT_FORBIDDEN = {
+    "cpp_refactor": [
+        "argparse", "cPickle", "cProfile", "difflib", "glob", "hashlib",
+        "json", "pprint", "numpy", "resource", "subprocess", "tempfile",
+        "unittest"
+    ],
+    "cpp_refactor_client": [
+        "cpp_partial_parser", "cpp_refactor", "tempfile", "unittest"
+    ],
+}
+_IMPORT_SCRIPT = """
+import json, sys, time
+before = set(sys.modules)
+start = time.time()
+import %s
+elapsed = time.time() - start
+print json.dumps([elapsed, [name for name in set(sys.modules) - before
+                            if sys.modules[name] is not None]])
+"""
+
+PHASES = [
+    "find", "parse_classes", "parse_functions", "parse_sig",
+    "compare_functions", "update_header_file"
+]
+
+# Pathological input -> [size of its smallest run, phases timed on it]
+SCALING_CASES = {
+    "long_line": [200, ["parse_classes", "parse_functions"]],
+    "nested_templates": [50, ["parse_functions", "parse_sig"]],
+    "block_comment": [2000, ["parse_classes", "parse_functions"]],
+    "overloads": [250, ["parse_functions", "compare_functions"]],
+}
+# Inputs are timed at the smallest size times each of these
+SCALING_FACTORS = [1, 2, 4, 8]
+# Largest allowed exponent k of the time growing as size ** k, 1 being linear
+# and 2 quadratic
+MAX_GROWTH_EXPONENT = 1.5
+
+_TYPES = ["int", "bool", "double", "const std::string&", "absl::string_view"]
+
+
+def _param_type(rand, nesting):
+  param_type = rand.choice(_TYPES)
+  for depth in range(rand.randint(0, nesting)):
+    param_type = param_type.replace("const ", "").rstrip("&")
+    param_type = "std::vector<%s>" % param_type
+  if nesting > 1 and rand.random() < 0.5:
+    param_type = "const std::map<int, %s>&" % param_type.rstrip("&")
+  return param_type
+
+
+def _signature(rand, params, nesting):
+  args = []
+  for i in range(rand.randint(0, params)):
+    arg = "%s a%d" % (_param_type(rand, nesting), i)
+    if i == params - 1 and rand.random() < 0.3:
+      arg += " = {}"
+    args.append(arg)
+  return "(" + ", ".join(args) + ")"
+
+
+def _inline_body(nesting):
+  body = "x_ += 1;"
+  for depth in range(nesting):
+    body = "if (x_ < %d) { %s }" % (depth, body)
+  return "{ " + body + " }"
+
+
+def _template(depth):
+  return "std::vector<" * depth + "int" + ">" * depth
+
+
+def scaling_input(case, size):
+  """Returns [header_text, sig_strings] of a pathological input of size:
+  a class on a single line of size methods, methods with templates nested
+  size deep, a class after a block comment of size lines, or a class of size
+  overloads of one method."""
+  sig_strings = []
+  if case == "long_line":
+    header = "class A { public: %s };\n" % " ".join(
+        "void F%d(int a, std::map<int, int> b = {});" % i
+        for i in range(size))
+  elif case == "nested_templates":
+    sig_strings = [
+        "(%s a%d, %s b = {})" % (_template(size), i, _template(size))
+        for i in range(10)
+    ]
+    header = "class A {\n public:\n%s};\n" % "".join(
+        "  %s F%d(%s a);\n" % (_template(size), i, _template(size))
+        for i in range(10))
+  elif case == "block_comment":
+    header = ("/*\n%s */\nclass A {\n public:\n  /*\n%s   */\n  void F();\n"
+              "};\n" % (" * { ( < text\n" * size, "   * ) } > text\n" * size))
+  elif case == "overloads":
+    header = "class A {\n public:\n%s};\n" % "".join(
+        "  void F(int a%d, double b);\n" % i for i in range(size))
+  else:
+    raise ValueError("unknown scaling case %s" % case)
+  return [header, sig_strings]
+
+
+def generate_corpus(classes,
+                    methods,
+                    params,
+                    nesting,
+                    comment_density,
+                    changes=0.1,
+                    seed=0):
+  """Returns [header_text, cc_text, sig_strings] of a generated class set.
+
+  A fraction of changes of the methods is only declared in the header, and
+  as many new methods are only defined in the cc file.
+  """
+  rand = random.Random(seed)
+  header = ["#ifndef BENCH_BENCH_H_\n", "#define BENCH_BENCH_H_\n", "\n",
+            "#include <map>\n", "#include <string>\n", "#include <vector>\n",
+            "\n", "namespace bench {\n", "\n"]
+  cc = ['#include "bench/bench.h"\n', "\n", "namespace bench {\n", "\n"]
+  sig_strings = []
+  for class_i in range(classes):
+    class_name = "Class%d" % class_i
+    if rand.random() < comment_density:
+      header.append("/* %s is generated.\n * It has %d methods.\n */\n" %
+                    (class_name, methods))
+    header.append("class %s : public Base<%s> {\n" % (class_name, class_name))
+    header.append(" public:\n")
+    for method_i in range(methods):
+      sig = _signature(rand, params, nesting)
+      sig_strings.append(sig)
+      return_type = rand.choice(["void", "int", "bool"])
+      suffix = rand.choice(["", " const", " override"])
+      if rand.random() < comment_density:
+        header.append("  // Method%d does something, (really) <maybe>.\n" %
+                      method_i)
+      if method_i % 10 == 9:
+        header.append("  void Inline%d() %s\n" %
+                      (method_i, _inline_body(nesting)))
+      is_deleted = rand.random() < changes
+      header.append("  %s Method%d%s%s;\n" % (return_type, method_i, sig,
+                                               suffix))
+      if is_deleted:
+        continue
+      cc.append("%s %s::Method%d%s%s {\n  %s\n}\n\n" %
+                (return_type, class_name, method_i, sig.replace(" = {}", ""),
+                 suffix.replace(" override", ""), _inline_body(nesting)))
+      if rand.random() < changes:
+        cc.append("int %s::NewMethod%d(int a, int b) const {\n"
+                  "  return a + b;\n}\n\n" % (class_name, method_i))
+    header.append("\n private:\n  int x_;\n};\n\n")
+  header.append("}  // namespace bench\n\n#endif  // BENCH_BENCH_H_\n")
+  cc.append("}  // namespace bench\n")
+  return ["".join(header), "".join(cc), sig_strings]
+
+
+# Returns the best CPU time of repeat runs of fn(setup()), as the wall time
+# of a run also has whatever else the machine runs meanwhile
+def time_phase(fn, setup, repeat):
+  best = None
+  for i in range(repeat):
+    args = setup()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+      start = time.clock()
+      fn(*args)
+      elapsed = time.clock() - start
+    finally:
+      sys.stdout = stdout
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+_CALIBRATION_TEXT = "".join(
+    "  virtual const std::vector<int>& Method%d(int a, const Foo<Bar>* b) "
+    "const;  // comment %d\n" % (i, i) for i in range(1500))
+_CALIBRATION_RE = re.compile(r"//[^\n]*|\w+|[^\w\s]")
+
+
+# Time of a fixed workload of regular expressions, string and dict
+# operations like the parser's, but none of its code, to scale results
+# between machines
+def calibrate(repeat=DEFAULT_REPEAT):
+
+  def tokenize():
+    counts = {}
+    depth = 0
+    for line in _CALIBRATION_TEXT.splitlines(True):
+      for token in _CALIBRATION_RE.findall(line):
+        if token in "(<":
+          depth += 1
+        elif token in ")>":
+          depth -= 1
+        counts[token] = counts.get(token, 0) + 1
+      " ".join(line.split())
+    return counts
+
+  return time_phase(tokenize, lambda: [], repeat)
+
+
+def _find_all(parser):
+  while parser.find("(", cpp_partial_parser.COMMON_EXCLUDE_PAIRS) is not None:
+    pass
+
+
+def _parse_all_functions(classes):
+  for (class_name, class_lines, class_offset) in classes:
+    cpp_partial_parser.parse_functions(class_lines)
+
+
+def _parse_all_sigs(sig_strings):
+  for sig_string in sig_strings:
+    cpp_partial_parser.parse_sig(sig_string)
+
+
+def _compare_all(class_pairs):
+  for (header_functions, cc_functions) in class_pairs:
+    cpp_refactor.compare_functions(header_functions, cc_functions)
+
+
+# Parse phases start without the signatures parsed by earlier runs
+def _cold(args):
+  cpp_partial_parser.clear_sig_cache()
+  return args
+
+
+def benchmark_corpus(config, repeat=DEFAULT_REPEAT):
+  """Returns a dict from each phase to its best time in seconds"""
+  header_text, cc_text, sig_strings = generate_corpus(**config)
+  header = cpp_partial_parser.SourceBuffer(header_text)
+  cc = cpp_partial_parser.SourceBuffer(cc_text)
+  classes = cpp_partial_parser.parse_classes(header)
+  class_names = [class_info[0] for class_info in classes]
+  header_functions = [
+      cpp_partial_parser.parse_functions(class_lines)
+      for (class_name, class_lines, class_offset) in classes
+  ]
+  cc_functions = cpp_partial_parser.parse_definitions(cc, class_names)
+
+  def class_pairs():
+    return [[[header_functions[i], cc_functions[class_names[i]]]
+             for i in range(len(classes))]]
+
+  tmp_dir = tempfile.mkdtemp()
+  header_file = os.path.join(tmp_dir, "bench.h")
+  with open(header_file, "w") as fout:
+    fout.write(header_text)
+
+  def update_args():
+    update_classes = []
+    for i in range(len(classes)):
+      update_classes.append([
+          class_names[i], classes[i][2], header_functions[i],
+          cc_functions[class_names[i]]
+      ])
+    return [header_file, header, update_classes]
+
+  try:
+    return {
+        "find":
+            time_phase(_find_all, lambda: [cpp_partial_parser.Parser(header)],
+                       repeat),
+        "parse_classes":
+            time_phase(cpp_partial_parser.parse_classes, lambda: [header],
+                       repeat),
+        "parse_functions":
+            time_phase(_parse_all_functions, lambda: _cold([classes]), repeat),
+        "parse_sig":
+            time_phase(_parse_all_sigs, lambda: _cold([sig_strings]), repeat),
+        "compare_functions":
+            time_phase(_compare_all, class_pairs, repeat),
+        "update_header_file":
+            time_phase(cpp_refactor.update_header_file, update_args, repeat),
+    }
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+# Returns the best time of phase on the input of scaling_input
+def time_scaling_phase(phase, header_text, sig_strings, repeat):
+  header = cpp_partial_parser.SourceBuffer(header_text)
+  if phase == "parse_classes":
+    return time_phase(cpp_partial_parser.parse_classes, lambda: [header],
+                      repeat)
+  if phase == "parse_sig":
+    return time_phase(_parse_all_sigs, lambda: _cold([sig_strings]), repeat)
+  classes = cpp_partial_parser.parse_classes(header)
+  if phase == "parse_functions":
+    return time_phase(_parse_all_functions, lambda: _cold([classes]), repeat)
+  # every tenth function changed its parameters in the cc file, so they are
+  # all paired by match_functions, compared many times to take long enough to
+  # time
+  class_pairs = []
+  for (class_name, class_lines, class_offset) in classes:
+    header_functions = cpp_partial_parser.parse_functions(class_lines)
+    cc_functions = [
+        f.replace(sig=f.sig[1:] + (cpp_partial_parser.Param("int c%d" % k),))
+        if k % 10 == 0 else f for (k, f) in enumerate(header_functions)
+    ]
+    class_pairs.append([header_functions, cc_functions])
+  return time_phase(_compare_all, lambda: [class_pairs * 20], repeat)
+
+
+def measure_scaling(case, repeat=DEFAULT_REPEAT):
+  """Returns [sizes, {phase: best seconds at each size}] of a scaling case"""
+  base_size, phases = SCALING_CASES[case]
+  sizes = [base_size * factor for factor in SCALING_FACTORS]
+  times = dict((phase, []) for phase in phases)
+  for size in sizes:
+    header_text, sig_strings = scaling_input(case, size)
+    for phase in phases:
+      times[phase].append(
+          time_scaling_phase(phase, header_text, sig_strings, repeat))
+  return [sizes, times]
+
+
+def growth_exponent(sizes, times):
+  """Returns k of the time growing as size ** k, the slope of the least
+  squares line through the log of times by the log of sizes, which one noisy
+  run moves less than the ratio of two"""
+  xs = [math.log(size) for size in sizes]
+  # a run too quick for the clock counts as one microsecond
+  ys = [math.log(max(t, 1e-6)) for t in times]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+  return (sum((x - mean_x) * (y - mean_y) for (x, y) in zip(xs, ys)) /
+          sum((x - mean_x)**2 for x in xs))
+
+
+def check_scaling(results, max_exponent=MAX_GROWTH_EXPONENT):
+  """Returns a list of [case, phase, exponent] of the results of
+  measure_scaling by case that grow faster than max_exponent"""
+  errors = []
+  for case, (sizes, times) in sorted(results.items()):
+    for phase, phase_times in sorted(times.items()):
+      exponent = growth_exponent(sizes, phase_times)
+      if exponent > max_exponent:
+        errors.append([case, phase, exponent])
+  return errors
+
+
+# Returns the functions parse_functions finds in lines with
+# cpp_partial_parser.FAST_PATH set to fast_path, or AssertionError if it
+# raises one
+def _parse_with(fast_path, lines):
+  saved = cpp_partial_parser.FAST_PATH
+  cpp_partial_parser.FAST_PATH = fast_path
+  try:
+    return cpp_partial_parser.parse_functions(lines)
+  except AssertionError:
+    return AssertionError
+  finally:
+    cpp_partial_parser.FAST_PATH = saved
+
+
+def generated_headers():
+  """Returns a dict from a name to the header of each corpus and scaling
+  case, at its smallest size"""
+  headers = {}
+  for name in sorted(CORPORA.keys()):
+    headers["corpus " + name] = generate_corpus(**CORPORA[name])[0]
+  for case in sorted(SCALING_CASES.keys()):
+    headers["scaling " + case] = scaling_input(case,
+                                               SCALING_CASES[case][0])[0]
+  return headers
+
+
+# Returns the headers under paths, which are files or directories
+def find_headers(paths):
+  headers = []
+  for path in paths:
+    if not os.path.isdir(path):
+      headers.append(path)
+      continue
+    for (dir_path, dir_names, file_names) in os.walk(path):
+      dir_names.sort()
+      headers.extend(
+          os.path.join(dir_path, name)
+          for name in sorted(file_names)
+          if name.endswith(".h"))
+  return headers
+
+
+def differential(header_texts):
+  """Parses every class of header_texts, a dict from a name to a header,
+  with the fast path of parse_functions and with Parser only. Returns
+  [{name: [lines taken by the fast path, lines of classes]}, a list of
+  [name, class name] of the classes they parse differently]."""
+  enabled = instrument.enabled()
+  if not enabled:
+    instrument.enable()
+  hits = {}
+  mismatches = []
+  try:
+    for name, header_text in sorted(header_texts.items()):
+      counters = instrument.counters
+      before = [counters["fast_path_lines"], counters["parser_path_lines"]]
+      for (class_name, class_lines, class_offset) in (
+          cpp_partial_parser.parse_classes(
+              cpp_partial_parser.SourceBuffer(header_text))):
+        if _parse_with("1", class_lines) != _parse_with("0", class_lines):
+          mismatches.append([name, class_name])
+      fast_lines = counters["fast_path_lines"] - before[0]
+      hits[name] = [
+          fast_lines,
+          fast_lines + counters["parser_path_lines"] - before[1]
+      ]
+  finally:
+    if not enabled:
+      instrument.disable()
+  return [hits, mismatches]
+
+
+# Returns [best import seconds, modules loaded by the import] in a new python.
+# Bytecode is written by the first run, as a save hook imports from it.
+def measure_import(module, repeat=DEFAULT_REPEAT):
+  env = dict(os.environ)
+  env.pop("PYTHONDONTWRITEBYTECODE", None)
+  best = None
+  for i in range(repeat + 1):
+    output = subprocess.check_output(
+        [sys.executable, "-c", _IMPORT_SCRIPT % module],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env)
+    elapsed, loaded = json.loads(output)
+    if best is None or elapsed < best:
+      best = elapsed
+  return [best, sorted(loaded)]
+
+
+def check_startup(startup, scale=1.0):
+  """Returns a list of errors of the modules that are over their import
+  budget, or load a forbidden module. Times are multiplied by scale."""
+  errors = []
+  for module, (elapsed, loaded) in sorted(startup.items()):
+    if elapsed * scale > IMPORT_BUDGETS[module]:
+      errors.append("import of %s takes %.2f ms, over %.2f ms" %
+                    (module, elapsed * scale * 1000,
+                     IMPORT_BUDGETS[module] * 1000))
+    for name in IMPORT_FORBIDDEN[module]:
+      if name in loaded:
+        errors.append("import of %s loads %s" % (module, name))
+  return errors
+
+
+def run_benchmarks(corpus_names, repeat=DEFAULT_REPEAT):
+  """Returns {"calibration": seconds, "corpora": {name: {phase: seconds}}}"""
+  results = {"calibration": calibrate(repeat), "corpora": {}, "startup": {}}
+  for name in corpus_names:
+    results["corpora"][name] = benchmark_corpus(CORPORA[name], repeat)
+  # calibrated again after the corpora, like the phases the best time is
+  # the one least disturbed by the rest of the machine
+  results["calibration"] = min(results["calibration"], calibrate(repeat))
+  for module in sorted(IMPORT_BUDGETS.keys()):
+    results["startup"][module] = measure_import(module, repeat)
+  return results
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+  """Returns a list of [corpus, phase, baseline_time, scaled_time] that are
+  slower than the baseline by more than tolerance"""
+  scale = baseline["calibration"] / results["calibration"]
+  regressions = []
+  for name, phases in sorted(results["corpora"].items()):
+    baseline_phases = baseline["corpora"].get(name, {})
+    for phase in PHASES:
+      if phase not in baseline_phases:
+        continue
+      scaled = phases[phase] * scale
+      allowed = max(baseline_phases[phase] * tolerance, MIN_REGRESSION)
+      if scaled > baseline_phases[phase] + allowed:
+        regressions.append([name, phase, baseline_phases[phase], scaled])
+  return regressions
+
+
+def main():
+  arg_parser = argparse.ArgumentParser(
+      description="Benchmark cpp_refactor phases against a baseline")
+  arg_parser.add_argument(
+      "--corpus",
+      action="append",
+      choices=sorted(CORPORA.keys()),
+      help="corpus to run, all by default")
+  arg_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+  arg_parser.add_argument(
+      "--tolerance",
+      type=float,
+      default=DEFAULT_TOLERANCE,
+      help="allowed slowdown ratio over the baseline")
+  arg_parser.add_argument("--baseline", default=BASELINE_FILE)
+  arg_parser.add_argument(
+      "--update_baseline",
+      action="store_true",
+      help="write the results as the new baseline")
+  arg_parser.add_argument(
+      "--scaling",
+      action="store_true",
+      help="check how phases scale on pathological inputs instead")
+  arg_parser.add_argument(
+      "--case",
+      action="append",
+      choices=sorted(SCALING_CASES.keys()),
+      help="scaling case to run, all by default")
+  arg_parser.add_argument(
+      "--max_exponent",
+      type=float,
+      default=MAX_GROWTH_EXPONENT,
+      help="allowed exponent of the time growth with the input size")
+  arg_parser.add_argument(
+      "--differential",
+      nargs="*",
+      metavar="PATH",
+      help="cross-check the fast path of parse_functions against Parser on "
+      "the generated corpora and the headers under PATH instead")
+  args = arg_parser.parse_args()
+
+  if args.differential is not None:
+    header_texts = generated_headers()
+    for path in find_headers(args.differential):
+      with open(path, "r") as fin:
+        header_texts[path] = fin.read()
+    hits, mismatches = differential(header_texts)
+    total = [0, 0]
+    for name, (fast_lines, num_lines) in sorted(hits.items()):
+      total = [total[0] + fast_lines, total[1] + num_lines]
+      print "%-28s fast path %5.1f%% of %d lines" % (
+          name, 100.0 * fast_lines / max(num_lines, 1), num_lines)
+    print "%-28s fast path %5.1f%% of %d lines" % (
+        "total", 100.0 * total[0] / max(total[1], 1), total[1])
+    for (name, class_name) in mismatches:
+      print "ERROR: fast path differs from Parser on %s class %s" % (
+          name, class_name)
+    if len(mismatches) > 0:
+      exit(1)
+    return
+
+  if args.scaling:
+    results = {}
+    for case in args.case or sorted(SCALING_CASES.keys()):
+      results[case] = measure_scaling(case, args.repeat)
+      sizes, times = results[case]
+      for phase, phase_times in sorted(times.items()):
+        print "%-16s %-20s %s exponent %.2f" % (
+            case, phase, " ".join("%.2f ms" % (t * 1000) for t in phase_times),
+            growth_exponent(sizes, phase_times))
+    errors = check_scaling(results, args.max_exponent)
+    for (case, phase, exponent) in errors:
+      print "ERROR: %s %s grows as size ** %.2f, over %.2f" % (
+          case, phase, exponent, args.max_exponent)
+    if len(errors) > 0:
+      exit(1)
+    return
+
+  corpus_names = args.corpus or sorted(CORPORA.keys())
+  results = run_benchmarks(corpus_names, args.repeat)
+  for name in corpus_names:
+    for phase in PHASES:
+      print "%-16s %-20s %9.2f ms" % (name, phase,
+                                      results["corpora"][name][phase] * 1000)
+  for module, (elapsed, loaded) in sorted(results["startup"].items()):
+    print "%-16s %-20s %9.2f ms" % ("import", module, elapsed * 1000)
+
+  if args.update_baseline:
+    with open(args.baseline, "w") as fout:
+      json.dump(
+          results, fout, indent=2, sort_keys=True, separators=(",", ": "))
+      fout.write("\n")
+    print "INFO: baseline written to", args.baseline
+    return
+
+  baseline = None
+  scale = 1.0
+  if os.path.exists(args.baseline):
+    with open(args.baseline, "r") as fin:
+      baseline = json.load(fin)
+    scale = baseline["calibration"] / results["calibration"]
+  else:
+    print "INFO: no baseline at", args.baseline
+  startup_errors = check_startup(results["startup"], scale)
+  for error in startup_errors:
+    print "ERROR:", error
+  if baseline is None:
+    if len(startup_errors) > 0:
+      exit(1)
+    return
+  regressions = compare_to_baseline(results, baseline, args.tolerance)
+  for (name, phase, baseline_time, scaled) in regressions:
+    print "ERROR: regression in %s %s: %.2f ms -> %.2f ms" % (
+        name, phase, baseline_time * 1000, scaled * 1000)
+  if len(regressions) > 0 or len(startup_errors) > 0:
+    exit(1)
+  print "INFO: no regression over", args.baseline
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+"""Scaling guards of the parser phases on pathological inputs, and the
+differential check of the fast path of parse_functions
+
+Each phase must grow about linearly with the size of the input, see
+cpp_refactor_benchmark.MAX_GROWTH_EXPONENT.
+"""
+
+import unittest
+
+import cpp_partial_parser
+import cpp_refactor_benchmark
+from cpp_partial_parser import SourceBuffer, parse_classes, parse_functions
+from cpp_refactor_benchmark import (MAX_GROWTH_EXPONENT, check_scaling,
+                                    check_startup, differential,
+                                    generated_headers, growth_exponent,
+                                    measure_scaling)
+
+# Fewer runs than the benchmark, the bound leaves room for the noise
+REPEAT = 3
+
+
+class TestAll(unittest.TestCase):
+
+  def check_case(self, case):
+    results = {case: measure_scaling(case, REPEAT)}
+    self.assertEqual(check_scaling(results), [], results)
+
+  def test_growth_exponent(self):
+    sizes = [1, 2, 4, 8]
+    self.assertAlmostEqual(growth_exponent(sizes, [1.0, 2.0, 4.0, 8.0]), 1.0)
+    self.assertAlmostEqual(
+        growth_exponent(sizes, [1.0, 4.0, 16.0, 64.0]), 2.0)
+    self.assertEqual(
+        check_scaling({"case": [sizes, {"phase": [1.0, 4.0, 16.0, 64.0]}]}),
+        [["case", "phase", growth_exponent(sizes, [1.0, 4.0, 16.0, 64.0])]])
+    self.assertLess(MAX_GROWTH_EXPONENT, 2.0)
+
+  def test_startup(self):
+    # what the imports load, as their times depend on the machine
+    startup = {}
+    for module in cpp_refactor_benchmark.IMPORT_BUDGETS:
+      loaded = cpp_refactor_benchmark.measure_import(module, 1)[1]
+      startup[module] = [0.0, loaded]
+    self.assertEqual(check_startup(startup), [])
+    self.assertEqual(
+        check_startup({"cpp_refactor": [1.0, ["hashlib"]]}),
+        ["import of cpp_refactor takes 1000.00 ms, over 10.00 ms",
+         "import of cpp_refactor loads hashlib"])
+
+  def test_long_line(self):
+    self.check_case("long_line")
+
+  def test_nested_templates(self):
+    self.check_case("nested_templates")
+
+  def test_block_comment(self):
+    self.check_case("block_comment")
+
+  def test_overloads(self):
+    self.check_case("overloads")
+
+  def test_scaling_inputs(self):
+    num_functions = {
+        "long_line": 3,
+        "nested_templates": 10,
+        "block_comment": 1,
+        "overloads": 3,
+    }
+    for case in sorted(cpp_refactor_benchmark.SCALING_CASES):
+      header_text = cpp_refactor_benchmark.scaling_input(case, 3)[0]
+      classes = parse_classes(SourceBuffer(header_text))
+      self.assertEqual([class_info[0] for class_info in classes], ["A"])
+      self.assertEqual(
+          len(parse_functions(classes[0][1])), num_functions[case], case)
+
+  def test_differential(self):
+    hits, mismatches = differential(generated_headers())
+    self.assertEqual(mismatches, [])
+    fast_lines, num_lines = hits["corpus many_classes"]
+    self.assertGreater(fast_lines, 0.9 * num_lines)
+    self.assertEqual(hits["scaling long_line"], [0, 1])
+
+    # a class the engines would parse differently is reported
+    saved = cpp_partial_parser._simple_declaration
+    cpp_partial_parser._simple_declaration = lambda m: ["g", "", "", "", "()"]
+    try:
+      self.assertEqual(
+          differential({"h": "class A {\n  void f(int a);\n};\n"})[1],
+          [["h", "A"]])
+    finally:
+      cpp_partial_parser._simple_declaration = saved
+
+
+if __name__ == "__main__":
+
+  unittest.main()
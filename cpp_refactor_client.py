@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""Thin client of cpp_refactor_server.py, for editors to run on save
+
+Sends the sync request to the running server, and only syncs in this process
+when no server is listening. It imports nothing else of cpp_utility unless it
+has to, to start quickly.
+
+Usage: cpp_refactor_client.py [--check|--diff] [--stdin] cc_file
+"""
+
+import argparse, json, os, socket, sys
+
+# Environment variable to set the path of the server socket
+SOCKET_ENV = "CPP_REFACTOR_SOCKET"
+
+
+def default_socket_path():
+  path = os.environ.get(SOCKET_ENV)
+  if path:
+    return path
+  # not tempfile.gettempdir(), which is slow to import
+  return os.path.join(
+      os.environ.get("TMPDIR", "/tmp"), "cpp_refactor-%d.sock" % os.getuid())
+
+
+# Sends one json request, returns the response or None if no server listens
+def send_request(socket_path, request):
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      client.connect(socket_path)
+    except socket.error:
+      return None
+    client.sendall(json.dumps(request) + "\n")
+    response = client.makefile("r").readline()
+  finally:
+    client.close()
+  if response == "":
+    return None
+  return json.loads(response)
+
+
+# Runs the request in this process, in the format of the server response
+def sync_locally(request):
+  import cpp_refactor_server, parse_cache
+  return cpp_refactor_server.SyncServer(
+      parse_cache.default_cache()).handle(request)
+
+
+def main():
+  arg_parser = argparse.ArgumentParser(
+      description="Sync the header of a cc file through cpp_refactor_server")
+  arg_parser.add_argument("cc_file", nargs="?")
+  mode = arg_parser.add_mutually_exclusive_group()
+  mode.add_argument(
+      "--check",
+      action="store_true",
+      help="print the diff without writing, exit 1 if the header is not in "
+      "sync")
+  mode.add_argument(
+      "--diff",
+      action="store_true",
+      help="print the diff without writing the header")
+  arg_parser.add_argument(
+      "--stdin",
+      action="store_true",
+      help="read the content of the cc file from stdin, ie. an unsaved "
+      "editor buffer")
+  arg_parser.add_argument("--socket", default=default_socket_path())
+  arg_parser.add_argument(
+      "--shutdown", action="store_true", help="stop the server")
+  args = arg_parser.parse_args()
+
+  if args.shutdown:
+    send_request(args.socket, {"command": "shutdown"})
+    return
+  if args.cc_file is None:
+    arg_parser.error("need a cc file")
+
+  cc_file = os.path.abspath(args.cc_file)
+  request = {"cc_file": cc_file, "write": not (args.check or args.diff)}
+  if args.stdin:
+    request["buffers"] = {cc_file: sys.stdin.read()}
+  response = send_request(args.socket, request)
+  if response is None:
+    response = sync_locally(request)
+
+  sys.stdout.write(response["output"])
+  if response["error"] is not None:
+    print "ERROR:", response["error"].strip()
+    exit(1)
+  diff = (response["summary"] or {}).get("diff")
+  if diff:
+    sys.stdout.write(diff)
+    if args.check:
+      exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+"""Tests of cpp_refactor_client against cpp_refactor_server
+"""
+
+import os, subprocess, sys, threading, time, unittest
+
+import cpp_refactor_client
+import cpp_refactor_server
+import parse_cache
+import test_util
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def setUp(self):
+    test_util.SourceTreeTest.setUp(self)
+    self.socket_path = self.path("server.sock")
+
+  def start_server(self):
+    thread = threading.Thread(
+        target=cpp_refactor_server.serve,
+        args=(self.socket_path, cpp_refactor_server.SyncServer()))
+    thread.start()
+    while not os.path.exists(self.socket_path):
+      time.sleep(0.01)
+    return thread
+
+  def run_client(self, args, stdin=""):
+    env = dict(os.environ)
+    env[parse_cache.CACHE_DIR_ENV] = ""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "cpp_refactor_client.py"), "--socket", self.socket_path
+        ] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=env)
+    output = process.communicate(stdin)[0]
+    return [process.returncode, output]
+
+  def test_send_request(self):
+    self.assertEqual(
+        cpp_refactor_client.send_request(self.socket_path,
+                                         {"cc_file": self.cc_file}), None)
+    thread = self.start_server()
+    try:
+      response = cpp_refactor_client.send_request(self.socket_path,
+                                                  {"cc_file": self.cc_file})
+      self.assertEqual(response["error"], None)
+      self.assertEqual(response["summary"], {
+          "changed": 0,
+          "deleted": 0,
+          "added": 0
+      })
+    finally:
+      cpp_refactor_client.send_request(self.socket_path,
+                                       {"command": "shutdown"})
+      thread.join()
+    self.assertFalse(os.path.exists(self.socket_path))
+
+  def test_main(self):
+    buffer = '#include "a/a.h"\nvoid A::f(int x) {}\n'
+    # without a server, the client syncs by itself
+    returncode, output = self.run_client(["--check", "--stdin", self.cc_file],
+                                         buffer)
+    self.assertEqual(returncode, 1)
+    self.assertIn("+  void f(int x);\n", output)
+
+    thread = self.start_server()
+    try:
+      self.assertEqual(self.run_client(["--check", self.cc_file])[0], 0)
+      returncode, output = self.run_client(
+          ["--diff", "--stdin", self.cc_file], buffer)
+      self.assertEqual(returncode, 0)
+      self.assertIn("+  void f(int x);\n", output)
+      self.assertEqual(self.read(self.header_file), test_util.HEADER)
+
+      returncode, output = self.run_client([self.path("google3/a/b.cc")])
+      self.assertEqual(returncode, 1)
+      self.assertIn("ERROR:", output)
+    finally:
+      self.run_client(["--shutdown"])
+      thread.join()
+
+
+if __name__ == "__main__":
+
+  unittest.main()
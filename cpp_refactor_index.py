@@ -0,0 +1,249 @@
+#!/usr/bin/python
+"""SQLite index of the functions each class declares and defines
+
+"update" parses the headers and cc files of directories, globs or file lists
+into the index, skipping files whose content did not change since the last
+update. "mismatches" then lists, from the index only, the declarations and
+definitions that cpp_refactor would delete or add.
+
+Usage: cpp_refactor_index.py [--db PATH] update dir|glob|@list_file ...
+       cpp_refactor_index.py [--db PATH] mismatches [--path PREFIX]
+"""
+
+import argparse, os, sqlite3
+
+import cpp_refactor
+import cpp_refactor_batch
+import parse_cache
+
+# Environment variable to set the index database
+INDEX_ENV = "CPP_REFACTOR_INDEX"
+DEFAULT_INDEX = os.path.join(parse_cache.DEFAULT_CACHE_DIR, "index.sqlite")
+
+# Increase whenever the schema changes, older databases are rebuilt
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE files (
+  path TEXT PRIMARY KEY,
+  hash TEXT NOT NULL,
+  -- for a cc file, the header it includes and the hash it was parsed with
+  header TEXT,
+  header_hash TEXT
+);
+CREATE TABLE classes (
+  header TEXT NOT NULL,
+  class TEXT NOT NULL
+);
+-- key is cpp_refactor.definition_key, the same for a declaration and its
+-- definition, and signature the function as written for messages
+CREATE TABLE declarations (
+  header TEXT NOT NULL,
+  class TEXT NOT NULL,
+  key TEXT NOT NULL,
+  signature TEXT NOT NULL,
+  line INTEGER NOT NULL,
+  -- pure virtual or deleted, which need no definition
+  declared_only INTEGER NOT NULL
+);
+CREATE TABLE definitions (
+  cc TEXT NOT NULL,
+  header TEXT NOT NULL,
+  class TEXT NOT NULL,
+  key TEXT NOT NULL,
+  signature TEXT NOT NULL,
+  line INTEGER NOT NULL
+);
+CREATE INDEX classes_header ON classes (header);
+CREATE INDEX declarations_header ON declarations (header, class, key);
+CREATE INDEX definitions_header ON definitions (header, class, key);
+CREATE INDEX definitions_cc ON definitions (cc);
+"""
+
+# Declarations of classes with definitions, that no definition matches and
+# that need one
+_DECLARED_ONLY = """
+SELECT header, line, class, signature FROM declarations AS d
+WHERE header LIKE ? ESCAPE '\\'
+  AND NOT declared_only
+  AND EXISTS (SELECT 1 FROM definitions
+              WHERE header = d.header AND class = d.class)
+  AND NOT EXISTS (SELECT 1 FROM definitions
+                  WHERE header = d.header AND class = d.class AND key = d.key)
+ORDER BY header, line
+"""
+
+# Definitions that no declaration of their class matches
+_DEFINED_ONLY = """
+SELECT cc, line, class, signature FROM definitions AS d
+WHERE cc LIKE ? ESCAPE '\\'
+  AND NOT EXISTS (SELECT 1 FROM declarations
+                  WHERE header = d.header AND class = d.class AND key = d.key)
+ORDER BY cc, line
+"""
+
+
+# Returns a function as written, ie. "virtual int f(int a) const"
+def _signature(f):
+  return cpp_refactor.generate_function_string(f).strip().rstrip(";")
+
+
+def default_index_path():
+  return os.path.expanduser(os.environ.get(INDEX_ENV, DEFAULT_INDEX))
+
+
+class SymbolIndex(object):
+  """The declarations and definitions of every indexed class, by file"""
+
+  def __init__(self, db_path, cache=None):
+    db_dir = os.path.dirname(db_path)
+    if db_dir != "" and not os.path.isdir(db_dir):
+      os.makedirs(db_dir)
+    self.db = sqlite3.connect(db_path)
+    self.db.text_factory = str
+    self.cache = cache
+    version = self.db.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+      self._create()
+
+  def _create(self):
+    with self.db:
+      for table in ["files", "classes", "declarations", "definitions"]:
+        self.db.execute("DROP TABLE IF EXISTS %s" % table)
+      self.db.executescript(_SCHEMA)
+      self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+  def close(self):
+    self.db.close()
+
+  def _stored(self, path):
+    return self.db.execute(
+        "SELECT hash, header, header_hash FROM files WHERE path = ?",
+        (path,)).fetchone()
+
+  # Indexes the header if it changed. Returns [its hash, its class names,
+  # whether it was parsed].
+  def _update_header(self, header_file):
+    header_lines, header_hash = cpp_refactor.read_source(header_file)
+    stored = self._stored(header_file)
+    if stored is not None and stored[0] == header_hash:
+      class_names = [
+          row[0] for row in self.db.execute(
+              "SELECT class FROM classes WHERE header = ?", (header_file,))
+      ]
+      return [header_hash, class_names, False]
+
+    header_classes = cpp_refactor.parse_header(header_lines, self.cache,
+                                               header_hash)
+    self.db.execute("DELETE FROM classes WHERE header = ?", (header_file,))
+    self.db.executemany("INSERT INTO classes VALUES (?, ?)",
+                        ((header_file, class_info[0])
+                         for class_info in header_classes))
+    self.db.execute("DELETE FROM declarations WHERE header = ?",
+                    (header_file,))
+    self.db.executemany(
+        "INSERT INTO declarations VALUES (?, ?, ?, ?, ?, ?)",
+        ((header_file, class_name, cpp_refactor.definition_key(f),
+          _signature(f), class_offset + f.range[0] + 1,
+          cpp_refactor.is_declared_only(f))
+         for (class_name, class_offset, header_functions) in header_classes
+         for f in header_functions))
+    self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, NULL, NULL)",
+                    (header_file, header_hash))
+    return [header_hash, [class_info[0] for class_info in header_classes],
+            True]
+
+  # Indexes a cc file and its header, returns the number of files parsed
+  def update_file(self, cc_file):
+    cc_file = os.path.abspath(cc_file)
+    cc_lines, cc_hash = cpp_refactor.read_source(cc_file)
+    header_file = cpp_refactor.get_header_file(cc_file, cc_lines)
+    if header_file is None or not os.path.exists(header_file):
+      self.remove_file(cc_file)
+      return 0
+    header_hash, class_names, parsed = self._update_header(header_file)
+
+    stored = self._stored(cc_file)
+    if stored == (cc_hash, header_file, header_hash):
+      return int(parsed)
+    cc_functions = cpp_refactor.parse_cc(cc_lines, class_names, self.cache,
+                                         cc_hash)
+    self.db.execute("DELETE FROM definitions WHERE cc = ?", (cc_file,))
+    self.db.executemany(
+        "INSERT INTO definitions VALUES (?, ?, ?, ?, ?, ?)",
+        ((cc_file, header_file, class_name, cpp_refactor.definition_key(f),
+          _signature(f), f.range[0] + 1)
+         for (class_name, functions) in cc_functions.items()
+         for f in functions))
+    self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (cc_file, cc_hash, header_file, header_hash))
+    return int(parsed) + 1
+
+  def remove_file(self, cc_file):
+    self.db.execute("DELETE FROM definitions WHERE cc = ?", (cc_file,))
+    self.db.execute("DELETE FROM files WHERE path = ?", (cc_file,))
+
+  def update(self, cc_files):
+    """Indexes cc files and their headers, and drops cc files that no longer
+    exist. Returns [number of cc files, number of files parsed]."""
+    parsed = 0
+    with self.db:
+      for cc_file in cc_files:
+        try:
+          parsed += self.update_file(cc_file)
+        except Exception as e:
+          print "ERROR:", cc_file, e
+      for (cc_file,) in self.db.execute(
+          "SELECT path FROM files WHERE header IS NOT NULL").fetchall():
+        if not os.path.exists(cc_file):
+          self.remove_file(cc_file)
+    return [len(cc_files), parsed]
+
+  def mismatches(self, path_prefix=""):
+    """Returns [declared_only, defined_only], lists of [file, line, class,
+    signature] of files under path_prefix"""
+    pattern = (path_prefix.replace("\\", "\\\\").replace("%", "\\%").replace(
+        "_", "\\_") + "%")
+    return [
+        [list(row) for row in self.db.execute(_DECLARED_ONLY, (pattern,))],
+        [list(row) for row in self.db.execute(_DEFINED_ONLY, (pattern,))]
+    ]
+
+
+def main():
+  arg_parser = argparse.ArgumentParser(
+      description="Index class declarations and definitions")
+  arg_parser.add_argument("--db", default=default_index_path())
+  commands = arg_parser.add_subparsers(dest="command")
+  update = commands.add_parser("update", help="index cc files and headers")
+  update.add_argument(
+      "inputs", nargs="+", help="directories, globs, cc files or @list_file")
+  mismatches = commands.add_parser(
+      "mismatches", help="list declarations and definitions out of sync")
+  mismatches.add_argument(
+      "--path", default="", help="only files under this path")
+  args = arg_parser.parse_args()
+
+  index = SymbolIndex(args.db, parse_cache.default_cache())
+  try:
+    if args.command == "update":
+      cc_files = cpp_refactor_batch.find_cc_files(args.inputs)
+      num_files, parsed = index.update(cc_files)
+      print "INFO: cc files", num_files, "parsed", parsed
+      return
+    declared_only, defined_only = index.mismatches(
+        os.path.abspath(args.path) if args.path != "" else "")
+    for (path, line, class_name, signature) in declared_only:
+      print "%s:%d: %s: declared only: %s" % (path, line, class_name,
+                                               signature)
+    for (path, line, class_name, signature) in defined_only:
+      print "%s:%d: %s: defined only: %s" % (path, line, class_name,
+                                              signature)
+    if len(declared_only) > 0 or len(defined_only) > 0:
+      exit(1)
+  finally:
+    index.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,73 @@
+"""Tests of cpp_refactor_index
+"""
+
+import os, unittest
+
+import test_util
+from cpp_refactor_index import SymbolIndex
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def setUp(self):
+    test_util.SourceTreeTest.setUp(self)
+    self.write(self.header_file,
+               "class A {\n public:\n  void f();\n  int g() const;\n};\n")
+    self.write(self.cc_file,
+               '#include "a/a.h"\n\nvoid A::f() {}\nvoid A::h(int x) {}\n')
+    self.index = SymbolIndex(self.path("index.sqlite"))
+
+  def tearDown(self):
+    self.index.close()
+    test_util.SourceTreeTest.tearDown(self)
+
+  def test_update(self):
+    self.assertEqual(self.index.update([self.cc_file]), [1, 2])
+    self.assertEqual(self.index.mismatches(), [
+        [[self.header_file, 4, "A", "int g() const"]],
+        [[self.cc_file, 4, "A", "void h(int x)"]],
+    ])
+    # nothing changed
+    self.assertEqual(self.index.update([self.cc_file]), [1, 0])
+    self.assertEqual(self.index.mismatches(self.path("b")),
+                     [[], []])
+
+    self.write(self.cc_file,
+               '#include "a/a.h"\nvoid A::f() {}\nint A::g() const {}\n')
+    self.assertEqual(self.index.update([self.cc_file]), [1, 1])
+    self.assertEqual(self.index.mismatches(), [[], []])
+
+    os.remove(self.cc_file)
+    self.assertEqual(self.index.update([]), [0, 0])
+    self.assertEqual(
+        self.index.db.execute("SELECT COUNT(*) FROM definitions").fetchone(),
+        (0,))
+
+  def test_declaration_words(self):
+    # words only a declaration has do not make a mismatch
+    self.write(
+        self.header_file, "class A {\n public:\n  explicit A(int x);\n"
+        "  virtual ~A() = 0;\n  static A* New();\n  virtual void f() = 0;\n"
+        "  A(const A&) = delete;\n};\n"
+        "class B : public A {\n public:\n  void f() override;\n"
+        "  virtual int g(int x) const;\n};\n")
+    self.write(
+        self.cc_file, '#include "a/a.h"\nA::A(int x) {}\nA::~A() {}\n'
+        "A* A::New() {}\nvoid B::f() {}\nint B::g(int x) const {}\n")
+    self.assertEqual(self.index.update([self.cc_file]), [1, 2])
+    self.assertEqual(self.index.mismatches(), [[], []])
+
+    self.write(self.cc_file,
+               '#include "a/a.h"\nA::A(int x) {}\nvoid B::f(int x) {}\n')
+    self.index.update([self.cc_file])
+    self.assertEqual(self.index.mismatches(), [
+        [[self.header_file, 5, "A", "static A* New()"],
+         [self.header_file, 11, "B", "void f() override"],
+         [self.header_file, 12, "B", "virtual int g(int x) const"]],
+        [[self.cc_file, 3, "B", "void f(int x)"]],
+    ])
+
+
+if __name__ == "__main__":
+
+  unittest.main()
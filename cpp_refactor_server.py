@@ -0,0 +1,152 @@
+#!/usr/bin/python
+"""Long lived cpp_refactor server, keeping files and parse results in memory
+
+Takes one json request per line over a Unix domain socket:
+  {"cc_file": path, "write": true, "buffers": {path: content}}
+where buffers are optional contents to use instead of the files on disk, ie.
+unsaved editor buffers. It answers one json line:
+  {"summary": summary of cpp_refactor.sync_file, "output": ..., "error": ...}
+{"command": "ping"} and {"command": "shutdown"} are also accepted.
+
+Files are read again only when their stat changes, and parse results are
+kept by content hash, so a sync of unchanged files does not parse anything.
+Of an edited file, only the top level blocks the edit changed are parsed.
+
+Usage: cpp_refactor_server.py [--socket PATH]
+"""
+
+import argparse, json, os, sys, traceback
+import SocketServer
+from collections import OrderedDict
+from StringIO import StringIO
+
+import cpp_refactor
+import cpp_refactor_client
+import parse_cache
+
+DEFAULT_MAX_FILES = 256
+
+
+class WarmSources(object):
+  """Keeps the last max_files files read, and reads a file again only when
+  its mtime, size or inode changes"""
+
+  def __init__(self, max_files=DEFAULT_MAX_FILES):
+    self.max_files = max_files
+    self.files = OrderedDict()
+
+  # Returns [lines, content hash] like cpp_refactor.read_source
+  def read(self, file_path):
+    st = os.stat(file_path)
+    stamp = (st.st_mtime, st.st_size, st.st_ino)
+    entry = self.files.pop(file_path, None)
+    if entry is None or entry[0] != stamp:
+      entry = [stamp, cpp_refactor.read_source(file_path)]
+    self.files[file_path] = entry
+    while len(self.files) > self.max_files:
+      self.files.popitem(last=False)
+    return entry[1]
+
+
+def _to_str(text):
+  if isinstance(text, unicode):
+    return text.encode("utf-8")
+  return text
+
+
+class SyncServer(object):
+  """The state kept between requests, and the handling of one request"""
+
+  def __init__(self, cache=None):
+    self.cache = parse_cache.MemoryCache(backing=cache)
+    self.sources = WarmSources()
+    self.history = cpp_refactor.ParseHistory()
+
+  # Returns the response to a request, both as dicts
+  def handle(self, request):
+    command = request.get("command", "sync")
+    if command == "ping":
+      return {"summary": None, "output": "", "error": None}
+    if command != "sync":
+      return {
+          "summary": None,
+          "output": "",
+          "error": "unknown command %s" % command
+      }
+
+    output = StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    summary = None
+    error = None
+    try:
+      buffers = dict((_to_str(path), _to_str(text))
+                     for (path, text) in request.get("buffers", {}).items())
+      header_file = request.get("header_file")
+      summary = cpp_refactor.sync_file(
+          _to_str(request["cc_file"]), self.cache,
+          None if header_file is None else _to_str(header_file),
+          request.get("write", True),
+          cpp_refactor.buffer_reader(buffers, self.sources.read),
+          history=self.history)
+    except Exception:
+      error = traceback.format_exc()
+    finally:
+      sys.stdout = stdout
+    return {"summary": summary, "output": output.getvalue(), "error": error}
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+  def handle(self):
+    for line in self.rfile:
+      try:
+        request = json.loads(line)
+      except ValueError:
+        response = {"summary": None, "output": "", "error": "invalid request"}
+      else:
+        if request.get("command") == "shutdown":
+          self.server.shutting_down = True
+          return
+        response = self.server.state.handle(request)
+      self.wfile.write(json.dumps(response) + "\n")
+      self.wfile.flush()
+
+
+# Returns True if a server already listens on socket_path
+def _is_listening(socket_path):
+  return cpp_refactor_client.send_request(socket_path,
+                                          {"command": "ping"}) is not None
+
+
+def serve(socket_path, state):
+  if os.path.exists(socket_path):
+    if _is_listening(socket_path):
+      print "Error: a server already listens on", socket_path
+      exit(1)
+    # left by a server that did not exit cleanly
+    os.remove(socket_path)
+  server = SocketServer.UnixStreamServer(socket_path, _RequestHandler)
+  server.state = state
+  server.shutting_down = False
+  print "INFO: listening on", socket_path
+  try:
+    while not server.shutting_down:
+      server.handle_request()
+  finally:
+    server.server_close()
+    os.remove(socket_path)
+
+
+def main():
+  arg_parser = argparse.ArgumentParser(
+      description="Serve cpp_refactor syncs with warm parse state")
+  arg_parser.add_argument(
+      "--socket", default=cpp_refactor_client.default_socket_path())
+  args = arg_parser.parse_args()
+
+  serve(args.socket, SyncServer(parse_cache.default_cache()))
+
+
+if __name__ == "__main__":
+  main()
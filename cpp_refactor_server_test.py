@@ -0,0 +1,49 @@
+"""Tests of cpp_refactor_server
+"""
+
+import unittest
+
+import instrument
+import test_util
+from cpp_refactor_server import SyncServer
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def test_handle(self):
+    server = SyncServer()
+    response = server.handle({"cc_file": self.cc_file})
+    self.assertEqual(response["error"], None)
+    self.assertEqual(response["summary"], {
+        "changed": 0,
+        "deleted": 0,
+        "added": 0
+    })
+    # unchanged files are not parsed again
+    response = server.handle({"cc_file": self.cc_file})
+    self.assertEqual(response["summary"], {"unchanged": True})
+
+    buffer = '#include "a/a.h"\nvoid A::f() {}\nint A::g() const {}\n'
+    instrument.enable()
+    try:
+      response = server.handle({
+          "cc_file": self.cc_file,
+          "write": False,
+          "buffers": {
+              self.cc_file: buffer
+          }
+      })
+      # only the edit is parsed
+      self.assertEqual(instrument.counters["incremental_parses"], 1)
+    finally:
+      instrument.disable()
+    self.assertTrue("+  int g() const;" in response["summary"]["diff"])
+    self.assertFalse("g()" in self.read(self.header_file))
+
+    response = server.handle({"cc_file": self.path("b.cc")})
+    self.assertTrue(response["error"] is not None)
+
+
+if __name__ == "__main__":
+
+  unittest.main()
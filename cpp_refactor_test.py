@@ -0,0 +1,333 @@
+"""Tests of cpp_refactor
+"""
+
+import os, stat, subprocess, sys, unittest
+
+import cpp_partial_parser
+import cpp_refactor
+import parse_cache
+import test_util
+from cpp_refactor_benchmark import generate_corpus
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def write_sources(self, header, definitions):
+    self.write(self.header_file, header)
+    self.write(self.cc_file, '#include "a/a.h"\n' + definitions)
+
+  def read_header(self):
+    return self.read(self.header_file)
+
+  def test_parallel_parse_header(self):
+    header_text = generate_corpus(40, 6, 2, 2, 0.2)[0]
+    header_lines = cpp_partial_parser.SourceBuffer(header_text)
+    chunks = cpp_refactor.split_header(header_lines, 8)
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual("".join(chunk[0] for chunk in chunks), header_text)
+
+    serial = cpp_refactor.parse_header(header_lines)
+    min_bytes = cpp_refactor.PARALLEL_MIN_BYTES
+    cpp_refactor.PARALLEL_MIN_BYTES = 0
+    try:
+      parallel = cpp_refactor.parse_header(header_lines, jobs=2)
+    finally:
+      cpp_refactor.PARALLEL_MIN_BYTES = min_bytes
+    self.assertEqual(parallel, serial)
+
+  # Asserts that parsing new_text from the parse of old_text is the same as
+  # parsing it whole, returns the span parsed again
+  def _check_reparse(self, old_text, new_text, class_names=None):
+    old_lines = cpp_partial_parser.SourceBuffer(old_text)
+    new_lines = cpp_partial_parser.SourceBuffer(new_text)
+    if class_names is None:
+      old_result = cpp_refactor.parse_header(old_lines)
+      result = cpp_refactor.reparse_header(old_lines, old_result, new_lines)
+      self.assertEqual(result, cpp_refactor.parse_header(new_lines))
+    else:
+      old_result = cpp_refactor.parse_cc(old_lines, class_names)
+      result = cpp_refactor.reparse_cc(old_lines, old_result, new_lines,
+                                       class_names)
+      self.assertEqual(result, cpp_refactor.parse_cc(new_lines, class_names))
+    return cpp_refactor._reparse_span(old_lines, new_lines)[:3]
+
+  def test_reparse_header(self):
+    header_text = generate_corpus(12, 5, 2, 2, 0.3)[0]
+    class_2 = header_text.index("class Class2 ")
+    class_3 = header_text.index("class Class3 ")
+    edits = [
+        header_text[:class_3] +
+        header_text[class_3:].replace("Method3(", "Renamed3(", 1),
+        header_text.replace(" private:\n  int x_;", " private:\n", 3),
+        header_text[:class_2] + header_text[class_3:],
+        header_text[:class_3] + "struct Added {\n  void Run();\n};\n" +
+        header_text[class_3:],
+        header_text.replace("#ifndef", "#if !defined", 1),
+        header_text + "// end\n",
+        header_text.replace("};\n", "}; /* open\n */ class Late {};\n", 1),
+        header_text,
+    ]
+    for new_text in edits:
+      start, end, old_end = self._check_reparse(header_text, new_text)
+    # only the class that changed is parsed again
+    start, end, old_end = self._check_reparse(header_text, edits[0])
+    class_3_line = header_text[:class_3].count("\n")
+    self.assertLessEqual(class_3_line - 4, start)
+    self.assertLessEqual(start, class_3_line)
+    self.assertEqual(end, old_end)
+    self.assertLess(end - start, 25)
+
+    unbalanced = header_text.replace("{", "{{", 1)
+    self.assertIsNone(
+        cpp_refactor.reparse_header(
+            header_text, cpp_refactor.parse_header(header_text), unbalanced))
+
+  def test_reparse_cc(self):
+    header_text, cc_text = generate_corpus(8, 5, 2, 2, 0.3)[:2]
+    class_names = [
+        class_info[0] for class_info in cpp_refactor.parse_header(header_text)
+    ]
+    class_2 = cc_text.rindex("\n\n", 0, cc_text.index("Class2::")) + 2
+    class_3 = cc_text.rindex("\n\n", 0, cc_text.index("Class3::")) + 2
+    edits = [
+        cc_text.replace("Class1::Method1(", "Class1::Method9(", 1),
+        cc_text[:class_2] + cc_text[class_3:],
+        cc_text.replace("namespace bench {\n",
+                        "namespace bench {\nvoid Class0::Added() {}\n", 1),
+        cc_text.replace("}\n\n", "}  int Class3::Late() { return 1; }\n\n",
+                        1),
+        cc_text.replace("}  // namespace bench", "}  // namespace bench\n"
+                        "namespace other {\nvoid Class1::Outside() {}\n}"),
+        cc_text + "/* open",
+        cc_text,
+    ]
+    for new_text in edits:
+      self._check_reparse(cc_text, new_text, class_names)
+    self.assertIsNone(
+        cpp_refactor.reparse_cc(
+            cc_text, cpp_refactor.parse_cc(cc_text, class_names),
+            cc_text[:class_2] + "/* open\n" + cc_text[class_2:],
+            class_names))
+
+  def test_parse_history(self):
+    history = cpp_refactor.ParseHistory(1)
+    header_text = generate_corpus(4, 3, 1, 1, 0)[0]
+    result = cpp_refactor.parse_header(header_text)
+    history.put("header", "a.h", header_text, "hash", result)
+    self.assertEqual(history.get("header", "a.h")[1], result)
+    self.assertEqual(list(history.get("header", "a.h")[0]),
+                     header_text.splitlines(True))
+    new_text = header_text.replace("Method1(", "Other1(")
+    self.assertEqual(
+        cpp_refactor.parse_header(
+            new_text, previous=history.get("header", "a.h")),
+        cpp_refactor.parse_header(new_text))
+    history.put("cc", "a.cc", "", "hash", {})
+    self.assertIsNone(history.get("header", "a.h"))
+
+  def test_compare_functions(self):
+
+    def functions(text):
+      return cpp_partial_parser.parse_functions("{\n%s};\n" % text)
+
+    header_functions = functions("""  void F(int a);
+  void F(double d);
+  void F(int a, int b);
+  int G(const std::string& s) const;
+  void H();
+  void K(int a, double b);
+  void K(std::string s, double b);
+""")
+    cc_functions = functions("""  void F(int x);
+  bool F(double d);
+  void F(int a, int b, int c);
+  int G(const std::string &name);
+  void I();
+  void K(std::string s, float b);
+  void K(int a, float b);
+""")
+    self.assertEqual(
+        cpp_refactor.match_functions(header_functions, range(7), cc_functions,
+                                     range(7)),
+        [[0, 0, "same parameter types", 0], [1, 1, "same parameter types", 1],
+         [2, 2, "same name", 1], [3, 3, "same parameter types", 1],
+         [5, 6, "same arity", 1], [6, 5, "same arity", 1]])
+    self.assertEqual(
+        cpp_refactor.compare_functions(header_functions, cc_functions),
+        [{0: 0, 1: 1, 2: 2, 3: 3, 5: 6, 6: 5}, [4], [4]])
+    self.assertEqual(
+        cpp_refactor.compare_functions(header_functions[:2], cc_functions[1:2]),
+        [{1: 0}, [0], []])
+    # a single function of another name is renamed
+    self.assertEqual(
+        cpp_refactor.compare_functions(header_functions[4:5],
+                                       cc_functions[4:5]), [{0: 0}, [], []])
+
+    # only the qualifiers a definition repeats are edits
+    h, c = functions("  virtual int F(int a);\n  constexpr int F(int a);\n")
+    self.assertEqual(cpp_refactor._change_cost(h, (), c, ()), 1)
+    self.assertEqual(cpp_refactor._change_cost(h, (), h.replace(prefix=""), ()),
+                     0)
+
+    # buckets too large for an assignment are paired in order
+    max_size = cpp_refactor.MAX_ASSIGNMENT_SIZE
+    cpp_refactor.MAX_ASSIGNMENT_SIZE = 1
+    try:
+      self.assertEqual(
+          cpp_refactor.match_functions(header_functions, [5, 6], cc_functions,
+                                       [5, 6]),
+          [[5, 5, "same arity", 2], [6, 6, "same arity", 2]])
+    finally:
+      cpp_refactor.MAX_ASSIGNMENT_SIZE = max_size
+
+  def test_sync_declared_only(self):
+    header = ("class A {\n public:\n  virtual void Pure() = 0;\n"
+              "  A(const A&) = delete;\n  void Other();\n"
+              "  void g(int x);\n};\n")
+    # functions not defined in this cc file are kept
+    self.write_sources(header, "void A::g(int x) {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file, write=False)
+    self.assertEqual(summary, {"changed": 0, "deleted": 0, "added": 0})
+    # nor are pure virtual or deleted ones when a function is added
+    self.write_sources(header, "void A::g(int x) {}\nvoid A::h() {}\n"
+                       "void A::k(int y) {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 0, "deleted": 1, "added": 2})
+    text = self.read_header()
+    self.assertIn("virtual void Pure() = 0;", text)
+    self.assertIn("A(const A&) = delete;", text)
+    self.assertNotIn("Other", text)
+
+  def test_sync_without_public(self):
+    # functions are not added to a class without public:, the others still
+    # are
+    self.write_sources(
+        "class A {\n  void f();\n};\nclass B {\n public:\n  void f();\n};\n",
+        "void A::f() {}\nvoid A::g() {}\nvoid B::f() {}\nvoid B::g() {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 0, "deleted": 0, "added": 1})
+    self.assertEqual(
+        self.read_header(), "class A {\n  void f();\n};\nclass B {\n"
+        " public:\n  void g();\n  void f();\n};\n")
+
+  def test_sync_struct(self):
+    self.write_sources("struct A {\n  int x;\n};\n", "void A::f() {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 0, "deleted": 0, "added": 1})
+    self.assertEqual(self.read_header(),
+                     "struct A {\n  void f();\n  int x;\n};\n")
+
+  def test_sync_rename(self):
+    self.write_sources(
+        "class A {\n public:\n  void Foo(int x);\n  void g();\n};\n",
+        "void A::Bar(int x) {}\nvoid A::g() {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 1, "deleted": 0, "added": 0})
+    self.assertEqual(self.read_header(),
+                     "class A {\n public:\n  void Bar(int x);\n"
+                     "  void g();\n};\n")
+
+  def test_sync_qualifiers(self):
+    header = ("class A {\n public:\n    explicit A(int a);\n"
+              "    virtual void F(int a) const;\n"
+              "    static int G(int a);\n    void H() override;\n};\n")
+    # qualifiers the definitions leave out are no change
+    self.write_sources(header, "A::A(int a) {}\nvoid A::F(int a) const {}\n"
+                       "int A::G(int a) {}\nvoid A::H() {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file, write=False)
+    self.assertEqual(summary, {"changed": 0, "deleted": 0, "added": 0})
+    # and are kept along with the indentation by changes
+    self.write_sources(
+        header, "A::A(int a, int b) {}\nvoid A::F(double a) const {}\n"
+        "int A::G(int a) const {}\nvoid A::H(int b) {}\n"
+        "void A::K() {}\n")
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 4, "deleted": 0, "added": 1})
+    self.assertEqual(
+        self.read_header(),
+        "class A {\n public:\n    void K();\n    explicit A(int a, int b);\n"
+        "    virtual void F(double a) const;\n"
+        "    static int G(int a) const;\n    void H(int b) override;\n};\n")
+
+  def test_sync_nested_class(self):
+    self.write_sources(
+        "namespace n {\nclass Outer {\n public:\n  class Inner {\n"
+        "   public:\n    void h();\n  };\n  void f();\n};\n}\n",
+        "namespace n {\nvoid Outer::Inner::h(int a) {}\n"
+        "void Outer::f() {}\n}\n")
+    classes = cpp_refactor.parse_header(
+        cpp_partial_parser.SourceBuffer(self.read_header()))
+    self.assertEqual([class_info[:2] for class_info in classes],
+                     [["n::Outer", 1], ["n::Outer::Inner", 3]])
+    summary = cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(summary, {"changed": 1, "deleted": 0, "added": 0})
+    self.assertIn("    void h(int a);\n", self.read_header())
+
+  def test_write_header(self):
+    header = "class A {\n public:\n  void f();\n};\n"
+    # a header in sync is not written
+    self.write_sources(header, "void A::f() {}\n")
+    os.utime(self.header_file, (1, 1))
+    cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(os.stat(self.header_file).st_mtime, 1)
+
+    # a header is replaced at once, with its permissions
+    os.chmod(self.header_file, 0640)
+    self.write_sources(header, "void A::f(int x) {}\n")
+    cpp_refactor.sync_file(self.cc_file)
+    self.assertEqual(self.read_header(),
+                     "class A {\n public:\n  void f(int x);\n};\n")
+    self.assertEqual(stat.S_IMODE(os.stat(self.header_file).st_mode), 0640)
+    self.assertEqual(sorted(os.listdir(os.path.dirname(self.header_file))),
+                     ["a.cc", "a.h"])
+
+  def run_main(self, *args):
+    env = dict(os.environ)
+    env[parse_cache.CACHE_DIR_ENV] = ""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "cpp_refactor.py")
+        ] + list(args),
+        stdout=subprocess.PIPE,
+        env=env)
+    output = process.communicate()[0]
+    return [process.returncode, output]
+
+  def test_check_and_diff(self):
+    header = "class A {\n public:\n  void f();\n};\n"
+    self.write_sources(header, "void A::f() {}\n")
+    self.assertEqual(self.run_main("--check", self.cc_file)[0], 0)
+
+    # edits are printed as a diff, and the header is not written
+    self.write_sources(header, "void A::f(int x) {}\n")
+    diff = "".join([
+        "--- %s\n+++ %s\n" % (self.header_file, self.header_file),
+        "@@ -1,4 +1,4 @@\n class A {\n  public:\n-  void f();\n",
+        "+  void f(int x);\n };\n"
+    ])
+    returncode, output = self.run_main("--check", self.cc_file)
+    self.assertEqual(returncode, 1)
+    self.assertTrue(output.endswith(diff))
+    returncode, output = self.run_main("--diff", self.cc_file)
+    self.assertEqual(returncode, 0)
+    self.assertTrue(output.endswith(diff))
+    self.assertEqual(self.read_header(), header)
+
+  def test_param_type(self):
+    self.assertEqual(cpp_refactor.param_type("const  std::string &name"),
+                     "const std::string&")
+    self.assertEqual(cpp_refactor.param_type("std::map<int, int> m"),
+                     "std::map<int,int>")
+    self.assertEqual(cpp_refactor.param_type("unsigned int"), "unsigned int")
+    self.assertEqual(cpp_refactor.param_type("std::string"), "std::string")
+    # kept for the next function with the same parameter
+    hits = cpp_refactor._param_type_cache.hits
+    self.assertEqual(cpp_refactor.param_type("std::string"), "std::string")
+    self.assertEqual(cpp_refactor._param_type_cache.hits, hits + 1)
+
+
+if __name__ == "__main__":
+
+  unittest.main()
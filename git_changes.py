@@ -0,0 +1,70 @@
+"""The cc files a git change affects, for cpp_refactor to sync only those
+
+A cc file is affected if it changed, or if the header it syncs with, ie. its
+first quoted include, changed. Changes are those against the merge base of a
+base ref and HEAD, staged and unstaged ones, and untracked files.
+"""
+
+import os, subprocess
+
+import common
+import cpp_refactor
+
+
+def _git(repo_dir, *args):
+  return subprocess.check_output(("git",) + args, cwd=repo_dir)
+
+
+def _split_paths(output):
+  return [path for path in output.split("\0") if path != ""]
+
+
+def git_root(path):
+  return _git(path, "rev-parse", "--show-toplevel").strip()
+
+
+def changed_files(repo_dir, base="HEAD"):
+  """Returns the absolute paths of the files changed since the merge base of
+  base and HEAD, in the index or in the work tree, or not tracked yet. Files
+  deleted since are left out."""
+  root = git_root(repo_dir)
+  merge_base = _git(root, "merge-base", base, "HEAD").strip()
+  paths = set(
+      _split_paths(_git(root, "diff", "--name-only", "-z", merge_base)))
+  paths.update(
+      _split_paths(
+          _git(root, "ls-files", "--others", "--exclude-standard", "-z")))
+  paths = [os.path.join(root, path) for path in paths]
+  return sorted(path for path in paths if os.path.isfile(path))
+
+
+# Returns the cc files of the work tree that sync with header_file
+def _including_cc_files(root, header_file):
+  try:
+    include = common.find_google3_path(header_file)[1]
+  except ValueError:
+    return []
+  try:
+    output = _git(root, "grep", "--untracked", "-l", "-z", "-F", "-e",
+                  '#include "%s"' % include, "--", "*.cc")
+  except subprocess.CalledProcessError:
+    # no match
+    return []
+  result = []
+  for path in _split_paths(output):
+    cc_file = os.path.join(root, path)
+    if cpp_refactor.get_header_file(cc_file) == header_file:
+      result.append(cc_file)
+  return result
+
+
+def affected_cc_files(repo_dir, base="HEAD"):
+  """Returns the sorted cc files that changed, or whose header changed"""
+  root = git_root(repo_dir)
+  result = set()
+  for path in changed_files(root, base):
+    if path.endswith(".cc"):
+      result.add(path)
+    elif path.endswith(".h"):
+      result.update(_including_cc_files(root, path))
+  return sorted(result)
@@ -0,0 +1,52 @@
+"""Tests of git_changes
+"""
+
+import subprocess, unittest
+
+import test_util
+from git_changes import affected_cc_files, changed_files
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def setUp(self):
+    test_util.SourceTreeTest.setUp(self)
+    self.git("init", "-q")
+    self.write("google3/b/b.h", test_util.HEADER)
+    self.write("google3/b/b.cc",
+               '#include "b/b.h"\n#include "a/a.h"\n\nvoid A::f() {}\n')
+    self.git("add", ".")
+    self.git("commit", "-q", "-m", "base")
+
+  def git(self, *args):
+    subprocess.check_call(
+        ("git", "-c", "user.name=test", "-c", "user.email=test@test") + args,
+        cwd=self.root)
+
+  def test_changed(self):
+    self.assertEqual(affected_cc_files(self.root), [])
+    # staged, unstaged and untracked
+    self.write("google3/a/a.h", "class A {\n public:\n  void g();\n};\n")
+    self.git("add", "google3/a/a.h")
+    self.write("google3/a/a.cc", '#include "a/a.h"\n\nvoid A::g() {}\n')
+    self.write("google3/c/c.cc", '#include "c/c.h"\n')
+    self.assertEqual(
+        changed_files(self.root),
+        [self.path("google3/a/a.cc"), self.path("google3/a/a.h"),
+         self.path("google3/c/c.cc")])
+    # b.cc includes a.h but syncs with b.h
+    self.assertEqual(
+        affected_cc_files(self.path("google3")),
+        [self.path("google3/a/a.cc"), self.path("google3/c/c.cc")])
+    self.write("google3/b/b.h", "class B {\n};\n")
+    self.assertEqual(len(affected_cc_files(self.root)), 3)
+
+    self.git("add", ".")
+    self.git("commit", "-q", "-m", "change")
+    self.assertEqual(affected_cc_files(self.root), [])
+    self.assertEqual(len(affected_cc_files(self.root, "HEAD~1")), 3)
+
+
+if __name__ == "__main__":
+
+  unittest.main()
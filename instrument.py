@@ -0,0 +1,114 @@
+"""Optional instrumentation of cpp_refactor phases and parser hot paths
+
+Nothing is recorded until enable() is called, and the parser only checks
+whether counters is None once per call while it is off. Modules only needed
+for profiling and reports are imported when used.
+"""
+
+import time
+from contextlib import contextmanager
+
+# Environment variable with a path for the report, "-" for stdout
+REPORT_ENV = "CPP_REFACTOR_REPORT"
+
+# Counters updated by the parser, None while instrumentation is off
+counters = None
+
+_phases = None
+_start_time = None
+_profiler = None
+_profile_path = None
+_tracemalloc = None
+
+
+def enable(profile_path=None, trace_memory=False):
+  """Starts recording. With profile_path, a cProfile of the run is written
+  there by report(). trace_memory needs tracemalloc, which Python 2 only has
+  as the pytracemalloc backport; without it the max RSS is still reported."""
+  global counters, _phases, _start_time, _profiler, _profile_path
+  global _tracemalloc
+  from collections import defaultdict
+  counters = defaultdict(int)
+  _phases = defaultdict(float)
+  _start_time = time.time()
+  if trace_memory:
+    try:
+      import tracemalloc
+      tracemalloc.start()
+      _tracemalloc = tracemalloc
+    except ImportError:
+      counters["tracemalloc_unavailable"] = 1
+  if profile_path is not None:
+    import cProfile
+    _profile_path = profile_path
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def disable():
+  global counters, _phases, _profiler, _profile_path, _tracemalloc
+  if _profiler is not None:
+    _profiler.disable()
+  if _tracemalloc is not None:
+    _tracemalloc.stop()
+  counters = None
+  _phases = None
+  _profiler = None
+  _profile_path = None
+  _tracemalloc = None
+
+
+def enabled():
+  return counters is not None
+
+
+@contextmanager
+def phase(name):
+  """Adds the wall time of the block to phase name"""
+  if counters is None:
+    yield
+    return
+  start = time.time()
+  try:
+    yield
+  finally:
+    _phases[name] += time.time() - start
+
+
+def add(name, value=1):
+  if counters is not None:
+    counters[name] += value
+
+
+def report():
+  """Returns the report as a dict, and writes the cProfile if asked"""
+  if counters is None:
+    return None
+  import resource
+  result = {
+      "total_seconds": time.time() - _start_time,
+      "phases": dict(_phases),
+      "counters": dict(counters),
+      "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  }
+  if _tracemalloc is not None:
+    current, peak = _tracemalloc.get_traced_memory()
+    result["traced_memory"] = {"current": current, "peak": peak}
+  if _profiler is not None:
+    _profiler.disable()
+    _profiler.dump_stats(_profile_path)
+    result["profile"] = _profile_path
+  return result
+
+
+def write_report(path):
+  result = report()
+  if result is None:
+    return
+  import json
+  data = json.dumps(result, indent=2, sort_keys=True, separators=(",", ": "))
+  if path == "-":
+    print data
+    return
+  with open(path, "w") as fout:
+    fout.write(data + "\n")
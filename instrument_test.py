@@ -0,0 +1,70 @@
+"""Tests of instrument
+"""
+
+import json, os, shutil, tempfile, unittest
+
+from instrument import (add, disable, enable, enabled, phase, report,
+                        write_report)
+
+
+class TestAll(unittest.TestCase):
+
+  def tearDown(self):
+    disable()
+
+  def test_disabled(self):
+    add("find_calls")
+    with phase("parse_header"):
+      pass
+    self.assertFalse(enabled())
+    self.assertEqual(report(), None)
+
+  def test_report(self):
+    enable()
+    add("find_calls")
+    add("find_tokens_scanned", 5)
+    with phase("parse_header"):
+      pass
+    result = report()
+    self.assertEqual(result["counters"], {
+        "find_calls": 1,
+        "find_tokens_scanned": 5
+    })
+    self.assertEqual(result["phases"].keys(), ["parse_header"])
+    self.assertTrue(result["max_rss_kb"] > 0)
+
+  def test_phase_error(self):
+    enable()
+    with self.assertRaises(ValueError):
+      with phase("parse_cc"):
+        raise ValueError()
+    self.assertEqual(report()["phases"].keys(), ["parse_cc"])
+
+  def test_write_report(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      report_path = os.path.join(tmp_dir, "report.json")
+      profile_path = os.path.join(tmp_dir, "profile")
+      write_report(report_path)
+      self.assertFalse(os.path.exists(report_path))
+
+      enable(profile_path, trace_memory=True)
+      add("cache_hits")
+      write_report(report_path)
+      with open(report_path, "r") as fin:
+        result = json.load(fin)
+      self.assertEqual(result["profile"], profile_path)
+      self.assertTrue(os.path.getsize(profile_path) > 0)
+      # without tracemalloc, only the max RSS is reported
+      if "traced_memory" in result:
+        self.assertTrue(result["traced_memory"]["peak"] > 0)
+      else:
+        self.assertEqual(result["counters"]["tracemalloc_unavailable"], 1)
+      self.assertEqual(result["counters"]["cache_hits"], 1)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+
+  unittest.main()
@@ -0,0 +1,157 @@
+"""On disk cache of parse results keyed by file content hash
+
+cPickle and hashlib are imported when first used, as a sync from the save
+hook may find the result in the cache or not use it at all.
+"""
+
+import errno, os
+
+import cpp_partial_parser
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "cpp_refactor")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 1024
+# ParseCache keeps more entries, ie. also the small "synced" ones
+DEFAULT_MAX_FILES = 16 * 1024
+# Each put evicts with odds 1 / DEFAULT_EVICT_INTERVAL, as a listing of the
+# directory costs milliseconds, and processes that put only a few values
+# still evict now and then
+DEFAULT_EVICT_INTERVAL = 64
+
+# Environment variable to set the cache directory, an empty value disables it
+CACHE_DIR_ENV = "CPP_REFACTOR_CACHE_DIR"
+
+
+def content_hash(data):
+  import hashlib
+  return hashlib.sha1(data).hexdigest()
+
+
+class ParseCache(object):
+  """Stores values in one file per key, evicting least recently used files
+  once the directory grows over max_bytes or max_files.
+
+  Keys are content hashes, and every file name also has the parser version so
+  that results of an older parser are never returned.
+  """
+
+  def __init__(self,
+               cache_dir,
+               max_bytes=DEFAULT_MAX_BYTES,
+               max_files=DEFAULT_MAX_FILES,
+               evict_interval=DEFAULT_EVICT_INTERVAL):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.max_files = max_files
+    self.evict_interval = evict_interval
+    # workers of a batch may create the directory at the same time
+    try:
+      os.makedirs(cache_dir)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+  def _path(self, kind, key):
+    return os.path.join(
+        self.cache_dir,
+        "%s-%s-%d" % (kind, key, cpp_partial_parser.PARSER_VERSION))
+
+  def get(self, kind, key):
+    import cPickle
+    path = self._path(kind, key)
+    try:
+      with open(path, "rb") as fin:
+        value = cPickle.load(fin)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+      return None
+    # mark as recently used
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    return value
+
+  def contains(self, kind, key):
+    return os.path.exists(self._path(kind, key))
+
+  def put(self, kind, key, value):
+    import cPickle, random, tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as fout:
+      cPickle.dump(value, fout, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, self._path(kind, key))
+    if random.randrange(self.evict_interval) == 0:
+      self.evict()
+
+  def evict(self):
+    entries = []
+    total = 0
+    for name in os.listdir(self.cache_dir):
+      path = os.path.join(self.cache_dir, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+    count = len(entries)
+    if total <= self.max_bytes and count <= self.max_files:
+      return
+    # oldest first
+    entries.sort()
+    for (mtime, size, path) in entries:
+      if total <= self.max_bytes and count <= self.max_files:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+      count -= 1
+
+
+class MemoryCache(object):
+  """Keeps the max_entries most recently used values in memory, in front of
+  an optional ParseCache for the values it does not have.
+
+  Values are returned as they were put, not copied, so they must not be
+  modified by the caller.
+  """
+
+  def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, backing=None):
+    self.max_entries = max_entries
+    self.backing = backing
+    from collections import OrderedDict
+    self.entries = OrderedDict()
+
+  def get(self, kind, key):
+    value = self.entries.pop((kind, key), None)
+    if value is None and self.backing is not None:
+      value = self.backing.get(kind, key)
+    if value is not None:
+      self._add(kind, key, value)
+    return value
+
+  def contains(self, kind, key):
+    if (kind, key) in self.entries:
+      return True
+    return self.backing is not None and self.backing.contains(kind, key)
+
+  def put(self, kind, key, value):
+    self.entries.pop((kind, key), None)
+    self._add(kind, key, value)
+    if self.backing is not None:
+      self.backing.put(kind, key, value)
+
+  def _add(self, kind, key, value):
+    self.entries[(kind, key)] = value
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+
+# Returns the cache configured by the environment, or None if disabled
+def default_cache():
+  cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+  if cache_dir == "":
+    return None
+  return ParseCache(os.path.expanduser(cache_dir))
@@ -0,0 +1,113 @@
+"""Tests of parse_cache
+"""
+
+import os, random, shutil, tempfile, unittest
+
+import cpp_partial_parser
+import parse_cache
+from parse_cache import MemoryCache, ParseCache, content_hash
+
+
+class TestAll(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_get_put(self):
+    cache = ParseCache(self.cache_dir)
+    key = content_hash("class A {};")
+    self.assertEqual(cache.get("header", key), None)
+    self.assertFalse(cache.contains("header", key))
+    cache.put("header", key, [["A", 0, []]])
+    self.assertEqual(cache.get("header", key), [["A", 0, []]])
+    self.assertTrue(cache.contains("header", key))
+    self.assertEqual(cache.get("cc", key), None)
+
+  def test_invalid_entries(self):
+    cache = ParseCache(self.cache_dir)
+    cache.put("header", "0", [])
+    self.assertEqual(os.listdir(self.cache_dir),
+                     [os.path.basename(cache._path("header", "0"))])
+    # results of another parser version are never returned
+    version = cpp_partial_parser.PARSER_VERSION
+    cpp_partial_parser.PARSER_VERSION = version + 1
+    try:
+      self.assertEqual(cache.get("header", "0"), None)
+    finally:
+      cpp_partial_parser.PARSER_VERSION = version
+    self.assertEqual(cache.get("header", "0"), [])
+    # nor are truncated files
+    with open(cache._path("header", "0"), "wb") as fout:
+      fout.write("")
+    self.assertEqual(cache.get("header", "0"), None)
+
+  def test_default_cache(self):
+    cache_dir = os.environ.get(parse_cache.CACHE_DIR_ENV)
+    try:
+      os.environ[parse_cache.CACHE_DIR_ENV] = ""
+      self.assertEqual(parse_cache.default_cache(), None)
+      os.environ[parse_cache.CACHE_DIR_ENV] = os.path.join(
+          self.cache_dir, "sub")
+      self.assertEqual(parse_cache.default_cache().cache_dir,
+                       os.path.join(self.cache_dir, "sub"))
+      self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, "sub")))
+    finally:
+      if cache_dir is None:
+        del os.environ[parse_cache.CACHE_DIR_ENV]
+      else:
+        os.environ[parse_cache.CACHE_DIR_ENV] = cache_dir
+
+  def test_evict(self):
+    cache = ParseCache(self.cache_dir)
+    for i in range(5):
+      cache.put("cc", str(i), "x" * 500)
+      # make the order of mtime deterministic
+      path = cache._path("cc", str(i))
+      os.utime(path, (i, i))
+    cache.get("cc", "0")
+    cache.max_bytes = 1500
+    cache.evict()
+    self.assertTrue(cache.contains("cc", "0"))
+    self.assertTrue(cache.contains("cc", "4"))
+    self.assertFalse(cache.contains("cc", "1"))
+    self.assertFalse(cache.contains("cc", "2"))
+
+    # the number of files is bounded as well
+    cache.max_files = 1
+    cache.evict()
+    self.assertTrue(cache.contains("cc", "0"))
+    self.assertFalse(cache.contains("cc", "4"))
+
+  def test_evict_interval(self):
+    # the directory exists already
+    cache = ParseCache(self.cache_dir, max_files=2, evict_interval=1000000)
+    random.seed(0)
+    for i in range(5):
+      cache.put("synced", str(i), True)
+      os.utime(cache._path("synced", str(i)), (i, i))
+    self.assertEqual(len(os.listdir(self.cache_dir)), 5)
+
+    cache = ParseCache(self.cache_dir, max_files=2, evict_interval=1)
+    cache.put("synced", "5", True)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+    self.assertTrue(cache.contains("synced", "5"))
+
+  def test_memory_cache(self):
+    backing = ParseCache(self.cache_dir)
+    backing.put("cc", "0", "zero")
+    cache = MemoryCache(2, backing)
+    self.assertEqual(cache.get("cc", "0"), "zero")
+    cache.put("cc", "1", "one")
+    cache.put("cc", "2", "two")
+    self.assertEqual(cache.entries.keys(), [("cc", "1"), ("cc", "2")])
+    self.assertTrue(cache.contains("cc", "0"))
+    self.assertEqual(backing.get("cc", "2"), "two")
+    self.assertEqual(MemoryCache().get("cc", "0"), None)
+
+
+if __name__ == "__main__":
+
+  unittest.main()
@@ -0,0 +1,205 @@
+"""Keeps headers in sync as the cc files of directories change
+
+Changes are found by polling a table of the mtime, size and inode of every cc
+file and header, as there is no inotify without extra modules. A poll lists a
+directory again only when its own mtime changed, and otherwise only stats the
+files it knows. A burst of saves is synced once it settles, and changes are
+grouped by header so each cc file of a header is synced once per burst. A
+save is synced at most interval + max_delay seconds after it, plus the time
+the sync takes. The state of cpp_refactor_server is kept across bursts, so
+files that did not change are not read or parsed again, and those that did
+are only parsed where they changed.
+"""
+
+import os, time
+
+import cpp_refactor
+
+# Seconds between polls while nothing changes
+DEFAULT_INTERVAL = 0.5
+# Seconds without changes after which a burst is synced
+DEFAULT_QUIET = 0.2
+# Seconds after its first change by which a burst is synced, even if it goes on
+DEFAULT_MAX_DELAY = 1.0
+
+WATCHED_SUFFIXES = (".cc", ".h")
+
+
+def _stamp(st):
+  return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _is_watched(name):
+  # skips hidden files, ie. editor swap files and the temporary files of
+  # cpp_refactor.write_atomically
+  return name.endswith(WATCHED_SUFFIXES) and not name.startswith(".")
+
+
+class Snapshot(object):
+  """The stamps of the cc files and headers under dirs"""
+
+  def __init__(self, dirs):
+    self.dirs = {}
+    self.files = {}
+    for dir_path in dirs:
+      self._scan(os.path.abspath(dir_path), [])
+
+  # Adds the directory and what it holds, and the new files to changed
+  def _scan(self, dir_path, changed):
+    try:
+      st = os.stat(dir_path)
+      names = os.listdir(dir_path)
+    except OSError:
+      return
+    self.dirs[dir_path] = st.st_mtime
+    for name in names:
+      path = os.path.join(dir_path, name)
+      if path in self.files or path in self.dirs:
+        continue
+      if os.path.isdir(path):
+        if not name.startswith("."):
+          self._scan(path, changed)
+      elif _is_watched(name):
+        try:
+          self.files[path] = _stamp(os.stat(path))
+        except OSError:
+          continue
+        changed.append(path)
+
+  def poll(self):
+    """Returns the sorted files added, modified or removed since the last
+    poll"""
+    changed = []
+    for (dir_path, mtime) in self.dirs.items():
+      try:
+        st = os.stat(dir_path)
+      except OSError:
+        del self.dirs[dir_path]
+        continue
+      if st.st_mtime != mtime:
+        self._scan(dir_path, changed)
+    for (path, stamp) in self.files.items():
+      try:
+        new_stamp = _stamp(os.stat(path))
+      except OSError:
+        del self.files[path]
+        changed.append(path)
+        continue
+      if new_stamp != stamp:
+        self.files[path] = new_stamp
+        changed.append(path)
+    return sorted(set(changed))
+
+  def refresh(self, path):
+    """Takes the current stamp of a file written by us, so that the next poll
+    does not report it"""
+    if path in self.files:
+      try:
+        self.files[path] = _stamp(os.stat(path))
+      except OSError:
+        pass
+
+
+def wait_changes(snapshot,
+                 interval=DEFAULT_INTERVAL,
+                 quiet=DEFAULT_QUIET,
+                 max_delay=DEFAULT_MAX_DELAY,
+                 sleep=time.sleep,
+                 clock=time.time):
+  """Polls until files change, then until no file changed for quiet seconds
+  or max_delay seconds passed since the first change. Returns the sorted
+  changed files."""
+  changed = set()
+  first = last = None
+  while True:
+    new = snapshot.poll()
+    now = clock()
+    if len(new) > 0:
+      changed.update(new)
+      last = now
+      if first is None:
+        first = now
+    if first is not None and (now - last >= quiet or now - first >= max_delay):
+      return sorted(changed)
+    sleep(interval if first is None else min(interval, quiet / 2.0))
+
+
+class PairIndex(object):
+  """The header each watched cc file syncs with"""
+
+  def __init__(self, cc_files=()):
+    self.header_of = {}
+    for cc_file in cc_files:
+      self.update(cc_file)
+
+  def update(self, cc_file):
+    self.header_of.pop(cc_file, None)
+    try:
+      header_file = cpp_refactor.get_header_file(cc_file)
+    except (IOError, OSError, ValueError):
+      return
+    if header_file is not None:
+      self.header_of[cc_file] = header_file
+
+  def affected(self, changed):
+    """Returns a sorted list of [header, cc files] of the pairs changed
+    files belong to, one per header"""
+    changed_headers = set()
+    result = {}
+    for path in changed:
+      if path.endswith(".cc"):
+        self.update(path)
+        if path in self.header_of:
+          result.setdefault(self.header_of[path], set()).add(path)
+      else:
+        changed_headers.add(path)
+    for (cc_file, header_file) in self.header_of.items():
+      if header_file in changed_headers:
+        result.setdefault(header_file, set()).add(cc_file)
+    return sorted([header_file, sorted(cc_files)]
+                  for (header_file, cc_files) in result.items()
+                  if os.path.exists(header_file))
+
+
+# Syncs the cc files of each header with a SyncServer, returns the headers
+# modified
+def sync_pairs(server, snapshot, pairs, verbose=False):
+  modified = []
+  for (header_file, cc_files) in pairs:
+    for cc_file in cc_files:
+      response = server.handle({"cc_file": cc_file, "header_file": header_file})
+      if verbose and response["output"] != "":
+        print "INFO: ==== %s\n%s" % (cc_file, response["output"].rstrip())
+      if response["error"] is not None:
+        print "ERROR:", cc_file, response["error"].strip().splitlines()[-1]
+        continue
+      summary = response["summary"]
+      if summary.get("unchanged"):
+        continue
+      if any(summary[key] > 0 for key in ["changed", "deleted", "added"]):
+        print "INFO: synced %s: changed %d, delete %d, add %d" % (
+            header_file, summary["changed"], summary["deleted"],
+            summary["added"])
+        snapshot.refresh(header_file)
+        if header_file not in modified:
+          modified.append(header_file)
+  return modified
+
+
+def watch(dirs,
+          interval=DEFAULT_INTERVAL,
+          quiet=DEFAULT_QUIET,
+          max_delay=DEFAULT_MAX_DELAY,
+          verbose=False,
+          cache=None):
+  """Syncs the headers of the cc files under dirs as they change, until
+  interrupted"""
+  import cpp_refactor_server
+  server = cpp_refactor_server.SyncServer(cache)
+  snapshot = Snapshot(dirs)
+  pairs = PairIndex(path for path in snapshot.files if path.endswith(".cc"))
+  print "INFO: watching", len(snapshot.files), "files in", len(
+      snapshot.dirs), "directories"
+  while True:
+    changed = wait_changes(snapshot, interval, quiet, max_delay)
+    sync_pairs(server, snapshot, pairs.affected(changed), verbose)
@@ -0,0 +1,95 @@
+"""Tests of source_watch
+"""
+
+import os, unittest
+
+import test_util
+from cpp_refactor_server import SyncServer
+from source_watch import PairIndex, Snapshot, sync_pairs, wait_changes
+
+
+class _ScriptedSnapshot(object):
+
+  def __init__(self, polls):
+    self.polls = list(polls)
+
+  def poll(self):
+    return self.polls.pop(0)
+
+
+class TestAll(test_util.SourceTreeTest):
+
+  def setUp(self):
+    test_util.SourceTreeTest.setUp(self)
+    self.write("google3/b/b.cc", test_util.CC)
+
+  def test_poll(self):
+    snapshot = Snapshot([self.path("google3")])
+    self.assertEqual(
+        sorted(snapshot.files),
+        [self.path("google3/a/a.cc"),
+         self.path("google3/a/a.h"),
+         self.path("google3/b/b.cc")])
+    self.assertEqual(snapshot.poll(), [])
+
+    self.write("google3/a/a.cc", '#include "a/a.h"\nvoid A::f() { }\n')
+    self.write("google3/c/c.cc", "")
+    self.write("google3/c/.c.cc.swp", "")
+    self.write("google3/c/c.txt", "")
+    os.remove(self.path("google3/b/b.cc"))
+    self.assertEqual(snapshot.poll(), [
+        self.path("google3/a/a.cc"),
+        self.path("google3/b/b.cc"),
+        self.path("google3/c/c.cc")
+    ])
+    self.assertEqual(snapshot.poll(), [])
+
+  def test_wait_changes(self):
+    sleeps = []
+    clock = lambda: sum(sleeps)
+    # a burst is synced once nothing changed for quiet seconds
+    snapshot = _ScriptedSnapshot([[], [], ["a.cc"], ["a.h"], [], []])
+    self.assertEqual(
+        wait_changes(snapshot, 0.5, 0.25, 1.0, sleeps.append, clock),
+        ["a.cc", "a.h"])
+    self.assertEqual(sleeps, [0.5, 0.5, 0.125, 0.125, 0.125])
+    # and after max_delay seconds if it goes on
+    del sleeps[:]
+    snapshot = _ScriptedSnapshot([["a.cc"]] * 20)
+    self.assertEqual(
+        wait_changes(snapshot, 0.5, 0.25, 1.0, sleeps.append, clock),
+        ["a.cc"])
+    self.assertEqual(sum(sleeps), 1.0)
+
+  def test_affected(self):
+    pairs = PairIndex([self.path("google3/a/a.cc"),
+                       self.path("google3/b/b.cc")])
+    self.assertEqual(
+        pairs.affected([self.path("google3/a/a.h"),
+                        self.path("google3/a/a.cc")]),
+        [[self.path("google3/a/a.h"),
+          [self.path("google3/a/a.cc"),
+           self.path("google3/b/b.cc")]]])
+    self.write("google3/b/b.cc", '#include "b/b.h"\nvoid A::f() {}\n')
+    self.assertEqual(pairs.affected([self.path("google3/b/b.cc")]), [])
+    self.assertEqual(
+        pairs.affected([self.path("google3/a/a.h")]),
+        [[self.path("google3/a/a.h"), [self.path("google3/a/a.cc")]]])
+
+  def test_sync_pairs(self):
+    snapshot = Snapshot([self.path("google3")])
+    pairs = PairIndex([self.path("google3/a/a.cc")])
+    self.write("google3/a/a.cc",
+               '#include "a/a.h"\nvoid A::f() {}\nint A::g() {}\n')
+    server = SyncServer()
+    self.assertEqual(
+        sync_pairs(server, snapshot, pairs.affected(snapshot.poll())),
+        [self.path("google3/a/a.h")])
+    self.assertTrue("int g();" in self.read("google3/a/a.h"))
+    # the header written is not a change
+    self.assertEqual(snapshot.poll(), [])
+
+
+if __name__ == "__main__":
+
+  unittest.main()
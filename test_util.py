@@ -0,0 +1,38 @@
+"""Fixtures shared by the tests
+"""
+
+import os, shutil, tempfile, unittest
+
+# The files of class A that SourceTreeTest starts with, in sync
+HEADER = "class A {\n public:\n  void f();\n};\n"
+CC = '#include "a/a.h"\nvoid A::f() {}\n'
+
+
+class SourceTreeTest(unittest.TestCase):
+  """Runs each test in a new temporary directory root, holding the header
+  google3/a/a.h of class A and its cc file google3/a/a.cc."""
+
+  def setUp(self):
+    self.root = os.path.realpath(tempfile.mkdtemp())
+    self.header_file = self.path("google3/a/a.h")
+    self.cc_file = self.path("google3/a/a.cc")
+    self.write(self.header_file, HEADER)
+    self.write(self.cc_file, CC)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  # Returns the absolute path of a path relative to root
+  def path(self, path):
+    return os.path.join(self.root, path)
+
+  def write(self, path, text):
+    path = self.path(path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fout:
+      fout.write(text)
+
+  def read(self, path):
+    with open(self.path(path), "r") as fin:
+      return fin.read()